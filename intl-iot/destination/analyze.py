@@ -4,12 +4,13 @@ import argparse
 import os
 import re
 import sys
-from multiprocessing import Process
+import csv
+import multiprocessing
+import shutil
+import tempfile
 import gc
 import time
 
-import pyshark
-
 #from trafficAnalyzer import *  #Import statement below, after package files are checked
 
 __author__ = "Roman Kolcun"
@@ -30,6 +31,7 @@ if DEST_DIR == "":
     DEST_DIR = "."
 
 TRAFFIC_ANA_DIR = DEST_DIR + "/trafficAnalyzer"
+CAPTURE = TRAFFIC_ANA_DIR + "/Capture.py"
 CONSTS = TRAFFIC_ANA_DIR + "/Constants.py"
 DATA_PRES = TRAFFIC_ANA_DIR + "/DataPresentation.py"
 DEV = TRAFFIC_ANA_DIR + "/Device.py"
@@ -45,8 +47,9 @@ GEO_DB_COUNTRY = GEO_DIR + "/GeoLite2-Country.mmdb"
 AUX_DIR = DEST_DIR + "/aux"
 IP_TO_ORG = AUX_DIR + "/ipToOrg.csv"
 IP_TO_COUNTRY = AUX_DIR + "/ipToCountry.csv"
+IP_CACHE = AUX_DIR + "/ipCache.sqlite"
 
-SCRIPTS = [CONSTS, DATA_PRES, DEV, DNS_TRACK, INIT, IP, NODE, STAT, UTIL]
+SCRIPTS = [CAPTURE, CONSTS, DATA_PRES, DEV, DNS_TRACK, INIT, IP, NODE, STAT, UTIL]
 
 RED = "\033[31;1m"
 END = "\033[0m"
@@ -319,33 +322,41 @@ def main():
     if not os.path.isfile(args.out_file):
         DataPresentation.DomainExport.create_csv(args.out_file)
 
-    #Create the groups to run analysis with processes
-    raw_files = [ [] for _ in range(num_proc) ]
-
-    index = 0
-    # Split the pcap files into num_proc groups
+    pcap_files = []
     for root, dirs, files in os.walk(args.in_dir):
         for filename in files:
             if filename.endswith(".pcap") and not filename.startswith("."):
-                raw_files[index].append(root + "/" + filename)
-                index += 1
-                if index >= num_proc:
-                    index = 0
+                pcap_files.append(root + "/" + filename)
+
+    #Largest files first, so a huge capture does not start last and leave the
+    #other workers idle; idle workers take the next file from the queue
+    pcap_files.sort(key=os.path.getsize, reverse=True)
+    jobs = [(idx + 1, len(pcap_files), f) for idx, f in enumerate(pcap_files)]
 
     gc.collect()
 
     print("Analyzing input pcap files...")
-    # run analysis with num_proc processes
-    procs = []
-    for pid, files in enumerate(raw_files):
-        p = Process(target=run, args=(pid, files))
-        procs.append(p)
-        p.start()
-
-    for p in procs:
-        p.join()
-
-    DataPresentation.DomainExport.sort_csv(args.out_file)
+    #Each worker writes its rows to its own shard; the shards are merged into
+    #the output file at the end
+    shard_dir = tempfile.mkdtemp(prefix="shards_", dir=os.path.dirname(os.path.abspath(args.out_file)))
+    #Build (or refresh) the IP to org/country indexes once, before the workers
+    #are forked, so they all map the same files
+    IP.IPTable.open(IP_TO_ORG)
+    IP.IPTable.open(IP_TO_COUNTRY)
+    worker_ids = multiprocessing.Value("i", 0)
+    report = []
+    try:
+        with multiprocessing.Pool(num_proc, init_worker, (worker_ids, shard_dir)) as pool:
+            for entry in pool.imap_unordered(analyze_file, jobs):
+                report.append(entry)
+    finally:
+        #Keep the rows of the files that did finish, even if the run is aborted
+        shards = [os.path.join(shard_dir, f) for f in sorted(os.listdir(shard_dir))]
+        DataPresentation.DomainExport.sort_csv(args.out_file, shards)
+        shutil.rmtree(shard_dir)
+
+    report_file = write_run_report(args.out_file, report)
+    print("Run report written to \"%s\"" % report_file)
 
     end_time = time.time()
     print("\nEnd time: %s" % time.strftime("%A %d %B %Y %H:%M:%S %Z", time.localtime(end_time)))
@@ -364,41 +375,81 @@ def main():
     print("\nDestintaion analysis finished.")
 
 
-def run(pid, pcap_files):
-    files_len = len(pcap_files)
-    for idx, f in enumerate(pcap_files):
-        perform_analysis(pid, idx + 1, files_len, f)
-        gc.collect()
+REPORT_FIELDS = ["input_file", "size_bytes", "worker", "status", "packets", "rows", "seconds"]
+
+worker_pid = 0
+shard_file = ""
+
+
+def init_worker(worker_ids, shard_dir):
+    global worker_pid, shard_file
+    with worker_ids.get_lock():
+        worker_pid = worker_ids.value
+        worker_ids.value += 1
+    shard_file = os.path.join(shard_dir, "shard_%d.csv" % worker_pid)
+    #GeoLite2, reverse DNS and whois results shared by all workers and runs
+    IP.openCache(IP_CACHE)
+
+
+def analyze_file(job):
+    idx, files_len, pcap_file = job
+    start = time.time()
+    try:
+        status, packets, rows = perform_analysis(worker_pid, idx, files_len, pcap_file, shard_file)
+    except Exception as e:
+        #One bad file (IP mapping, GeoLite2 readers, export, ...) must not abort the whole run
+        print("  %sP%s: Error: Analysis of \"%s\" failed: %s: %s. Skipping file.%s"
+              % (RED, worker_pid, pcap_file, type(e).__name__, e, END), file=sys.stderr)
+        status, packets, rows = "error", 0, 0
+    gc.collect()
+    return {"input_file": pcap_file, "size_bytes": os.path.getsize(pcap_file), "worker": worker_pid,
+            "status": status, "packets": packets, "rows": rows, "seconds": round(time.time() - start, 3)}
+
+
+def write_run_report(out_file, report):
+    report_file = out_file[:-4] + "_run_report.csv"
+    with open(report_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(sorted(report, key=lambda r: r["seconds"], reverse=True))
 
+    busy = {}
+    for r in report:
+        busy[r["worker"]] = busy.get(r["worker"], 0) + r["seconds"]
+    failed = sum(1 for r in report if r["status"] != "ok")
+    print("\n%d pcap files analyzed (%d skipped); busy time per worker: %s"
+          % (len(report), failed, ", ".join("P%s %.1fs" % (w, t) for w, t in sorted(busy.items()))))
+    return report_file
 
-def perform_analysis(pid, idx, files_len, pcap_file):
+
+def perform_analysis(pid, idx, files_len, pcap_file, out_file):
+    """ Analyze one pcap and append its rows to out_file.
+    Returns (status, number of packets, number of rows written). """
     print("P%s (%s/%s): Processing pcap file \"%s\"..." % (pid, idx, files_len, pcap_file))
-    cap = pyshark.FileCapture(pcap_file, use_json=True)
-    Utils.sysUsage("PCAP file loading")
-    cap.close()
-    base_ts = 0
+    #One tshark pass gives the frame columns and the DNS answers for host mapping
     try:
-        if args.no_time_shift:
-            cap[0]
-        else:
-            base_ts = float(cap[0].frame_info.time_epoch)
-    except KeyError:
+        cap = Capture.readCapture(pcap_file)
+    except OSError:
+        print("  %sP%s: Error: There is something wrong with \"%s\". Skipping file.%s"
+              % (RED, pid, pcap_file, END), file=sys.stderr)
+        return "error", 0, 0
+    Utils.sysUsage("PCAP file loading")
+    packets = len(cap)
+    if packets == 0:
         print(c.NO_PCKT % pcap_file, file=sys.stderr)
-        return
+        return "no packets", 0, 0
+    base_ts = 0 if args.no_time_shift else cap.time[0]
 
     node_id = Node.NodeId(args.mac_addr, args.ip_addr)
     node_stats = Node.NodeStats(node_id, base_ts, devices)
 
     print("  P%s: Processing packets..." % pid)
     try:
-        for packet in cap:
-            node_stats.processPacket(packet)
+        node_stats.processCapture(cap)
     except:
         print("  %sP%s: Error: There is something wrong with \"%s\". Skipping file.%s"
               % (RED, pid, pcap_file, END), file=sys.stderr)
-        return
-
-    del cap
+        return "error", packets, 0
 
     Utils.sysUsage("Packets processed")
 
@@ -406,9 +457,11 @@ def perform_analysis(pid, idx, files_len, pcap_file):
     ip_map = IP.IPMapping()
     if args.hosts_dir != "":
         host_file = args.hosts_dir + "/" + os.path.basename(pcap_file)[:-4] + "txt"
-        ip_map.extractFromFile(pcap_file, host_file)
+        ip_map.extractFromCapture(cap, host_file)
     else:
-        ip_map.extractFromFile(pcap_file)
+        ip_map.extractFromCapture(cap)
+
+    del cap
 
     ip_map.loadOrgMapping(IP_TO_ORG)
     ip_map.loadCountryMapping(IP_TO_COUNTRY)
@@ -419,7 +472,7 @@ def perform_analysis(pid, idx, files_len, pcap_file):
     de = DataPresentation.DomainExport(node_stats.stats.stats, ip_map, GEO_DB_CITY, GEO_DB_COUNTRY)
     de.loadDiffIPFor("eth") if args.find_diff else de.loadIPFor("eth")
     de.loadDomains(args.dev, args.lab, args.experiment, args.network, pcap_file, str(base_ts))
-    de.exportDataRows(args.out_file)
+    de.exportDataRows(out_file)
 
     print("  P%s: Analyzed data from \"%s\" successfully written to \"%s\""
           % (pid, pcap_file, args.out_file))
@@ -434,6 +487,8 @@ def perform_analysis(pid, idx, files_len, pcap_file):
 
         Utils.sysUsage("Plots generated")
 
+    return "ok", packets, len(de.dataRows)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,75 @@
+import subprocess
+from array import array
+
+from . import DNSTracker
+
+
+FIELDS = ["frame.time_epoch", "frame.len", "eth.src", "eth.dst", "eth.len", "ip.src", "ip.dst",
+          "dns.flags.response", "dns.qry.name", "dns.qry.type", "dns.resp.name", "dns.resp.type",
+          "dns.a", "dns.aaaa"]
+
+
+class Capture(object):
+    """ One pcap decoded by a single "tshark -T fields" pass: per-frame columns
+    for the node statistics and the DNS answers for the IP to host mapping.
+    Addresses are interned, so repeated MACs and IPs share one string. """
+
+    def __init__(self, pcap_file):
+        self.pcapFile = pcap_file
+        self.time = array('d')
+        self.length = array('q')
+        self.ethLen = array('q')  # -1 when the frame has no eth.len field
+        self.ethSrc = []
+        self.ethDst = []
+        self.ipSrc = []
+        self.ipDst = []
+        self.dns = DNSTracker.Tracker()
+        self.strings = {}
+
+    def __len__(self):
+        return len(self.time)
+
+    def intern(self, value):
+        if not value:
+            return None
+        return self.strings.setdefault(value, value)
+
+    def addFrame(self, cols):
+        (ts, length, eth_src, eth_dst, eth_len, ip_src, ip_dst,
+         response, qry_name, qry_type, resp_names, resp_types, a_addrs, aaaa_addrs) = cols
+        self.time.append(float(ts))
+        self.length.append(int(length))
+        self.ethLen.append(int(eth_len.split(",")[0], 0) if eth_len else -1)
+        # tunnelled frames repeat the layers; the outer one is what pyshark reported
+        self.ethSrc.append(self.intern(eth_src.split(",")[0]))
+        self.ethDst.append(self.intern(eth_dst.split(",")[0]))
+        self.ipSrc.append(self.intern(ip_src.split(",")[0]))
+        self.ipDst.append(self.intern(ip_dst.split(",")[0]))
+
+        if response.split(",")[0] in ("1", "True") and (a_addrs or aaaa_addrs):
+            self.dns.addResponse(qry_name.split(",")[0], int(qry_type.split(",")[0] or 0),
+                                 resp_names.split(","), [int(t) for t in resp_types.split(",") if t],
+                                 a_addrs.split(",") if a_addrs else [],
+                                 aaaa_addrs.split(",") if aaaa_addrs else [])
+
+
+def readCapture(pcap_file, tshark="tshark"):
+    command = [tshark, "-n", "-r", pcap_file, "-T", "fields", "-E", "separator=/t", "-E", "occurrence=a"]
+    for field in FIELDS:
+        command += ["-e", field]
+
+    capture = Capture(pcap_file)
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        for line in proc.stdout:
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) == len(FIELDS):
+                capture.addFrame(cols)
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+    if proc.returncode != 0 and len(capture) == 0:
+        raise OSError("tshark could not read %s" % pcap_file)
+
+    return capture
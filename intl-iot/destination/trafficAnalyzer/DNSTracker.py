@@ -1,6 +1,52 @@
+A_RECORD = 1
+AAAA_RECORD = 28
+
+
 class Tracker(object):
+    """ A/AAAA answers of the DNS responses in a capture.
+
+    hosts holds ip -> owner names of the address records in first-seen order,
+    which is what "tshark -q -z hosts" reports. queries holds ip -> (query
+    name, names in the response) for every A query that resolved to the ip,
+    so the name that was actually asked for can be found for a host without
+    rescanning the packet summaries. """
+
     def __init__(self):
-        pass
+        self.hosts = {}
+        self.queries = {}
+
+    def addResponse(self, qry_name, qry_type, resp_names, resp_types, a_addrs, aaaa_addrs):
+        a_addrs = iter(a_addrs)
+        aaaa_addrs = iter(aaaa_addrs)
+        records = []
+        for name, rtype in zip(resp_names, resp_types):
+            if rtype == A_RECORD:
+                ip = next(a_addrs, None)
+            elif rtype == AAAA_RECORD:
+                ip = next(aaaa_addrs, None)
+            else:
+                continue
+            if ip is not None:
+                records.append((name, ip))
+
+        names = frozenset(resp_names) | {qry_name}
+        for name, ip in records:
+            owners = self.hosts.setdefault(ip, [])
+            if name not in owners:
+                owners.append(name)
+            if qry_type == A_RECORD:
+                self.queries.setdefault(ip, []).append((qry_name, names))
+
+    def hostPairs(self):
+        """ (ip, host) pairs in the order "tshark -z hosts" would list them. """
+        return [(ip, host) for ip, hosts in self.hosts.items() for host in hosts]
+
+    def getCorrectHost(self, host, ip):
+        """ Name queried in the first A response that resolved host to ip. """
+        for qry_name, names in self.queries.get(ip, ()):
+            if host in names:
+                return qry_name
+        return None
 
 
 class Record(object):
@@ -401,11 +401,18 @@ class DomainExport(DataPresentation):
             f.write("ts,device,ip,host,host_full,traffic_snd,traffic_rcv,packet_snd,"
                     "packet_rcv,country,party,lab,experiment,network,input_file,organization\n")
 
-    def sort_csv(output_file):
-        reader = csv.reader(open(output_file))
-        header = next(reader)
+    def sort_csv(output_file, shards=()):
+        """ Sort the rows of output_file, first merging in the header-less
+        rows of the given per-worker shard files. """
+        with open(output_file) as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            rows = list(reader)
+        for shard in shards:
+            with open(shard) as f:
+                rows.extend(csv.reader(f))
         csv_data = ",".join(header) + "\n"
-        sorted_list = sorted(reader)
+        sorted_list = sorted(rows)
         csv_data = csv_data + "\n".join([",".join(r) for r in sorted_list]) + "\n"
         with open(output_file, "w") as f:
             f.write(csv_data)
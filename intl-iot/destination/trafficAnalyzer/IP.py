@@ -1,26 +1,116 @@
 import datetime
+import ipaddress
 import json
 import operator
 import os
+import shutil
 import socket
+import sqlite3
+import struct
 import subprocess
+import tempfile
+import time
 import urllib.request
+from collections import OrderedDict
 
 import geoip2.database
 import mysql.connector
+import numpy as np
 import pandas as pd
 import tldextract
 import whois
 
 
+DAY = 24 * 3600
+
+
+class IPCache(object):
+    """ Memoizes IP lookups keyed by (ip, method).
+
+    An in-process LRU sits in front of an optional SQLite file shared by all
+    analysis processes (WAL mode, so readers never block the writer). Every
+    entry expires after the TTL of its method; lookups that found nothing are
+    cached too, with the shorter NEGATIVE_TTL. """
+
+    TTL = {"geo": 30 * DAY, "host": 7 * DAY, "whois": 30 * DAY}
+    NEGATIVE_TTL = DAY
+    LRU_SIZE = 65536
+
+    def __init__(self, file_name=None, lru_size=LRU_SIZE):
+        self.fileName = file_name
+        self.lru = OrderedDict()
+        self.lruSize = lru_size
+        self.db = None
+        if file_name is not None:
+            self.db = sqlite3.connect(file_name, timeout=60, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS lookups (ip TEXT, method TEXT, value TEXT, found INTEGER,"
+                            " expires REAL, PRIMARY KEY (ip, method)) WITHOUT ROWID")
+
+    def remember(self, key, value, expires):
+        self.lru[key] = (value, expires)
+        self.lru.move_to_end(key)
+        if len(self.lru) > self.lruSize:
+            self.lru.popitem(last=False)
+
+    def lookup(self, ip, method, compute, found=lambda value: value != "N/A"):
+        """ Cached compute(ip); found(value) tells a hit from a negative result. """
+        key = (ip, method)
+        now = time.time()
+        entry = self.lru.get(key)
+        if entry is not None and entry[1] > now:
+            self.lru.move_to_end(key)
+            return entry[0]
+
+        if self.db is not None:
+            row = self.db.execute("SELECT value, expires FROM lookups WHERE ip = ? AND method = ?", key).fetchone()
+            if row is not None and row[1] > now:
+                value = json.loads(row[0])
+                value = tuple(value) if isinstance(value, list) else value
+                self.remember(key, value, row[1])
+                return value
+
+        value = compute(ip)
+        is_found = bool(found(value))
+        expires = now + (self.TTL.get(method, DAY) if is_found else self.NEGATIVE_TTL)
+        self.remember(key, value, expires)
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO lookups VALUES (?, ?, ?, ?, ?)",
+                            (ip, method, json.dumps(value), int(is_found), expires))
+        return value
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+_cache = IPCache()
+
+
+def openCache(file_name):
+    """ Use file_name as the shared on-disk cache for every IPResolver of
+    this process (call once per process, after fork). """
+    global _cache
+    _cache.close()
+    _cache = IPCache(file_name)
+    return _cache
+
+
 class IPResolver(object):
-    def __init__(self, ipMapping, geoDbCity, geoDbCountry):
+    def __init__(self, ipMapping, geoDbCity, geoDbCountry, cache=None):
         self.ipCity = geoip2.database.Reader(geoDbCity)
         self.ipCountry = geoip2.database.Reader(geoDbCountry)
         self.ipMap = ipMapping
+        self.cache = cache if cache is not None else _cache
+        self.domains = {}
         #self.ripeProbe = RipeProbe() #RipeCountry argument to the -l option, commented out because SQL database missing
 
     def getCountryAndCity(self, ip):
+        return self.cache.lookup(ip, "geo", self.lookupCountryAndCity, lambda v: v[0] != "N/A")
+
+    def lookupCountryAndCity(self, ip):
         try:
             resp = self.ipCity.city(ip)
             return resp.country.iso_code, resp.subdivisions.most_specific.name, resp.city.name
@@ -28,6 +118,9 @@ class IPResolver(object):
             return "N/A", "", ""
       
     def getHostByAddr(self, ip):
+        return self.cache.lookup(ip, "host", self.lookupHostByAddr, lambda v: v[0] != "N/A")
+
+    def lookupHostByAddr(self, ip):
         try: 
             host_name, alias_list, ip_addr_list = socket.gethostbyaddr(ip)
             host_name = self.extractDomain(host_name)
@@ -36,7 +129,13 @@ class IPResolver(object):
             return "N/A", [], []
 
     def getWhois(self, ip):
-        w = whois.whois(ip)
+        return self.cache.lookup(ip, "whois", self.lookupWhois)
+
+    def lookupWhois(self, ip):
+        try:
+            w = whois.whois(ip)
+        except Exception:
+            return "N/A"
         if isinstance(w.domain_name, (list,)):
             return w.domain_name[0].lower()
     
@@ -63,8 +162,10 @@ class IPResolver(object):
         elif self.isIPAddr(host_name):
             return host_name
 
-        ext = tldextract.extract(host_name)
-        return "{}.{}".format(ext.domain, ext.suffix)
+        if host_name not in self.domains:
+            ext = tldextract.extract(host_name)
+            self.domains[host_name] = "{}.{}".format(ext.domain, ext.suffix)
+        return self.domains[host_name]
 
     def splitIPBy(self, ip_dict, method, data=None):
         if data is None:
@@ -309,6 +410,30 @@ class IPMapping(object):
             except ValueError:
                 pass 
 
+    def extractFromCapture(self, capture, host_file=""):
+        """ extractFromFile over a Capture.Capture: the hosts and the DNS
+        answers used to correct them come from the single tshark pass, and
+        the correction is a dictionary lookup per host. """
+        if host_file == "" or not os.path.isfile(host_file) or not os.access(host_file, os.R_OK):
+            pairs = capture.dns.hostPairs()
+        else:
+            pairs = []
+            with open(host_file) as f:
+                for host_line in f:
+                    try:
+                        ip, host = host_line.strip().split("\t")
+                    except ValueError:
+                        continue
+                    pairs.append((ip, host))
+
+        for ip, host in pairs:
+            #Get the correct host name
+            tmp_host = capture.dns.getCorrectHost(host, ip)
+            if tmp_host is not None:
+                host = tmp_host
+
+            self.addHostIP(host.strip(), ip)
+
     def addHostIP(self, host, ip):
         if ip not in self.ip:
             self.ip[ip] = []
@@ -329,27 +454,183 @@ class IPMapping(object):
         return ["N/A"]
 
     def loadOrgMapping(self, file_name):
-        self.orgMapping = pd.read_csv(file_name)
+        self.orgMapping = IPTable.open(file_name)
 
     def loadCountryMapping(self, file_name):
-        self.countryMapping = pd.read_csv(file_name)
+        self.countryMapping = IPTable.open(file_name)
 
     def getOrg(self, ip, column = "org"):
-        org = self.orgMapping[self.orgMapping['ip'] == ip]
-        if org.empty:
+        row = self.orgMapping.find(ip)
+        if row < 0:
             return "N/A"
-        return org.iloc[0][column]
+        return self.orgMapping.value(row, column)
 
     def getCountry(self, ip):
-        country = self.countryMapping[self.countryMapping['ip'] == ip]
+        row = self.countryMapping.find(ip)
 
-        if country.empty:
+        if row < 0:
             country = self.getOrg(ip, 'country')
             if country != "None":
                 return country
             return "N/A"
 
-        return country.iloc[0]['country']
+        return self.countryMapping.value(row, 'country')
+
+
+class IPTable(object):
+    """ Read-only index over an "ip,..." CSV such as aux/ipToOrg.csv.
+
+    The table is compiled once into FILE.index/: an open-addressing hash
+    table of IPv4 addresses (exact matches, O(1)), a sorted array of
+    (prefix length, network) keys for CIDR rows (longest-prefix match, one
+    binary search per prefix length present) and the other columns as
+    fixed-width arrays. All of them are .npy files opened with mmap, so every
+    analysis process shares the same pages. The index is rebuilt when the CSV
+    changes. Rows are looked up the way the pandas scan did: the first row
+    for an IP wins, and cells pandas reads as NaN are returned as NaN. """
+
+    EMPTY = -1
+    _tables = {}
+
+    def __init__(self, file_name):
+        self.fileName = file_name
+        self.indexDir = file_name + ".index"
+        if not self.isFresh():
+            self.build()
+        self.load()
+
+    @classmethod
+    def open(cls, file_name):
+        """ One IPTable per CSV and process. """
+        key = os.path.abspath(file_name)
+        if key not in cls._tables:
+            cls._tables[key] = cls(file_name)
+        return cls._tables[key]
+
+    def source(self):
+        st = os.stat(self.fileName)
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def isFresh(self):
+        try:
+            with open(os.path.join(self.indexDir, "meta.json")) as f:
+                return json.load(f)["source"] == self.source()
+        except (OSError, ValueError, KeyError):
+            return False
+
+    @staticmethod
+    def hashSlot(key, mask):
+        return (key * 2654435761) & mask
+
+    def build(self):
+        source = self.source()
+        df = pd.read_csv(self.fileName)
+        columns = [col for col in df.columns if col != "ip"]
+
+        exact, prefixes, other = {}, {}, {}
+        for row, ip in enumerate(df["ip"].astype(str)):
+            ip = ip.strip()
+            try:
+                if "/" in ip:
+                    net = ipaddress.ip_network(ip, strict=False)
+                    if net.version == 4:
+                        prefixes.setdefault((net.prefixlen << 32) | int(net.network_address), row)
+                        continue
+                else:
+                    exact.setdefault(struct.unpack("!I", socket.inet_pton(socket.AF_INET, ip))[0], row)
+                    continue
+            except (OSError, ValueError):
+                pass
+            other.setdefault(ip, row)
+
+        size = 1 << max(4, (2 * len(exact)).bit_length())
+        keys = np.zeros(size, dtype=np.uint32)
+        rows = np.full(size, self.EMPTY, dtype=np.int32)
+        for key, row in exact.items():
+            slot = self.hashSlot(key, size - 1)
+            while rows[slot] != self.EMPTY:
+                slot = (slot + 1) & (size - 1)
+            keys[slot] = key
+            rows[slot] = row
+
+        prefix_keys = np.array(sorted(prefixes), dtype=np.uint64)
+        arrays = {
+            "hash_keys": keys,
+            "hash_rows": rows,
+            "prefix_keys": prefix_keys,
+            "prefix_rows": np.array([prefixes[k] for k in prefix_keys.tolist()], dtype=np.int32),
+        }
+        for i, col in enumerate(columns):
+            na = df[col].isna().to_numpy()
+            arrays["col%d" % i] = np.array(df[col].astype(object).where(~na, "").astype(str).tolist(), dtype=str)
+            arrays["col%d_na" % i] = na
+
+        tmp_dir = tempfile.mkdtemp(prefix=os.path.basename(self.indexDir) + ".", dir=os.path.dirname(self.indexDir) or ".")
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp_dir, name + ".npy"), arr)
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump({"source": source, "columns": columns, "other": other,
+                       "prefix_lens": sorted({k >> 32 for k in prefixes}, reverse=True)}, f)
+
+        #Swap the finished index in; if another process got there first, keep theirs
+        old_dir = None
+        if os.path.isdir(self.indexDir):
+            old_dir = tempfile.mkdtemp(dir=os.path.dirname(self.indexDir) or ".")
+            try:
+                os.replace(self.indexDir, os.path.join(old_dir, "index"))
+            except OSError:
+                pass
+        try:
+            os.replace(tmp_dir, self.indexDir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        if old_dir is not None:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    def load(self):
+        with open(os.path.join(self.indexDir, "meta.json")) as f:
+            meta = json.load(f)
+        def array(name):
+            return np.load(os.path.join(self.indexDir, name + ".npy"), mmap_mode="r")
+        self.hashKeys = array("hash_keys")
+        self.hashRows = array("hash_rows")
+        self.mask = len(self.hashKeys) - 1
+        self.prefixKeys = array("prefix_keys")
+        self.prefixRows = array("prefix_rows")
+        self.prefixLens = meta["prefix_lens"]
+        self.other = meta["other"]
+        self.columns = {col: (array("col%d" % i), array("col%d_na" % i)) for i, col in enumerate(meta["columns"])}
+
+    def find(self, ip):
+        """ Row of the exact IP, else of the longest matching prefix, else -1. """
+        try:
+            key = struct.unpack("!I", socket.inet_pton(socket.AF_INET, ip))[0]
+        except (OSError, TypeError):
+            return self.other.get(ip, self.EMPTY)
+
+        slot = self.hashSlot(key, self.mask)
+        while True:
+            row = int(self.hashRows[slot])
+            if row == self.EMPTY:
+                break
+            if int(self.hashKeys[slot]) == key:
+                return row
+            slot = (slot + 1) & self.mask
+
+        for plen in self.prefixLens:
+            net = key & ((0xFFFFFFFF << (32 - plen)) & 0xFFFFFFFF)
+            wanted = (plen << 32) | net
+            i = int(np.searchsorted(self.prefixKeys, np.uint64(wanted)))
+            if i < len(self.prefixKeys) and int(self.prefixKeys[i]) == wanted:
+                return int(self.prefixRows[i])
+
+        return self.EMPTY
+
+    def value(self, row, column):
+        values, na = self.columns[column]
+        if na[row]:
+            return np.nan
+        return str(values[row])
 
 
 class UndefinedMethodError(Exception):
@@ -1,5 +1,7 @@
 from collections import defaultdict
 
+import numpy as np
+
 from . import Stats
 from . import Constants
 
@@ -46,6 +48,40 @@ class NodeStats(object):
             stats = self.stats.getStats(layer.layer_name, dir2)
             stats.processLayer(packet, layer)
 
+    def processCapture(self, capture):
+        """ Same statistics as calling processPacket on every frame, computed
+        from the columns of a Capture.Capture (only the eth layer is tracked,
+        see extractLayers). """
+        if Constants.Layer.ETH not in self.layersToProcess:
+            return
+        if any(mac is None for mac in capture.ethSrc):
+            raise ValueError("%s has frames without an Ethernet header" % capture.pcapFile)
+
+        times = np.array(capture.time, dtype=np.float64)
+        lengths = np.array(capture.length, dtype=np.int64)
+        eth_len = np.array(capture.ethLen, dtype=np.int64)
+        sizes = np.where(eth_len >= 0, eth_len, lengths)
+
+        # frames sent by the node are "snd" and attributed to the destination,
+        # everything else is "rcv" and attributed to the source
+        sent = np.array([mac == self.nodeId.mac for mac in capture.ethSrc], dtype=bool)
+        names = {}
+        addrs = []
+        for is_sent, e_src, e_dst, i_src, i_dst in zip(sent.tolist(), capture.ethSrc, capture.ethDst,
+                                                        capture.ipSrc, capture.ipDst):
+            key = (e_dst, i_dst) if is_sent else (e_src, i_src)
+            if key not in names:
+                addr = NodeId(key[0], key[1])
+                addr.deviceName = self.devices.getDeviceName(key[0])
+                names[key] = addr.getAddr()
+            addrs.append(names[key])
+        addrs = np.array(addrs, dtype=object)
+
+        for mask, direction in ((sent, Constants.Direction.SND), (~sent, Constants.Direction.RCV)):
+            if mask.any():
+                stats = self.stats.getStats(Constants.Layer.ETH, direction)
+                stats.processLayers(times[mask], lengths[mask], addrs[mask], sizes=sizes[mask])
+
     def extractLayers(self):
         layers = defaultdict(int)
         layers['eth'] += 1
@@ -1,3 +1,5 @@
+from array import array
+
 import numpy as np
 from . import Constants
 
@@ -21,20 +23,33 @@ class Stats(object):
 
 
 class StatsData(object):
+    """ Per-layer, per-direction statistics. Packet times and sizes are kept in
+    typed arrays and addresses/ports as interned ids, so a layer costs a few
+    bytes per packet instead of several Python objects. The attributes read by
+    DataPresentation (packetTS/packetSize as arrays, addrpcktnum/addrpcktsize
+    as dicts, ...) are built from the arrays when they are read. """
+
+    LENGTH_FIELDS = ('len', 'data_len', 'length')
+
     def __init__(self, node, layer_name, direction):
         self.node = node
         self.layerName = layer_name
         self.direction = direction
         self.packets = []
-        self.packetTS = []
-        self.packetDiff = []
-        self.packetSize = []
-        self.addrpcktnum = {}
-        self.addrpcktsize = {}
-        self.srcPort = {}
-        self.destPort = {}
+        self._ts = array('d')
+        self._diff = array('d')
+        self._size = array('q')
+        self._frameLen = array('q')
+        self._addr = array('l')
+        self._srcPort = array('l')
+        self._destPort = array('l')
+        self.addrs = Interner()
+        self.srcPorts = Interner()
+        self.destPorts = Interner()
         self.flags = []
         self.options = []
+        # dict views built from the arrays, dropped whenever packets are added
+        self._views = {}
 
     def increaseCount(self, _dict, key, val = 1):
         if key not in _dict:
@@ -45,31 +60,47 @@ class StatsData(object):
     def processLayer(self, packet, layer):
         """ Currently it is not needed to store all packets """
         #self.packets.append(layer)
+        self._views.clear()
         time = float(packet.frame_info.time_epoch) - self.node.baseTS
-        self.packetTS.append(time)
-        try:
-            self.packetDiff.append(time - self.packetTS[-2])
-        except IndexError:
-            self.packetDiff.append(0)
-  
-        length = self.getDataLength(layer)
-        if length >= 0:
-            self.packetSize.append(length)
-        else:
-            self.packetSize.append(packet.length)
-    
-        self.increaseCount(self.addrpcktnum, packet.addr.getAddr())
-        self.increaseCount(self.addrpcktsize, packet.addr.getAddr(), packet.length)
-    
+        self._diff.append(time - self._ts[-1] if self._ts else 0)
+        self._ts.append(time)
+
+        field_names = layer.field_names
+        length = self.getDataLength(layer, field_names)
+        self._size.append(length if length >= 0 else int(packet.length))
+        self._frameLen.append(int(packet.length))
+        self._addr.append(self.addrs.id(packet.addr.getAddr()))
+
         if self.layerHasPort(layer):
-            self.increaseCount(self.srcPort, layer.srcport)
-            self.increaseCount(self.destPort, layer.dstport)
-    
-        if 'flags' in layer.field_names:
+            self._srcPort.append(self.srcPorts.id(layer.srcport))
+            self._destPort.append(self.destPorts.id(layer.dstport))
+
+        if 'flags' in field_names:
             self.flags.append(layer.flags)
-        if 'options' in layer.field_names:
+        if 'options' in field_names:
             self.options.append(layer.options)
 
+    def processLayers(self, times, lengths, addrs, sizes=None, src_ports=None, dst_ports=None):
+        """ Batch version of processLayer for columns of already decoded
+        packets: epoch times, frame lengths, addresses (as NodeId.getAddr()
+        returns them), optionally the layer's data lengths (frame length
+        when omitted) and source/destination ports. """
+        times = np.asarray(times, dtype=np.float64) - self.node.baseTS
+        if len(times) == 0:
+            return
+        self._views.clear()
+        lengths = np.asarray(lengths, dtype=np.int64)
+        sizes = lengths if sizes is None else np.asarray(sizes, dtype=np.int64)
+        diff = np.diff(times, prepend=self._ts[-1] if self._ts else times[0])
+        self._ts.frombytes(times.tobytes())
+        self._diff.frombytes(diff.tobytes())
+        self._size.frombytes(sizes.tobytes())
+        self._frameLen.frombytes(lengths.tobytes())
+        self._addr.extend(map(self.addrs.id, addrs))
+        if src_ports is not None:
+            self._srcPort.extend(map(self.srcPorts.id, src_ports))
+            self._destPort.extend(map(self.destPorts.id, dst_ports))
+
     def getOtherAddr(self, layer):
         try:
             if self.direction == Constants.Direction.SND:
@@ -83,20 +114,80 @@ class StatsData(object):
             return True
         return False
 
-    def getDataLength(self, layer):
-        intersect = list(set(layer.field_names) & {'len', 'data_len', 'length'})
-        if len(intersect) == 1:
-            return int(getattr(layer, intersect[0]), 0)
-        elif len(intersect) > 1:
-            #print("intersect:",intersect, layer.field_names, layer.layer_name)
-            return int(getattr(layer, intersect[0]), 0)
-        else:
-            return -1
+    def getDataLength(self, layer, field_names=None):
+        if field_names is None:
+            field_names = layer.field_names
+        for name in self.LENGTH_FIELDS:
+            if name in field_names:
+                return int(getattr(layer, name), 0)
+        return -1
+
+    # copies, so the typed arrays stay resizable while views are held
+    @property
+    def packetTS(self):
+        return np.array(self._ts, dtype=np.float64)
+
+    @property
+    def packetDiff(self):
+        return np.array(self._diff, dtype=np.float64)
+
+    @property
+    def packetSize(self):
+        return np.array(self._size, dtype=np.int64)
+
+    def countBy(self, ids, interner, weights=None):
+        """ {value: number of packets} (or sum of weights) per interned id,
+        in first-seen order. """
+        ids = np.array(ids, dtype=np.int64)
+        if weights is not None:
+            weights = np.array(weights, dtype=np.float64)
+        counts = np.bincount(ids, weights=weights, minlength=len(interner)).astype(np.int64)
+        return dict(zip(interner.values, counts.tolist()))
+
+    def cached(self, name, compute):
+        if name not in self._views:
+            self._views[name] = compute()
+        return self._views[name]
+
+    @property
+    def addrpcktnum(self):
+        return self.cached('addrpcktnum', lambda: self.countBy(self._addr, self.addrs))
+
+    @property
+    def addrpcktsize(self):
+        return self.cached('addrpcktsize', lambda: self.countBy(self._addr, self.addrs, self._frameLen))
+
+    @property
+    def srcPort(self):
+        return self.cached('srcPort', lambda: self.countBy(self._srcPort, self.srcPorts))
+
+    @property
+    def destPort(self):
+        return self.cached('destPort', lambda: self.countBy(self._destPort, self.destPorts))
 
     def __str__(self):
         return "addr: {}".format(self.srcPort)
 
 
+class Interner(object):
+    """ Maps hashable values to dense integer ids in first-seen order. """
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def id(self, value):
+        try:
+            return self.ids[value]
+        except KeyError:
+            self.ids[value] = len(self.values)
+            self.values.append(value)
+            return self.ids[value]
+
+    def __len__(self):
+        return len(self.values)
+
+
 class StatsMerge(object):
     def __init__(self):
         pass
@@ -109,7 +200,7 @@ class StatsMerge(object):
             y_dict_list.append(dict(zip(x1, y1)))
 
         y_dict_list.append(dict(zip(x2, y2)))
-        x = sorted(x1 + x2)
+        x = sorted(list(x1) + list(x2))
     
         for xVal in x:
             for i, yDict in enumerate(y_dict_list):
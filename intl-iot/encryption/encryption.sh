@@ -150,9 +150,9 @@ run_pipeline() {
     if [[ "$ek_json" == "/dev/null" ]]; then
         echo -e "\nJSON generation skipped - processing packets directly..."
         
-        # Process packets directly with tshark and pipe to Python
-        # This avoids creating any intermediate files
-        tshark -r "$in_pcap" -T ek -x | python3 -W ignore "$shrink_comp" /dev/stdin "$out_csv"
+        # shrink_compute runs tshark with only the fields it needs and
+        # parses its output from the pipe, so no intermediate file is written
+        python3 -W ignore "$shrink_comp" --pcap "$in_pcap" "$out_csv"
         check_ret_code $? "TShark + Python pipeline"
         
     else
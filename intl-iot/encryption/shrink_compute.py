@@ -6,12 +6,15 @@ Updated by Derek Ng in 2020
 
 CSVFILE: ip_src,ip_dst,srcport,dstport,tp_proto,data_proto,data_type,data_len,entropy_shannon,entropy_renyi,entropy_tsallis,reason
 """
+import binascii
 import json
 import math
 import os
+import subprocess
 import sys
 import traceback
-from collections import Counter  # <-- added
+
+import numpy as np
 
 SUFIX_RAW = '_raw'
 LAYER_TCP = 'tcp'
@@ -70,6 +73,14 @@ list_compressed = ['gzip', 'tar']
 If save to a smaller JSON file, by default is False
 """
 saveSmaller = False
+"""
+Entropy is computed over the raw payload octets. Set legacyDecode to True
+(or pass --legacy-decode) to reproduce the published numbers, which decoded
+the payload to a UTF-8 string first and dropped the invalid bytes, and took
+the UDP payload as frame_raw past a fixed 42-byte header instead of the
+dissected udp.payload (wrong with VLAN tags or IP options).
+"""
+legacyDecode = False
 TH_DATA_LEN_EMPTY = 4
 TH_DATA_LEN_OMIT = 20
 TH_DATA_LEN_MEANINGFUL = 100
@@ -77,22 +88,60 @@ TH_HIGH = 0.9
 TH_LOW = 0.4
 TH_ENCRYPTED = 0.8
 
+JSON_BACKENDS = ('simdjson', 'orjson', 'json')
+
+"""
+tshark fields read in --pcap mode: (layer, EK field name, tshark field).
+They are mapped back onto the EK layout so compute_pkt is shared by both modes.
+"""
+TSHARK_FIELDS = [
+    ('frame', 'frame_frame_time_epoch', 'frame.time_epoch'),
+    ('frame', 'frame_frame_protocols', 'frame.protocols'),
+    ('ip', 'ip_ip_src', 'ip.src'),
+    ('ip', 'ip_ip_dst', 'ip.dst'),
+    ('tcp', 'tcp_tcp_srcport', 'tcp.srcport'),
+    ('tcp', 'tcp_tcp_dstport', 'tcp.dstport'),
+    ('tcp', 'tcp_tcp_len', 'tcp.len'),
+    ('tcp', 'tcp_tcp_payload_raw', 'tcp.payload'),
+    ('udp', 'udp_udp_srcport', 'udp.srcport'),
+    ('udp', 'udp_udp_dstport', 'udp.dstport'),
+    ('udp', 'udp_udp_payload_raw', 'udp.payload'),
+    ('http', 'http_http_content_encoding', 'http.content_encoding'),
+    ('http', 'http_http_content_type', 'http.content_type'),
+    ('ssl', 'ssl_handshake_text', 'tls.handshake.type'),
+    ('dns', 'text_dns_dnskey_protocol', 'dns.dnskey.protocol'),
+]
+HEX_FIELDS = ('tcp_tcp_payload_raw', 'udp_udp_payload_raw')
+
+WRITE_BUFFER = 1 << 20
+FLUSH_EVERY = 10000
+
 RED = "\033[31;1m"
 END = "\033[0m"
 path = sys.argv[0]
 
 usage_stm = """
-Usage: python3 {prog_name} in_json out_csv
+Usage: python3 {prog_name} [--legacy-decode] [--json-backend=NAME] in_json out_csv
+       python3 {prog_name} [--legacy-decode] --pcap in_pcap out_csv
 
 Uses the intermediate JSON file to output a CSV file that includes the entropy
 of each packet and its classification (encrypted, text, media, unknown).
 
 Example: python3 {prog_name} sample.json sample.csv
+         python3 {prog_name} --pcap sample.pcap sample.csv
 
 Arguments:
   in_json: path to the output JSON file created from running TShark on a pcap file
   out_csv: path to the CSV file to write the results to
 
+Options:
+  --legacy-decode: count UTF-8 characters instead of raw bytes and take UDP
+      payloads at a fixed frame offset (old behavior)
+  --json-backend=NAME: one of auto, simdjson, orjson, json (default: auto,
+      the fastest one installed)
+  --pcap: read a pcap directly; tshark is run with only the fields needed
+      and its output is parsed from the pipe, no intermediate JSON is written
+
 Note:
  - If the output CSV file does not current exist, it will be generated by the script.
 
@@ -106,24 +155,53 @@ def print_usage(is_error):
 
 
 def main():
+    global legacyDecode, json_backend, json_loads
+    pcap_mode = False
     for arg in sys.argv:
         if arg in ("-h", "--help"):
             print_usage(0)
 
     print("Running %s..." % path)
 
-    if len(sys.argv) != 3:
+    args = []
+    for arg in sys.argv[1:]:
+        if arg == "--legacy-decode":
+            legacyDecode = True
+        elif arg == "--pcap":
+            pcap_mode = True
+        elif arg.startswith("--json-backend="):
+            try:
+                json_backend, json_loads = get_json_decoder(arg.split("=", 1)[1])
+            except ValueError as e:
+                print("%s%s: Error: %s%s" % (RED, path, e, END), file=sys.stderr)
+                print_usage(1)
+        else:
+            args.append(arg)
+
+    if len(args) != 2:
         print("%s%s: Error: 2 arguments expected. %s arguments found.%s"
-              % (RED, path, (len(sys.argv) - 1), END), file=sys.stderr)
+              % (RED, path, len(args), END), file=sys.stderr)
         print_usage(0)
 
-    jsonfile = sys.argv[1]
-    csvfile = sys.argv[2]
+    jsonfile = args[0]
+    csvfile = args[1]
 
+    if pcap_mode:
+        if not os.path.isfile(jsonfile):
+            print("%s%s: Error: The file \"%s\" does not exist.%s"
+                  % (RED, path, jsonfile, END), file=sys.stderr)
+            print_usage(1)
+        print("Computing entropy of \"%s\" through tshark..." % jsonfile)
+        n_rows, ret = run_tshark_pipe(jsonfile, csvfile)
+        if ret != 0:
+            print("%s%s: Error: tshark exited with status %s.%s"
+                  % (RED, path, ret, END), file=sys.stderr)
+            exit(ret)
     # Handle stdin
-    if jsonfile == "/dev/stdin":
+    elif jsonfile == "/dev/stdin":
         print("Reading JSON from stdin...")
-        forpd = split_layers_stdin()
+        rows = iter_layers(sys.stdin, "stdin")
+        n_rows = write_rows(csvfile, rows)
     else:
         done = False
         if not jsonfile.endswith(".json"):
@@ -138,58 +216,168 @@ def main():
         if done:
             print_usage(1)
             
-        print("Shrinking and computing entropy of \"%s\"..." % jsonfile)
-        forpd = split_layers(jsonfile)
-    
-    if len(forpd) > 0:
-        print("Writing to \"%s\"..." % csvfile)
-        dirname = os.path.dirname(csvfile)
-        if dirname != '' and not os.path.isdir(dirname):
-            os.makedirs(dirname)
-        
-        with open(csvfile, 'w') as cf:
-            cf.write(result_header+'\n')
-            n_rows = 0
-            for row in forpd:
-                if row is not None:
-                    n_rows += 1
-                    cf.write('%s\n' % ','.join(map(str, row)))
+        print("Shrinking and computing entropy of \"%s\" (%s)..." % (jsonfile, json_backend))
+        with open(jsonfile, 'r') as f:
+            n_rows = write_rows(csvfile, iter_layers(f, jsonfile))
+
+    if n_rows > 0:
+        print("Results written to \"%s\" (%s packets)." % (csvfile, n_rows))
+
+
+def write_rows(csvfile, rows):
+    """
+    Stream result rows to csvfile as they are computed so memory stays
+    constant for any input size. The file is only created once the first
+    row arrives, and is flushed every FLUSH_EVERY rows.
+    Returns the number of rows written.
+    """
+    cf = None
+    n_rows = 0
+    try:
+        for row in rows:
+            if cf is None:
+                print("Writing to \"%s\"..." % csvfile)
+                dirname = os.path.dirname(csvfile)
+                if dirname != '' and not os.path.isdir(dirname):
+                    os.makedirs(dirname)
+                cf = open(csvfile, 'w', buffering=WRITE_BUFFER)
+                cf.write(result_header+'\n')
+            cf.write('%s\n' % ','.join(map(str, row)))
+            n_rows += 1
+            if n_rows % FLUSH_EVERY == 0:
+                cf.flush()
+    finally:
+        if cf is not None:
+            cf.close()
+    return n_rows
+
+
+def iter_layers(lines, infile):
+    """
+    Yield one result row per EK JSON line that produces one
+    """
+    for line in lines:
+        line = line.strip()
+        if line and line.startswith('{"timestamp"'):
+            res = process_pkt(line, infile)
+            if res is None:
+                continue
+            yield res
+
+
+def tshark_fields_cmd(pcapfile):
+    cmd = ['tshark', '-n', '-r', pcapfile, '-T', 'fields',
+           '-E', 'separator=/t', '-E', 'occurrence=f']
+    for _, _, field in TSHARK_FIELDS:
+        cmd += ['-e', field]
+    return cmd
+
+
+def fields_to_ek(parts):
+    """
+    Build the subset of an EK object that compute_pkt reads from one line of
+    tshark -T fields output. Returns (ek_obj, detected layers).
+    """
+    layers_obj = {}
+    for (layer, name, _), value in zip(TSHARK_FIELDS, parts):
+        if value == '':
+            continue
+        if name in HEX_FIELDS:
+            value = value.replace(':', '')
+        layers_obj.setdefault(layer, {})[name] = value
+
+    frame = layers_obj.get('frame', {})
+    detected = set(frame.get('frame_frame_protocols', '').split(':'))
+    for layer in ('tcp', 'udp'):
+        if layer in detected:
+            detected.add(layer + SUFIX_RAW)
+    for layer in (LAYER_HTTP, LAYER_SSL, LAYER_DNS):
+        if layer in detected:
+            layers_obj.setdefault(layer, {})
+    return {'timestamp': frame.get('frame_frame_time_epoch'), K_LAYER: layers_obj}, detected
+
+
+def iter_tshark_fields(lines, infile):
+    """
+    Yield one result row per tshark -T fields line that produces one
+    """
+    n_fields = len(TSHARK_FIELDS)
+    for line in lines:
+        parts = line.rstrip('\n').split('\t')
+        if len(parts) < n_fields:
+            parts.extend([''] * (n_fields - len(parts)))
+        try:
+            ek_obj, detected = fields_to_ek(parts)
+            tp_layer = determine_transport_layer(detected)
+            if tp_layer == LAYER_TP_OTHER:
+                continue
+            res = compute_pkt(ek_obj, tp_layer, detected)
+        except:
+            print("Err At file: %s" % (infile))
+            print(line)
+            traceback.print_exc()
+            continue
+        if res is not None:
+            yield res
+
+
+def run_tshark_pipe(pcapfile, csvfile):
+    """
+    Run tshark on pcapfile and compute entropies straight from its stdout.
+    Returns (rows written, tshark exit status).
+    """
+    proc = subprocess.Popen(tshark_fields_cmd(pcapfile), stdout=subprocess.PIPE,
+                            text=True, bufsize=WRITE_BUFFER)
+    try:
+        n_rows = write_rows(csvfile, iter_tshark_fields(proc.stdout, pcapfile))
+    finally:
+        proc.stdout.close()
+    return n_rows, proc.wait()
 
-            print("Results written to \"%s\" (%s packets)." % (csvfile, n_rows))
 
 def split_layers(jsonfile):
     """
     Read JSON lines from a file instead of stdin
     """
-    for_pd = []
-    num_orginal_pkt = 0
     with open(jsonfile, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line and line.startswith('{"timestamp"'):
-                num_orginal_pkt += 1
-                res = process_pkt(line, jsonfile)
-                if res is None:
-                    continue
-                for_pd.append(res)
-    return for_pd
+        return list(iter_layers(f, jsonfile))
 
 
 def split_layers_stdin():
     """
     Read JSON lines from stdin instead of a file
     """
-    for_pd = []
-    num_orginal_pkt = 0
-    for line in sys.stdin:
-        line = line.strip()
-        if line and line.startswith('{"timestamp"'):
-            num_orginal_pkt += 1
-            res = process_pkt(line, "stdin")
-            if res is None:
+    return list(iter_layers(sys.stdin, "stdin"))
+
+
+def get_json_decoder(backend='auto'):
+    """
+    Return (name, loads) for a JSON backend. 'auto' picks the fastest one
+    installed, in JSON_BACKENDS order. The simdjson parser is lazy: loads
+    returns proxies and only the fields compute_pkt reads are materialized,
+    so the large *_raw hex strings are never copied into Python objects.
+    """
+    names = JSON_BACKENDS if backend == 'auto' else (backend,)
+    for name in names:
+        if name == 'simdjson':
+            try:
+                import simdjson
+            except ImportError:
                 continue
-            for_pd.append(res)
-    return for_pd
+            return name, simdjson.Parser().parse
+        if name == 'orjson':
+            try:
+                import orjson
+            except ImportError:
+                continue
+            return name, orjson.loads
+        if name == 'json':
+            return name, json.loads
+        raise ValueError("unknown JSON backend \"%s\"" % name)
+    raise ValueError("JSON backend \"%s\" is not installed" % backend)
+
+
+json_backend, json_loads = get_json_decoder()
 
 
 def get_layers(ek_obj):
@@ -201,7 +389,7 @@ def get_layers(ek_obj):
 
 def process_pkt(line, infile):
     try:
-        ek_obj = json.loads(line)
+        ek_obj = json_loads(line)
         list_detected_layers = get_layers(ek_obj)
         tp_layer = determine_transport_layer(list_detected_layers)
 
@@ -250,7 +438,13 @@ def compute_pkt(ek_obj, tp_layer, list_detected_layers):
                     return
             return
     elif tp_layer == 'udp':
-        data_stream = ek_obj[K_LAYER]['frame_raw'][84:]
+        udp_obj = layers_obj[tp_layer]
+        if 'frame_raw' in layers_obj and (legacyDecode or 'udp_udp_payload_raw' not in udp_obj):
+            # fixed offset past the Ethernet, IPv4 and UDP headers (published numbers)
+            data_stream = layers_obj['frame_raw'][84:]
+        else:
+            # --pcap mode has no frame_raw, and no udp.payload for an empty datagram
+            data_stream = udp_obj.get('udp_udp_payload_raw', '')
 
     data_bytes = len(data_stream) / 2
     if data_bytes < TH_DATA_LEN_EMPTY:
@@ -363,18 +557,70 @@ def check_magic_number(data_stream):
 
 # ---------- NEW: entropy helpers & functions ----------
 
-def _probs_from_stream(data_stream):
+def _symbol_counts(stream):
     """
-    Given a (possibly decoded) data_stream (string or list), return a list
-    of probabilities for each unique symbol. Returns None if <2 samples.
+    Count symbols of a str (by code point) or bytes-like (by octet) with
+    NumPy. Returns a 1-D count array (zeros allowed).
     """
-    if not isinstance(data_stream, str):
-        data_stream = list(data_stream)
-    n = len(data_stream)
-    if n < 2:
-        return None
-    counts = Counter(data_stream)
-    return [c / n for c in counts.values()]
+    if isinstance(stream, str):
+        codes = np.frombuffer(stream.encode('utf-32-le'), dtype='<u4')
+        return np.unique(codes, return_counts=True)[1]
+    if isinstance(stream, (bytes, bytearray, memoryview)):
+        return np.bincount(np.frombuffer(stream, dtype=np.uint8), minlength=256)
+    return np.unique(np.asarray(list(stream)), return_counts=True)[1]
+
+def byte_histograms(buf, offsets):
+    """
+    256-bin histograms of many payloads in one pass.
+
+    buf: concatenated payload bytes (bytes-like or uint8 array)
+    offsets: n+1 boundaries, payload i is buf[offsets[i]:offsets[i+1]]
+    Returns an (n, 256) int64 array.
+    """
+    data = np.frombuffer(buf, dtype=np.uint8) if not isinstance(buf, np.ndarray) else buf
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n = len(offsets) - 1
+    if n <= 0:
+        return np.zeros((0, 256), dtype=np.int64)
+    data = data[offsets[0]:offsets[-1]]
+    seg = np.repeat(np.arange(n, dtype=np.int64), np.diff(offsets))
+    return np.bincount(seg * 256 + data, minlength=n * 256).reshape(n, 256)
+
+def entropies_from_counts(counts, alpha=RENYI_ALPHA, q=TSALLIS_Q, log_base=LOG_BASE):
+    """
+    Shannon, Rényi and Tsallis entropies for every row of a count matrix.
+    Rows with fewer than 2 samples get -1, as in entropies_from_stream.
+    Returns three float64 arrays.
+    """
+    counts = np.atleast_2d(counts).astype(np.float64)
+    totals = counts.sum(axis=1)
+    valid = totals >= 2
+    p = counts / np.where(valid, totals, 1.0)[:, None]
+    nz = p > 0
+    logp = np.log(p, where=nz, out=np.zeros_like(p))
+
+    sh = -(p * logp).sum(axis=1) / math.log(log_base)
+    if alpha == 1.0:
+        re = sh.copy()
+    else:
+        re = np.log((p ** alpha).sum(axis=1), where=valid, out=np.zeros_like(totals))
+        re = re / ((1.0 - alpha) * math.log(log_base))
+    if q == 1.0:
+        # Shannon with natural log by convention; change if you need base-256 here.
+        ts = -(p * logp).sum(axis=1)
+    else:
+        ts = (1.0 - (p ** q).sum(axis=1)) / (q - 1.0)
+
+    for arr in (sh, re, ts):
+        arr[~valid] = -1
+    return sh, re, ts
+
+def batch_entropies(buf, offsets, alpha=RENYI_ALPHA, q=TSALLIS_Q, log_base=LOG_BASE):
+    """
+    Byte entropies of many payloads at once, see byte_histograms for the
+    buf/offsets layout. Returns (shannon, renyi, tsallis) arrays.
+    """
+    return entropies_from_counts(byte_histograms(buf, offsets), alpha, q, log_base)
 
 def shannon_from_probs(probs, log_base=LOG_BASE):
     return -sum(p * math.log(p, log_base) for p in probs if p > 0)
@@ -394,26 +640,30 @@ def tsallis_from_probs(probs, q=TSALLIS_Q):
 
 def entropies_after_decode(data_stream):
     """
-    Decode hex -> bytes -> string (ignore decode errors), then compute
-    Shannon, Rényi, Tsallis entropies.
+    Decode hex -> bytes, then compute Shannon, Rényi, Tsallis entropies
+    over the octets. The hex text is a str, so unhexlify makes the one
+    per-packet copy; NumPy then counts the octets through a view of it.
+    With legacyDecode the bytes are decoded to a string (ignoring decode
+    errors) and characters are counted instead.
+    Malformed hex falls back to counting the hex text, as before.
     Returns (shannon, renyi, tsallis).
     """
     try:
-        tmp = bytearray.fromhex(data_stream).decode(errors='ignore')
-        return entropies_from_stream(tmp)
-    except:
+        raw = binascii.unhexlify(data_stream)
+    except (binascii.Error, ValueError):
         traceback.print_exc()
         return entropies_from_stream(data_stream)
+    if legacyDecode:
+        return entropies_from_stream(raw.decode(errors='ignore'))
+    return entropies_from_stream(raw)
 
 def entropies_from_stream(stream):
-    probs = _probs_from_stream(stream)
-    if probs is None:
+    counts = _symbol_counts(stream)
+    if counts.sum() < 2:
         return -1, -1, -1
 
-    sh = shannon_from_probs(probs, log_base=LOG_BASE)
-    re = renyi_from_probs(probs, alpha=RENYI_ALPHA, log_base=LOG_BASE)
-    ts = tsallis_from_probs(probs, q=TSALLIS_Q)
-    return sh, re, ts
+    sh, re, ts = entropies_from_counts(counts)
+    return float(sh[0]), float(re[0]), float(ts[0])
 # -----------------------------------------------------
 
 
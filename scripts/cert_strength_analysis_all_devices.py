@@ -4,6 +4,8 @@ Generates device-wise breakdowns and combined analysis.
 """
 
 import csv
+import os
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from pathlib import Path
@@ -20,15 +22,24 @@ CERT_FOLDER_CANDIDATES = [
 ]
 
 
+CERT_SUFFIXES = {'.cer', '.crt', '.cert'}
+_folder_counts = {}
+
+
 def count_device_cert_files(device, folder_name):
-    """Count .cer files for a device folder; return None when folder is missing."""
+    """Count .cer files for a device folder; return None when folder is missing.
+    Each folder is listed once per run."""
     folder = DATASET_BASE / device / folder_name
-    if not folder.exists():
-        return None
-    return len([
-        path for path in folder.iterdir()
-        if path.is_file() and path.suffix.lower() in {'.cer', '.crt', '.cert'}
-    ])
+    if folder not in _folder_counts:
+        try:
+            with os.scandir(folder) as entries:
+                _folder_counts[folder] = sum(
+                    1 for entry in entries
+                    if entry.is_file() and os.path.splitext(entry.name)[1].lower() in CERT_SUFFIXES
+                )
+        except (FileNotFoundError, NotADirectoryError):
+            _folder_counts[folder] = None
+    return _folder_counts[folder]
 
 
 def count_device_cert_files_auto(device):
@@ -63,6 +74,30 @@ def assess_strength(key_type, key_size):
     else:
         return 'UNKNOWN', 0
 
+def assess_strength_vectorized(key_type, key_size):
+    """Array version of assess_strength: (strength levels, security bits)
+    for whole key type / key size columns at once."""
+    key_type = np.asarray(key_type, dtype=object)
+    key_size = np.asarray(key_size, dtype=float)
+    rsa = key_type == 'RSAPublicKey'
+    ec = key_type == 'EllipticCurvePublicKey'
+    conditions = [
+        rsa & (key_size == 1024),
+        rsa & (key_size == 2048),
+        rsa & (key_size >= 3072),
+        ec & (key_size == 256),
+        ec & (key_size == 384),
+        ec & (key_size == 521),
+        ec,
+    ]
+    levels = np.select(conditions, ['BROKEN', 'WEAK', 'STRONG', 'STRONG', 'STRONG', 'STRONG', 'UNKNOWN'],
+                       default='UNKNOWN').astype(object)
+    # other EC curves report their key size, as in assess_strength
+    bits = np.select(conditions, [80, 112, 128, 128, 192, 256, key_size], default=0)
+    if np.isfinite(bits).all() and (bits == np.round(bits)).all():
+        bits = bits.astype(np.int64)
+    return levels, bits
+
 def format_pct(count, total):
     """Format percentage safely."""
     if total == 0:
@@ -71,13 +106,8 @@ def format_pct(count, total):
 
 def analyze_strength(df):
     """Assess strength for all certificates."""
-    df['strength_level'] = df.apply(
-        lambda r: assess_strength(r['public_key_type'], r['public_key_size'])[0],
-        axis=1
-    )
-    df['security_bits'] = df.apply(
-        lambda r: assess_strength(r['public_key_type'], r['public_key_size'])[1],
-        axis=1
+    df['strength_level'], df['security_bits'] = assess_strength_vectorized(
+        df['public_key_type'].to_numpy(), df['public_key_size'].to_numpy()
     )
     
     # Parse dates
@@ -104,53 +134,43 @@ def generate_analysis_csv(df):
 
 def generate_device_summary(df):
     """Generate per-device summary statistics."""
-    devices = sorted(df['device'].unique())
-    device_stats = []
-    
-    for device in devices:
-        device_df = df[df['device'] == device]
-
-        # Folder-based counts:
-        # - certificates_with_duplicate: total observed captures
-        # - certificates: manual unique set
-        total_with_duplicates = count_device_cert_files(device, 'certificates_with_duplicate')
-        unique_certificates = count_device_cert_files_auto(device)
-
-        # Fallbacks when a folder is missing
-        if total_with_duplicates is None:
-            total_with_duplicates = len(device_df)
-        if unique_certificates is None:
-            unique_certificates = len(device_df)
-
-        self_signed = (device_df['is_self_signed']).sum()
-        
-        strength_counts = device_df['strength_level'].value_counts()
-        broken = strength_counts.get('BROKEN', 0)
-        weak = strength_counts.get('WEAK', 0)
-        strong = strength_counts.get('STRONG', 0)
-
-        earliest_expiry_date = device_df['not_after_dt'].min().date().isoformat()
-        latest_expiry_date = device_df['not_after_dt'].max().date().isoformat()
-        
-        avg_validity = device_df['validity_years'].mean()
-        avg_security_bits = device_df['security_bits'].mean()
-        
-        device_stats.append({
-            'device': device,
-            'total_certificates': total_with_duplicates,
-            'unique_certificates': unique_certificates,
-            'unique_serials': device_df['serial_number'].nunique(),
-            'broken_strength': broken,
-            'weak_strength': weak,
-            'strong_strength': strong,
-            'earliest_expiry_date': earliest_expiry_date,
-            'latest_expiry_date': latest_expiry_date,
-            'self_signed': self_signed,
-            'avg_validity_years': round(avg_validity, 2),
-            'avg_security_bits': round(avg_security_bits, 1),
-        })
-    
-    device_df_out = pd.DataFrame(device_stats)
+    grouped = df.groupby('device', sort=True)
+    stats = grouped.agg(
+        rows=('device', 'size'),
+        unique_serials=('serial_number', 'nunique'),
+        self_signed=('is_self_signed', 'sum'),
+        earliest_expiry=('not_after_dt', 'min'),
+        latest_expiry=('not_after_dt', 'max'),
+        avg_validity_years=('validity_years', 'mean'),
+        avg_security_bits=('security_bits', 'mean'),
+    )
+    strength = pd.crosstab(df['device'], df['strength_level']).reindex(
+        index=stats.index, columns=['BROKEN', 'WEAK', 'STRONG'], fill_value=0)
+
+    # Folder-based counts:
+    # - certificates_with_duplicate: total observed captures
+    # - certificates: manual unique set
+    # Fallbacks when a folder is missing: the device's row count
+    devices = stats.index.tolist()
+    total_with_duplicates = pd.Series(
+        [count_device_cert_files(d, 'certificates_with_duplicate') for d in devices], index=stats.index, dtype=object)
+    unique_certificates = pd.Series(
+        [count_device_cert_files_auto(d) for d in devices], index=stats.index, dtype=object)
+
+    device_df_out = pd.DataFrame({
+        'device': devices,
+        'total_certificates': total_with_duplicates.fillna(stats['rows']).astype(int).to_numpy(),
+        'unique_certificates': unique_certificates.fillna(stats['rows']).astype(int).to_numpy(),
+        'unique_serials': stats['unique_serials'].to_numpy(),
+        'broken_strength': strength['BROKEN'].to_numpy(),
+        'weak_strength': strength['WEAK'].to_numpy(),
+        'strong_strength': strength['STRONG'].to_numpy(),
+        'earliest_expiry_date': stats['earliest_expiry'].dt.strftime('%Y-%m-%d').to_numpy(),
+        'latest_expiry_date': stats['latest_expiry'].dt.strftime('%Y-%m-%d').to_numpy(),
+        'self_signed': stats['self_signed'].to_numpy(),
+        'avg_validity_years': stats['avg_validity_years'].round(2).to_numpy(),
+        'avg_security_bits': stats['avg_security_bits'].round(1).to_numpy(),
+    })
     device_df_out.to_csv(OUTPUT_PATH / 'certificate_device_summary.csv', index=False)
     print(f"Saved device summary to certificate_device_summary.csv")
     
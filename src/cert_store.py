@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""Persistent, content-addressed store for TLS certificates.
+
+`tls_cert.PCAPParserApp` deduplicated certificates with an in-memory set, so
+nothing was shared across pcaps, devices or processes. `CertStore` keeps
+every certificate once, keyed by the SHA-256 of its DER encoding, in an
+SQLite database together with its parsed fields, plus one `sightings` row per
+(certificate, pcap, src, dst). The database runs in WAL mode with a busy
+timeout and inserts are `INSERT OR IGNORE` in one short transaction per
+pcap, so any number of worker processes can ingest into the same store.
+
+Parsed fields follow scripts/analyze_certificates_all_devices.py and need
+the optional `cryptography` package; without it only the signature algorithm
+OID is filled in.
+
+Bulk ingest of a directory tree (pcaps already ingested with the same size
+and mtime are skipped, so interrupted runs resume):
+
+  python3 src/cert_store.py ingest controlled/dataset --store controlled/certs.sqlite -j 8
+  python3 src/cert_store.py ingest controlled/dataset --store controlled/certs.sqlite --native
+  python3 src/cert_store.py show <sha256> --store controlled/certs.sqlite
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+PCAP_EXTS = ('.pcap', '.pcapng')
+BUSY_TIMEOUT = 60
+
+FIELDS = (
+    'subject', 'issuer', 'not_before', 'not_after', 'serial_number',
+    'public_key_type', 'public_key_size', 'signature_algorithm_oid', 'is_self_signed',
+)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS certs (
+    sha256 TEXT PRIMARY KEY,
+    der BLOB NOT NULL,
+    subject TEXT,
+    issuer TEXT,
+    not_before TEXT,
+    not_after TEXT,
+    serial_number TEXT,
+    public_key_type TEXT,
+    public_key_size INTEGER,
+    signature_algorithm_oid TEXT,
+    is_self_signed INTEGER,
+    first_seen REAL
+);
+CREATE TABLE IF NOT EXISTS sightings (
+    sha256 TEXT NOT NULL,
+    pcap TEXT NOT NULL,
+    src_ip TEXT NOT NULL DEFAULT '',
+    dst_ip TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (sha256, pcap, src_ip, dst_ip)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_sightings_pcap ON sightings (pcap);
+CREATE TABLE IF NOT EXISTS ingested (
+    pcap TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    certificates INTEGER
+);
+'''
+
+
+def cert_sha256(der):
+    return hashlib.sha256(der).hexdigest()
+
+
+def _der_element(der, pos):
+    """(tag, content start, content end) of the DER element at pos."""
+    tag = der[pos]
+    length = der[pos + 1]
+    pos += 2
+    if length & 0x80:
+        n = length & 0x7F
+        length = int.from_bytes(der[pos:pos + n], 'big')
+        pos += n
+    return tag, pos, pos + length
+
+
+def _oid_to_str(body):
+    first = body[0]
+    parts = [str(min(first // 40, 2)), str(first - 40 * min(first // 40, 2))]
+    value = 0
+    for b in body[1:]:
+        value = (value << 7) | (b & 0x7F)
+        if not b & 0x80:
+            parts.append(str(value))
+            value = 0
+    return '.'.join(parts)
+
+
+def signature_oid(der):
+    """Dotted signatureAlgorithm OID read straight from the DER, or None."""
+    try:
+        _, start, _ = _der_element(der, 0)              # Certificate
+        _, _, tbs_end = _der_element(der, start)        # tbsCertificate
+        _, alg_start, _ = _der_element(der, tbs_end)    # signatureAlgorithm
+        tag, oid_start, oid_end = _der_element(der, alg_start)
+        if tag != 0x06:
+            return None
+        return _oid_to_str(der[oid_start:oid_end])
+    except IndexError:
+        return None
+
+
+def parse_cert_fields(der):
+    """Metadata of one DER certificate (None for fields that cannot be read)."""
+    fields = dict.fromkeys(FIELDS)
+    fields['signature_algorithm_oid'] = signature_oid(der)
+    try:
+        from cryptography import x509
+    except ImportError:
+        return fields
+    try:
+        cert = x509.load_der_x509_certificate(der)
+    except ValueError:
+        return fields
+    fields['subject'] = cert.subject.rfc4514_string()
+    fields['issuer'] = cert.issuer.rfc4514_string()
+    try:
+        not_before, not_after = cert.not_valid_before_utc, cert.not_valid_after_utc
+    except AttributeError:
+        not_before, not_after = cert.not_valid_before, cert.not_valid_after
+    fields['not_before'] = not_before.isoformat()
+    fields['not_after'] = not_after.isoformat()
+    fields['serial_number'] = str(cert.serial_number)
+    try:
+        public_key = cert.public_key()
+        fields['public_key_type'] = type(public_key).__name__
+        fields['public_key_size'] = getattr(public_key, 'key_size', None)
+    except (ValueError, TypeError):
+        pass
+    fields['is_self_signed'] = int(fields['subject'] == fields['issuer'])
+    return fields
+
+
+class CertStore(object):
+    def __init__(self, path):
+        self.path = path
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM certs').fetchone()[0]
+
+    def __contains__(self, sha256):
+        return self.conn.execute('SELECT 1 FROM certs WHERE sha256 = ?', (sha256,)).fetchone() is not None
+
+    def missing(self, hashes):
+        """The subset of `hashes` not in the store yet."""
+        hashes = list(set(hashes))
+        present = set()
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            present.update(r[0] for r in self.conn.execute(
+                f"SELECT sha256 FROM certs WHERE sha256 IN ({', '.join('?' * len(chunk))})", chunk))
+        return set(hashes) - present
+
+    def add_many(self, sightings, pcap=None):
+        """Insert (der, src_ip, dst_ip) sightings in one transaction.
+
+        Certificates are parsed only when the store does not have them yet.
+        Returns the number of certificates that were new to the store."""
+        by_hash = {}
+        rows = []
+        for der, src_ip, dst_ip in sightings:
+            sha = cert_sha256(der)
+            by_hash.setdefault(sha, der)
+            if pcap is not None:
+                rows.append((sha, pcap, src_ip or '', dst_ip or ''))
+        new = self.missing(by_hash)
+        now = time.time()
+        certs = []
+        for sha in new:
+            fields = parse_cert_fields(by_hash[sha])
+            certs.append((sha, by_hash[sha]) + tuple(fields[f] for f in FIELDS) + (now,))
+
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            cur = self.conn.executemany(
+                f"INSERT OR IGNORE INTO certs VALUES ({', '.join('?' * (len(FIELDS) + 3))})", certs)
+            inserted = cur.rowcount if cur.rowcount >= 0 else len(certs)
+            self.conn.executemany('INSERT OR IGNORE INTO sightings VALUES (?, ?, ?, ?)', rows)
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return inserted
+
+    def add(self, der, pcap=None, src_ip=None, dst_ip=None):
+        return self.add_many([(der, src_ip, dst_ip)], pcap)
+
+    def get(self, sha256):
+        cur = self.conn.execute('SELECT * FROM certs WHERE sha256 = ?', (sha256,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return dict(zip([d[0] for d in cur.description], row))
+
+    def sightings(self, sha256):
+        return [{'pcap': p, 'src_ip': s, 'dst_ip': d} for p, s, d in self.conn.execute(
+            'SELECT pcap, src_ip, dst_ip FROM sightings WHERE sha256 = ? ORDER BY pcap', (sha256,))]
+
+    def is_ingested(self, pcap):
+        row = self.conn.execute('SELECT size, mtime_ns FROM ingested WHERE pcap = ?', (pcap,)).fetchone()
+        if row is None:
+            return False
+        st = os.stat(pcap)
+        return tuple(row) == (st.st_size, st.st_mtime_ns)
+
+    def mark_ingested(self, pcap, n_certificates):
+        st = os.stat(pcap)
+        self.conn.execute('INSERT OR REPLACE INTO ingested VALUES (?, ?, ?, ?)',
+                          (pcap, st.st_size, st.st_mtime_ns, n_certificates))
+
+
+def _native_sightings(pcap_file):
+    import tls_parser
+    for rec in tls_parser.parse_pcap(pcap_file):
+        for der in rec.get('certificates', ()):
+            yield der, rec['ip_src'], None
+
+
+def ingest_pcap(store_path, pcap_file, native=False, display_filter=''):
+    """Worker: extract the certificates of one pcap into the store.
+    Returns (certificates seen, certificates new to the store)."""
+    with CertStore(store_path) as store:
+        if native:
+            sightings = list(_native_sightings(pcap_file))
+        else:
+            import tls_cert
+            app = tls_cert.PCAPParserApp()
+            sightings = list(app.iter_certificates(pcap_file, display_filter))
+        new = store.add_many(sightings, pcap_file)
+        store.mark_ingested(pcap_file, len(sightings))
+    return len(sightings), new
+
+
+def ingest_tree(root, store_path, jobs=None, native=False, display_filter=''):
+    with CertStore(store_path) as store:
+        pcaps = []
+        for dirpath, _, filenames in os.walk(root):
+            for filename in sorted(filenames):
+                if filename.lower().endswith(PCAP_EXTS):
+                    path = os.path.abspath(os.path.join(dirpath, filename))
+                    if not store.is_ingested(path):
+                        pcaps.append(path)
+    print(f"{len(pcaps)} pcaps to ingest into {store_path}")
+
+    # largest first so a huge capture does not end up last on one worker
+    pcaps.sort(key=os.path.getsize, reverse=True)
+    total_seen = total_new = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(ingest_pcap, store_path, p, native, display_filter): p for p in pcaps}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                seen, new = future.result()
+            except Exception as e:
+                print(f"[{done}/{len(pcaps)}] {futures[future]} failed: {e}")
+                continue
+            total_seen += seen
+            total_new += new
+            print(f"[{done}/{len(pcaps)}] {futures[future]}: {seen} certificates, {new} new")
+    with CertStore(store_path) as store:
+        print(f"Ingested {total_seen} certificates ({total_new} new); store holds {len(store)} unique certificates.")
+
+
+def main():
+    p = argparse.ArgumentParser(description='Content-addressed TLS certificate store')
+    sub = p.add_subparsers(dest='command', required=True)
+
+    ing = sub.add_parser('ingest', help='Extract certificates from every pcap under a directory')
+    ing.add_argument('root', help='Directory searched recursively for pcap/pcapng files')
+    ing.add_argument('--store', required=True, help='Path of the certificate database')
+    ing.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Worker processes')
+    ing.add_argument('--native', action='store_true', help='Parse TLS with tls_parser.py instead of tshark')
+    ing.add_argument('--filter', default='', help='Extra tshark display filter')
+
+    show = sub.add_parser('show', help='Print a certificate and where it was seen')
+    show.add_argument('sha256')
+    show.add_argument('--store', required=True, help='Path of the certificate database')
+
+    args = p.parse_args()
+    if args.command == 'ingest':
+        ingest_tree(args.root, args.store, args.jobs, args.native, args.filter)
+    else:
+        with CertStore(args.store) as store:
+            cert = store.get(args.sha256)
+            if cert is None:
+                print(f"{args.sha256} not in store")
+                return
+            cert.pop('der')
+            for k, v in cert.items():
+                print(f"{k}: {v}")
+            for s in store.sightings(args.sha256):
+                print(f"  seen in {s['pcap']} ({s['src_ip']} -> {s['dst_ip']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,23 +9,23 @@
 # python3 src/check_true_updates.py ~/update_traffic/retrospective/dataset_extracted/iot-data_tls/
 
 
-# The input directory should contain the file_metadata.pickle and bin_results.json files generated by the
+# The input directory should contain the file_metadata.sqlite (or legacy file_metadata.pickle) and bin_results.json files generated by the
 # analysis script, and the results will be printed to the console
 
 
 
 import os
 import json
-import pickle
 import argparse
 import time
 from collections import Counter, defaultdict
 
+import metadata_store
+
 # Track execution time
 start_time = time.perf_counter()
 
 # Constants
-PICKLE_FILE_CONST = "file_metadata.pickle"
 ANAL_RESULTS_CONST = "bin_results.json"
 UPDATE_KEYS = ["update", "firmware", "software", "download"]
 
@@ -39,17 +39,15 @@ with open(os.path.join(args.input_dir, ANAL_RESULTS_CONST), 'r') as f:
     results_data = json.load(f)
     print("[+] Loaded analysis JSON")
 
-# Load device metadata
-with open(os.path.join(args.input_dir, PICKLE_FILE_CONST), 'rb') as f:
-    device_metadata = pickle.load(f)
-    print("[+] Loaded device metadata")
+# Load device metadata (only the column we need), indexed by uuid
+store = metadata_store.open_store(args.input_dir)
+device_metadata = store.index(['device'])
+store.close()
+print("[+] Loaded device metadata")
 
 # Helper to get device by UUID
 def get_device_by_uuid(uuid):
-    for device in device_metadata:
-        if device['uuid'] == uuid:
-            return device
-    return None
+    return device_metadata.get(uuid)
 
 # Counters
 true_counter = Counter()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Precompiled cipher-suite classification table.
+
+ciphersuite.py, ciphersuite_nested_folder.py and tls_breakdown.py classify
+suites by normalising the hex string and probing the SECURE / RECOMMENDED /
+WEAK / INSECURE sets one occurrence at a time. This module compiles those
+sets once into a 65536-entry uint8 array indexed by the 16-bit suite code
+(values are indexes into CATEGORIES), so classification is `table[codes]`
+over a NumPy array. The IANA names of src/tls_vars.py are compiled alongside
+for `suite_name`, and set entries that are not a registered code are
+reported when the table is built.
+
+The compiled table is cached as src/__pycache__/cipher_table-<digest>.npz,
+where the digest covers the sets and names, so editing ciphersuite.py or
+tls_vars.py rebuilds it on the next run.
+
+    table = cipher_table.load_table()
+    cats = table[codes]                            # uint8 category indexes
+    cats = cipher_table.classify_hex(['0x1301', 'c02f'])
+"""
+
+import hashlib
+import os
+import sys
+
+import numpy as np
+
+CATEGORIES = ('Secure', 'Recommended', 'Weak', 'Insecure', 'Unknown')
+UNKNOWN = CATEGORIES.index('Unknown')
+N_CODES = 1 << 16
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__pycache__')
+
+_tables = {}
+_names = None
+
+
+def normalize_hex(value):
+    """'0x00BA' / '00ba' / 'ba' -> 0x00ba, or None when not a 16-bit hex code."""
+    h = str(value).strip().lower()
+    if h.startswith('0x'):
+        h = h[2:]
+    if not h or len(h) > 4:
+        return None
+    try:
+        return int(h, 16)
+    except ValueError:
+        return None
+
+
+def default_sets():
+    import ciphersuite
+    return {
+        'Secure': ciphersuite.SECURE,
+        'Recommended': ciphersuite.RECOMMENDED,
+        'Weak': ciphersuite.WEAK,
+        'Insecure': ciphersuite.INSECURE,
+    }
+
+
+def iana_names():
+    global _names
+    if _names is None:
+        import tls_vars
+        _names = dict(tls_vars.CIPHERSUITES)
+    return _names
+
+
+def _digest(sets, names):
+    h = hashlib.sha256()
+    for cat in CATEGORIES[:-1]:
+        h.update(cat.encode() + b'\0' + '\0'.join(sorted(str(x) for x in sets[cat])).encode() + b'\1')
+    h.update(repr(sorted(names.items())).encode())
+    return h.hexdigest()[:16]
+
+
+def build_table(sets, names=None):
+    """Compile {category: set of hex strings} into the uint8 lookup table.
+
+    Matches ciphersuite.classify_cipher_suite: entries are compared as the
+    lowercased 4-digit hex form, and the first of Secure, Recommended, Weak,
+    Insecure that contains a code wins."""
+    table = np.full(N_CODES, UNKNOWN, dtype=np.uint8)
+    # assign in reverse priority so the earlier category overwrites
+    for cat in reversed(CATEGORIES[:-1]):
+        codes = [int(x, 16) for x in sets[cat]
+                 if len(x) == 4 and all(ch in '0123456789abcdef' for ch in x)]
+        table[codes] = CATEGORIES.index(cat)
+    if names is not None:
+        for cat in CATEGORIES[:-1]:
+            for x in sorted(sets[cat]):
+                code = normalize_hex(x)
+                if code is None or code not in names:
+                    print(f"[!] cipher_table: {cat} entry {x!r} is not a registered cipher suite", file=sys.stderr)
+    return table
+
+
+def load_table(sets=None, cache_dir=CACHE_DIR):
+    """The compiled table for `sets` (ciphersuite.py's sets by default),
+    read from the on-disk cache when it is up to date."""
+    sets = default_sets() if sets is None else sets
+    names = iana_names()
+    key = _digest(sets, names)
+    if key in _tables:
+        return _tables[key]
+    path = os.path.join(cache_dir, f'cipher_table-{key}.npz')
+    table = None
+    if os.path.exists(path):
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                table = data['category']
+        except (OSError, ValueError, KeyError):
+            table = None
+    if table is None or table.shape != (N_CODES,):
+        table = build_table(sets, names)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = path + '.part.npz'
+            np.savez(tmp, category=table)
+            os.replace(tmp, path)
+        except OSError:
+            pass  # read-only checkout: keep the in-memory table
+    _tables[key] = table
+    return table
+
+
+def classify_codes(codes, table=None):
+    """Category indexes for an integer array of suite codes (-1 = Unknown)."""
+    table = load_table() if table is None else table
+    codes = np.asarray(codes, dtype=np.int64)
+    valid = (codes >= 0) & (codes < N_CODES)
+    out = np.full(codes.shape, UNKNOWN, dtype=np.uint8)
+    out[valid] = table[codes[valid]]
+    return out
+
+
+def codes_from_hex(values):
+    """Integer codes for hex strings (-1 when not a 16-bit code); each
+    distinct string is parsed once."""
+    values = np.asarray(values, dtype=str)
+    if values.size == 0:
+        return np.zeros(values.shape, dtype=np.int64)
+    uniq, inverse = np.unique(values, return_inverse=True)
+    parsed = np.array([-1 if c is None else c for c in map(normalize_hex, uniq)], dtype=np.int64)
+    return parsed[inverse.reshape(values.shape)]
+
+
+def classify_hex(values, table=None):
+    return classify_codes(codes_from_hex(values), table)
+
+
+def category_name(index):
+    return CATEGORIES[index]
+
+
+def suite_name(code):
+    return iana_names().get(code, 'Unknown')
+
+
+if __name__ == '__main__':
+    table = load_table()
+    counts = np.bincount(table, minlength=len(CATEGORIES))
+    for cat, n in zip(CATEGORIES, counts):
+        print(f"  {cat}: {n} codes")
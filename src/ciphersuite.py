@@ -1,7 +1,12 @@
 import json
+import os
 import sys
 from collections import Counter
 
+import numpy as np
+
+import cipher_table
+
 # This script reads a JSON file containing packet data, extracts TLS cipher suite information, classifies each cipher suite into categories (Secure, Recommended, Weak, Insecure, Unknown), and counts the occurrences of each category and individual cipher suites.
 # Use: python ciphersuite.py <packets.json>
 # python src/ciphersuite.py ~/update_traffic/controlled/entropy/d-link-cam/dlink.json 
@@ -30,75 +35,191 @@ INSECURE = {
 
 
 
+def _table():
+    return cipher_table.load_table({'Secure': SECURE, 'Recommended': RECOMMENDED,
+                                    'Weak': WEAK, 'Insecure': INSECURE})
+
+
 def classify_cipher_suite(hexcode: str) -> str:
-    h = hexcode.lower()
-    if h.startswith('0x'):
-        h = h[2:]
-    h = h.zfill(4)
-    if h in SECURE:
-        return 'Secure'
-    elif h in RECOMMENDED:
-        return 'Recommended'
-    elif h in WEAK:
-        return 'Weak'
-    elif h in INSECURE:
-        return 'Insecure'
-    else:
+    code = cipher_table.normalize_hex(hexcode)
+    if code is None:
         return 'Unknown'
+    return cipher_table.CATEGORIES[_table()[code]]
 
-def main(filename):
-    cipher_counts = Counter()
-    category_counts = Counter()
 
+def category_counts_of(cipher_counts):
+    """Occurrences per category for a Counter of suite strings, classified in one table lookup."""
+    suites = list(cipher_counts)
+    cats = cipher_table.classify_hex(suites, _table())
+    totals = np.bincount(cats, weights=[cipher_counts[s] for s in suites], minlength=len(cipher_table.CATEGORIES))
+    return Counter({cat: int(n) for cat, n in zip(cipher_table.CATEGORIES, totals)})
+
+# Streaming scanner. Packets are decoded one at a time and only the TLS
+# cipher fields are kept, so multi-GB dumps are summarised in bounded memory.
+# Both layouts are accepted: `tshark -T ek` (one JSON object per line) and
+# `tshark -T json` (one JSON array, possibly pretty-printed). The array is
+# decoded object by object from a rolling buffer. `-T json` repeats a key for
+# every occurrence of a field (one "tls.handshake.ciphersuite" per offered
+# suite), so duplicate keys are merged into lists instead of keeping the last.
+READ_CHUNK = 1 << 20
+# largest single array element the rolling buffer will hold before giving up
+MAX_ELEMENT = 64 * READ_CHUNK
+CIPHER_MARKER = 'ciphersuite'
+
+
+def merge_duplicate_keys(pairs):
+    """object_pairs_hook that turns repeated keys into a list of their values."""
+    obj = {}
+    repeated = set()
+    for key, value in pairs:
+        if key not in obj:
+            obj[key] = value
+        elif key in repeated:
+            obj[key].append(value)
+        else:
+            obj[key] = [obj[key], value]
+            repeated.add(key)
+    return obj
+
+
+def _ek_cipher_values(tls):
+    cipher_list = []
+    if isinstance(tls, dict):
+        cipher_list = tls.get('tls_tls_handshake_ciphersuite_raw') or tls.get('tls_tls_handshake_ciphersuite')
+        if cipher_list and isinstance(cipher_list, str):
+            cipher_list = cipher_list.split()
+    elif isinstance(tls, list):
+        for tls_entry in tls:
+            if isinstance(tls_entry, dict):
+                ciphers = tls_entry.get('tls_tls_handshake_ciphersuite_raw') or tls_entry.get('tls_tls_handshake_ciphersuite')
+                if ciphers:
+                    if isinstance(ciphers, str):
+                        cipher_list.extend(ciphers.split())
+                    elif isinstance(ciphers, list):
+                        cipher_list.extend(ciphers)
+    return cipher_list or []
+
+
+def _json_cipher_values(obj, out):
+    """Collect tls.handshake.ciphersuite values from a `-T json` tls layer."""
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if k == 'tls.handshake.ciphersuite':
+                out.extend(v if isinstance(v, list) else [v])
+            elif isinstance(v, (dict, list)):
+                _json_cipher_values(v, out)
+    elif isinstance(obj, list):
+        for v in obj:
+            _json_cipher_values(v, out)
+    return out
+
+
+def packet_ciphers(packet):
+    """Cipher suite strings of one decoded packet (EK or `-T json` layout)."""
+    if not isinstance(packet, dict):
+        return []
+    if 'layers' in packet:
+        cipher_list = _ek_cipher_values(packet.get('layers', {}).get('tls', {}))
+    else:
+        layers = packet.get('_source', {}).get('layers', {})
+        cipher_list = _json_cipher_values(layers.get('tls', {}), [])
+
+    suites = []
+    for c in cipher_list:
+        c = str(c).strip().lower()
+        if not c:
+            continue
+        if ',' in c:
+            suites.extend(p.strip() for p in c.split(',') if p.strip())
+        else:
+            suites.append(c)
+    return suites
+
+
+def _iter_lines(f):
+    for line in f:
+        # most packets carry no cipher fields; skip them without decoding
+        if CIPHER_MARKER not in line:
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            continue
+
+
+def iter_json_array(f, decoder=None):
+    """Yield the elements of a JSON array read from a text stream (file or pipe).
+
+    `decoder` is an optional json.JSONDecoder, e.g. one with an
+    object_pairs_hook that keeps tshark's duplicate keys.
+
+    Raises ValueError when an element still does not decode after
+    MAX_ELEMENT characters, so malformed input cannot make the buffer grow
+    to the size of the file."""
+    decoder = decoder or json.JSONDecoder()
+    buf = f.read(READ_CHUNK).lstrip()[1:]  # drop the opening '['
+    pos = 0
+    eof = False
+    while True:
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            more = f.read(READ_CHUNK)
+            buf, pos, eof = buf[pos:] + more, 0, not more
+        if pos >= len(buf) or buf[pos] == ']':
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError as e:
+            if eof:
+                return
+            if len(buf) - pos > MAX_ELEMENT:
+                raise ValueError(f"Malformed JSON array element ({e.msg}) or element larger than "
+                                 f"{MAX_ELEMENT} characters") from e
+            more = f.read(READ_CHUNK)
+            buf, pos, eof = buf[pos:] + more, 0, not more
+            continue
+        yield obj
+        pos = end
+        if pos > READ_CHUNK:
+            buf, pos = buf[pos:], 0
+
+
+def iter_packets(filename):
+    """Yield decoded packets of a tshark EK or JSON dump one at a time."""
     with open(filename, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                packet = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-
-            tls = packet.get('layers', {}).get('tls', {})
-            cipher_list = []
-
-            if isinstance(tls, dict):
-                cipher_list = tls.get('tls_tls_handshake_ciphersuite_raw') or tls.get('tls_tls_handshake_ciphersuite')
-                if cipher_list and isinstance(cipher_list, str):
-                    cipher_list = cipher_list.split()
-            elif isinstance(tls, list):
-                for tls_entry in tls:
-                    if isinstance(tls_entry, dict):
-                        ciphers = tls_entry.get('tls_tls_handshake_ciphersuite_raw') or tls_entry.get('tls_tls_handshake_ciphersuite')
-                        if ciphers:
-                            if isinstance(ciphers, str):
-                                cipher_list.extend(ciphers.split())
-                            elif isinstance(ciphers, list):
-                                cipher_list.extend(ciphers)
-
-            if not cipher_list:
-                continue
-
-            for c in cipher_list:
-                c = c.strip().lower()
-                if not c:
-                    continue
-                if ',' in c:
-                    parts = [p.strip() for p in c.split(',') if p.strip()]
-                    for p in parts:
-                        cat = classify_cipher_suite(p)
-                        cipher_counts[p] += 1
-                        category_counts[cat] += 1
-                else:
-                    cat = classify_cipher_suite(c)
-                    cipher_counts[c] += 1
-                    category_counts[cat] += 1
+        head = f.read(READ_CHUNK)
+        stripped = head.lstrip()
+        f.seek(0)
+        if not stripped.startswith('['):
+            yield from _iter_lines(f)
+            return
+        yield from iter_json_array(f, json.JSONDecoder(object_pairs_hook=merge_duplicate_keys))
+
+
+def scan_file(filename):
+    """Counter of cipher suite strings over one dump."""
+    cipher_counts = Counter()
+    for packet in iter_packets(filename):
+        for suite in packet_ciphers(packet):
+            cipher_counts[suite] += 1
+    return cipher_counts
+
+
+def main(filename):
+    cipher_counts = scan_file(filename)
 
     if not cipher_counts:
         print("No cipher suites found in input.")
         return
 
+    category_counts = category_counts_of(cipher_counts)
+
     # --- Summary of occurrences ---
     print("\nSummary of categories (occurrences):")
     for cat in ["Secure", "Recommended", "Weak", "Insecure", "Unknown"]:
@@ -109,8 +230,31 @@ def main(filename):
         cat = classify_cipher_suite(c)
         print(f"  {c} : {cat} ({count} occurrences)")
 
+def run_test():
+    """Scan a synthetic `-T json` dump with one ClientHello offering three
+    suites and the ServerHello selecting one of them."""
+    import tempfile
+    client_hello = ('{"_source": {"layers": {"tls": {"tls.record": {"tls.handshake": {'
+                    '"tls.handshake.type": "1", "tls.handshake.ciphersuites": {'
+                    '"tls.handshake.ciphersuite": "0x1301", "tls.handshake.ciphersuite": "0x1302", '
+                    '"tls.handshake.ciphersuite": "0xc02f"}}}}}}}')
+    server_hello = ('{"_source": {"layers": {"tls": {"tls.record": {"tls.handshake": {'
+                    '"tls.handshake.type": "2", "tls.handshake.ciphersuite": "0x1301"}}}}}}')
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        f.write('[\n  %s,\n  %s\n]\n' % (client_hello, server_hello))
+    try:
+        counts = scan_file(f.name)
+    finally:
+        os.remove(f.name)
+    expected = Counter({'0x1301': 2, '0x1302': 1, '0xc02f': 1})
+    print("Multi-suite ClientHello ->", dict(counts), "OK" if counts == expected else f"FAIL (expected {dict(expected)})")
+    return counts == expected
+
+
 if __name__ == '__main__':
+    if len(sys.argv) == 2 and sys.argv[1] == '--test':
+        sys.exit(0 if run_test() else 1)
     if len(sys.argv) != 2:
-        print(f"Usage: python {sys.argv[0]} <packets.json>")
+        print(f"Usage: python {sys.argv[0]} <packets.json> | --test")
         sys.exit(1)
     main(sys.argv[1])
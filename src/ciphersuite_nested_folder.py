@@ -1,7 +1,12 @@
-import json
 import sys
 from collections import Counter, defaultdict
 import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import cipher_table
+import ciphersuite
 
 # Classification based on known TLS cipher suites (TLS 1.2 mainly)
 # Source info: https://www.iana.org/assignments/tls-parameters/tls-parameters.xhtml#tls-parameters-4import json
@@ -9,7 +14,7 @@ import os
 # Classification based on known TLS cipher suites (TLS 1.2 mainly)
 
 # Usage:
-# python ciphersuite_nested_folder.py <folder_with_json_files>  
+# python ciphersuite_nested_folder.py <folder_with_json_files> [jobs]
 # The script will recursively search for .json files in the specified folder and its subfolders, process them, and print a summary of cipher suite categories and unique cipher suites found.
 # 
 
@@ -33,84 +38,55 @@ INSECURE = {
     '0000', '00ff', '0005','c011', 'c007', 'c00c', 'c002', '0004', '0015', '0012', '000f', '000c', '0009',
 }
 
+def _table():
+    return cipher_table.load_table({'Secure': SECURE, 'Recommended': RECOMMENDED,
+                                    'Weak': WEAK, 'Insecure': INSECURE})
+
+
 def classify_cipher_suite(hexcode: str) -> str:
-    h = hexcode.lower()
-    if h.startswith('0x'):
-        h = h[2:]
-    h = h.zfill(4)
-    if h in SECURE:
-        return 'Secure'
-    elif h in RECOMMENDED:
-        return 'Recommended'
-    elif h in WEAK:
-        return 'Weak'
-    elif h in INSECURE:
-        return 'Insecure'
-    else:
+    code = cipher_table.normalize_hex(hexcode)
+    if code is None:
         return 'Unknown'
+    return cipher_table.CATEGORIES[_table()[code]]
 
-def process_file(filename, category_counts, cipher_counts):
-    with open(filename, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                packet = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-
-            tls = packet.get('layers', {}).get('tls', {})
-            cipher_list = []
-
-            if isinstance(tls, dict):
-                cipher_list = tls.get('tls_tls_handshake_ciphersuite_raw') or tls.get('tls_tls_handshake_ciphersuite')
-                if cipher_list and isinstance(cipher_list, str):
-                    cipher_list = cipher_list.split()
-            elif isinstance(tls, list):
-                for tls_entry in tls:
-                    if isinstance(tls_entry, dict):
-                        ciphers = tls_entry.get('tls_tls_handshake_ciphersuite_raw') or tls_entry.get('tls_tls_handshake_ciphersuite')
-                        if ciphers:
-                            if isinstance(ciphers, str):
-                                cipher_list.extend(ciphers.split())
-                            elif isinstance(ciphers, list):
-                                cipher_list.extend(ciphers)
-
-            if not cipher_list:
-                continue
-
-            for c in cipher_list:
-                c = c.strip().lower()
-                if not c:
-                    continue
-                if ',' in c:
-                    parts = [p.strip() for p in c.split(',') if p.strip()]
-                    for p in parts:
-                        cat = classify_cipher_suite(p)
-                        category_counts[cat] += 1
-                        cipher_counts[p] += 1
-                else:
-                    cat = classify_cipher_suite(c)
-                    category_counts[cat] += 1
-                    cipher_counts[c] += 1
-
-def main(root_dir):
-    category_counts = Counter()
+
+def category_counts_of(cipher_counts):
+    """Occurrences per category for a Counter of suite strings, classified in one table lookup."""
+    suites = list(cipher_counts)
+    cats = cipher_table.classify_hex(suites, _table())
+    totals = np.bincount(cats, weights=[cipher_counts[s] for s in suites], minlength=len(cipher_table.CATEGORIES))
+    return Counter({cat: int(n) for cat, n in zip(cipher_table.CATEGORIES, totals)})
+
+def main(root_dir, jobs=None):
     cipher_counts = Counter()
 
     # Walk through all folders and subfolders for .json files
+    filepaths = []
     for dirpath, _, filenames in os.walk(root_dir):
         for fname in filenames:
             if fname.endswith(".json"):
-                filepath = os.path.join(dirpath, fname)
-                print(f"Processing {filepath}...")
-                process_file(filepath, category_counts, cipher_counts)
+                filepaths.append(os.path.join(dirpath, fname))
+
+    # Files are scanned in parallel (each one streamed in bounded memory) and
+    # merged in walk order, so the report matches a sequential run
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = []
+        for filepath in filepaths:
+            print(f"Processing {filepath}...")
+            futures.append(pool.submit(ciphersuite.scan_file, filepath))
+        for filepath, future in zip(filepaths, futures):
+            try:
+                cipher_counts.update(future.result())
+            except (OSError, UnicodeDecodeError, ValueError) as e:
+                # one unreadable or malformed dump must not abort the whole scan
+                print(f"[!] Skipping {filepath}: {e}")
 
     if not cipher_counts:
         print("No cipher suites found in input.")
         return
 
+    category_counts = category_counts_of(cipher_counts)
+
     # --- Summary of occurrences ---
     print("\nSummary of categories (occurrences):")
     for cat in ["Secure", "Recommended", "Weak", "Insecure", "Unknown"]:
@@ -133,7 +109,7 @@ def main(root_dir):
         print(f"  {c} : {cat} ({count} occurrences)")
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print(f"Usage: python {sys.argv[0]} <folder_with_json_files>")
+    if len(sys.argv) not in (2, 3):
+        print(f"Usage: python {sys.argv[0]} <folder_with_json_files> [jobs]")
         sys.exit(1)
-    main(sys.argv[1])
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) == 3 else None)
@@ -3,8 +3,9 @@
 
 Usage:
   - Test with synthetic data: `python3 scripts/compute_entropy.py --test`
-  - Compute on a pcap (requires scapy):
+  - Compute on a pcap/pcapng (requires numpy, see src/pcap_reader.py):
     `python3 scripts/compute_entropy.py --pcap path/to/file.pcap --mode session`
+  - Add `--tls` to also list TLS handshakes parsed in the same pass (src/tls_parser.py)
 
 The script includes compact implementations and a fallback test that does not require pcaps.
 """
@@ -52,31 +53,84 @@ def entropy_from_bytes(data: bytes, renyi_alpha: float = 2.0, tsallis_q: float =
         "tsallis": tsallis_entropy(data, tsallis_q),
     }
 
-def process_pcap_sessions(pcap_path: str, renyi_alpha: float=2.0, tsallis_q: float=1.5):
+def _shrink_compute():
+    """intl-iot/encryption/shrink_compute.py, which holds the one vectorized
+    histogram and entropy kernel shared by both entropy scripts."""
+    import os
+    import sys
+    encryption_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'intl-iot', 'encryption')
+    if encryption_dir not in sys.path:
+        sys.path.insert(0, encryption_dir)
+    import shrink_compute
+    return shrink_compute
+
+def entropies_batch(buf, offsets, renyi_alpha: float = 2.0, tsallis_q: float = 1.5):
+    """Shannon/Rényi/Tsallis for many payloads in one vectorized pass.
+
+    `buf` holds the concatenated payloads and `offsets` the n+1 boundaries
+    (payload i is buf[offsets[i]:offsets[i+1]]). Returns three float arrays
+    normalized like the scalar functions above; empty payloads give 0.
+    """
+    return entropies_from_counts(_shrink_compute().byte_histograms(buf, offsets), renyi_alpha, tsallis_q)
+
+def entropies_from_counts(counts, renyi_alpha: float = 2.0, tsallis_q: float = 1.5):
+    """Shannon/Rényi/Tsallis from an (n, 256) array of byte-value counts, so
+    running histograms can be scored without keeping the payloads.
+
+    Runs shrink_compute.entropies_from_counts in base 256 (bits / 8) and
+    applies this script's conventions on top: Tsallis is normalized by its
+    maximum over 256 symbols, and payloads under 2 bytes give 0 instead of -1.
+    """
+    import numpy as np
+    counts = np.atleast_2d(counts)
+    shannon, renyi, tsallis = _shrink_compute().entropies_from_counts(counts, renyi_alpha, tsallis_q, 256)
+    if tsallis_q == 1.0:
+        tsallis = shannon.copy()
+    else:
+        max_ent = (1.0 - 256 * (1.0 / 256.0) ** tsallis_q) / (tsallis_q - 1.0)
+        tsallis = tsallis / max_ent if max_ent != 0 else np.zeros_like(tsallis)
+    short = counts.sum(axis=1) < 2
+    for arr in (shannon, renyi, tsallis):
+        arr[short] = 0.0
+    return shannon, renyi, tsallis
+
+def process_pcap_sessions(pcap_path: str, renyi_alpha: float=2.0, tsallis_q: float=1.5, tls_tracker=None):
+    """Entropy per 5-tuple session. When `tls_tracker` (a
+    tls_parser.TLSConnectionTracker) is given, TLS handshakes are parsed from
+    the same pass over the frames into `tls_tracker.records`."""
     try:
-        from scapy.all import rdpcap, Raw
+        from pcap_reader import PcapFile, format_addr, IPPROTO_TCP
+        from tls_parser import TCP_SYN
     except Exception as e:
-        raise RuntimeError("scapy is required to process pcaps. Install from requirements.") from e
-    packets = rdpcap(pcap_path)
+        raise RuntimeError("numpy is required to process pcaps. Install from requirements.") from e
     # simple session grouping: aggregate payload per 5-tuple (src,dst,sport,dport,proto)
     sessions = {}
-    for pkt in packets:
-        try:
-            proto = pkt.payload.name
-            key = (pkt[0].src, pkt[0].dst, pkt.sport if hasattr(pkt, 'sport') else None,
-                   pkt.dport if hasattr(pkt, 'dport') else None, proto)
-        except Exception:
-            key = ('unknown',)
-        raw = None
-        try:
-            raw = bytes(pkt[Raw].load)
-        except Exception:
-            raw = b''
-        sessions.setdefault(key, bytearray()).extend(raw)
-    # compute entropies per session
+    with PcapFile(pcap_path) as cap:
+        frames = cap.frames
+        for i, f in enumerate(frames):
+            if f['ip_version']:
+                key = (format_addr(f['src'], f['ip_version']), format_addr(f['dst'], f['ip_version']),
+                       int(f['sport']) if f['l4_offset'] else None,
+                       int(f['dport']) if f['l4_offset'] else None, int(f['ip_proto']))
+            else:
+                key = ('unknown',)
+            payload = sessions.setdefault(key, bytearray())
+            if f['payload_len']:
+                payload.extend(cap.payload(i))
+            if tls_tracker is not None and f['l4_offset'] and f['ip_proto'] == IPPROTO_TCP:
+                syn = bool(f['tcp_flags'] & TCP_SYN)
+                if syn or f['payload_len']:
+                    tls_tracker.feed(key[0], key[1], key[2], key[3], int(f['tcp_seq']), cap.payload(i),
+                                     float(f['ts']), syn)
+    # compute entropies for all sessions in one batch
+    keys = list(sessions)
+    offsets = [0]
+    for key in keys:
+        offsets.append(offsets[-1] + len(sessions[key]))
+    shannon, renyi, tsallis = entropies_batch(b''.join(sessions.values()), offsets, renyi_alpha, tsallis_q)
     results = []
-    for key, payload in sessions.items():
-        e = entropy_from_bytes(bytes(payload), renyi_alpha, tsallis_q)
+    for i, key in enumerate(keys):
+        e = {"shannon": float(shannon[i]), "renyi": float(renyi[i]), "tsallis": float(tsallis[i])}
         results.append((key, e))
     return results
 
@@ -99,14 +153,25 @@ def main():
     parser.add_argument('--alpha', type=float, default=2.0, help='Rényi alpha')
     parser.add_argument('--q', type=float, default=1.5, help='Tsallis q')
     parser.add_argument('--test', action='store_true', help='Run synthetic tests')
+    parser.add_argument('--tls', action='store_true', help='Also list TLS handshakes found in the same pass')
     args = parser.parse_args()
     if args.test:
         run_test()
         return
     if args.pcap:
-        res = process_pcap_sessions(args.pcap, args.alpha, args.q)
+        tracker = None
+        if args.tls:
+            from tls_parser import TLSConnectionTracker
+            tracker = TLSConnectionTracker(certificates=False)
+        res = process_pcap_sessions(args.pcap, args.alpha, args.q, tracker)
         for key, e in res:
             print(key, e)
+        if tracker is not None:
+            for rec in tracker.records:
+                if rec['type'] in (1, 2):
+                    print(rec['tcp_stream'], rec['ip_src'], 'ClientHello' if rec['type'] == 1 else 'ServerHello',
+                          rec['sni'] or (f"0x{rec['cipher']:04x}" if rec['cipher'] >= 0 else '-'),
+                          rec['ja3'] or rec['ja3s'])
     else:
         parser.print_help()
 
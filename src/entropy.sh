@@ -2,6 +2,9 @@
 
 #Usage: .src/entropy.sh 
 #Usage: .src/entropy.sh [--skip-json]  if the the file is too large and you want to skip the json file generation, which can be time-consuming. The CSV file will still be generated as usual.]
+#       With --skip-json, shrink_compute.py reads the pcap through a tshark -T fields pipe (see its --pcap mode).
+#Parallel, resumable alternative (splits large pcaps across workers):
+#       python3 src/parallel_entropy.py <input_folder> <output_folder> -j 8
 
 
 # Parse command line arguments
@@ -11,11 +11,11 @@
 import os
 import argparse
 import pathlib
-import uuid
-import pickle
-import subprocess
 from joblib import Parallel, delayed
-import pyshark
+
+import extraction_manifest
+import metadata_store
+import pcap_decoder
 
 
 parser = argparse.ArgumentParser(description='Analyze Packet Files')
@@ -29,49 +29,19 @@ walk_dir = os.path.abspath(args.dir)
 out_dir = os.path.abspath(args.out)
 
 PCAP_EXT = '.pcap'
+EXTRACTOR = 'extract_all'
+# Bump when the output format changes so existing results are redone
+EXTRACTOR_VERSION = 2
 
 EXTRACTED_OBJS_DIR = out_dir
 print("Extracting objects to ", EXTRACTED_OBJS_DIR)
 pathlib.Path(EXTRACTED_OBJS_DIR).mkdir(parents=True, exist_ok=True)
 
-file_metadata = []
-jobs = []
-
-def extract_packets_by_filter(packet_file, filter_exp):
-    collected_packets = []
-    packets = pyshark.FileCapture(packet_file, display_filter=filter_exp, use_json=True, custom_parameters=["-Y", "ssl.handshake.ciphersuites"])
-    try:
-        for pkt in packets:
-            try:
-                ip_src = pkt.ip.src if hasattr(pkt, 'ip') else None
-                ssl_layer = pkt.ssl if hasattr(pkt, 'ssl') else None
-
-                if ssl_layer and hasattr(ssl_layer, 'handshake_version') and hasattr(ssl_layer, 'handshake_type'):
-                    handshake_version = ssl_layer.handshake_version
-                    handshake_type = ssl_layer.handshake_type
-                    ciphersuite = getattr(ssl_layer, 'handshake_ciphersuite', None)
-
-                    collected_packets.append({
-                        "SSL": {
-                            'ssl.handshake.version': handshake_version,
-                            'ssl.handshake.type': handshake_type,
-                            'ssl.handshake.ciphersuite': ciphersuite
-                        },
-                        "IP": {
-                            'ip.src': ip_src
-                        }
-                    })
-            except Exception as e:
-                print(f"[!] Packet parse error: {e}")
-    finally:
-        packets.close()
-    return collected_packets
-
-
 def do_export(job, job_count):
-    dir_uuid = job['dir_uuid']
-    filename = job['filename']
     file_path = job['filepath']
+    content_sha256 = extraction_manifest.file_sha256(file_path)
+    dir_uuid = extraction_manifest.output_id(file_path, EXTRACTOR, EXTRACTOR_VERSION)
+    filename = job['filename']
     root_segments = job['root_segments']
     root_segments_len = len(root_segments)
 
@@ -80,8 +50,22 @@ def do_export(job, job_count):
 
     is_idle = '/iot-idle/' in file_path
 
-    server_hello_packets = extract_packets_by_filter(file_path, "ssl.handshake.type == 2")
-    client_hello_packets = extract_packets_by_filter(file_path, "ssl.handshake.type == 1")
+    object_out_dir = os.path.join(EXTRACTED_OBJS_DIR, dir_uuid)
+    os.makedirs(object_out_dir, exist_ok=True)
+
+    # One tshark pass collects both hello types, exports HTTP objects and
+    # dumps the entire PCAP as JSON for full packet details
+    decoder = pcap_decoder.FrameDecoder()
+    tls = decoder.register(pcap_decoder.TLSHandshakeConsumer())
+    decoder.register(pcap_decoder.HTTPObjectConsumer(object_out_dir))
+    decoder.register(pcap_decoder.JSONDumpConsumer(os.path.join(object_out_dir, filename + ".json")))
+    if not decoder.run(file_path):
+        # Recorded as failed so the next run retries it
+        print(f"[!] Tshark failed on file {file_path}")
+        return file_path, content_sha256, None, extraction_manifest.STATUS_FAILED
+    hellos = tls.result()
+    server_hello_packets = [pcap_decoder.to_ssl_record(r) for r in hellos['server_hello_packets']]
+    client_hello_packets = [pcap_decoder.to_ssl_record(r) for r in hellos['client_hello_packets']]
 
     if is_idle:
         metadata = {
@@ -106,42 +90,23 @@ def do_export(job, job_count):
             'pcap': file_path
         }
 
-    object_out_dir = os.path.join(EXTRACTED_OBJS_DIR, dir_uuid)
-    os.makedirs(object_out_dir, exist_ok=True)
+    return file_path, content_sha256, metadata, extraction_manifest.STATUS_DONE
 
-    # Dump entire PCAP as JSON for full packet details
-    try:
-        json_path = os.path.join(object_out_dir, filename + ".json")
-        with open(json_path, "w") as json_out:
-            subprocess.run([
-                "tshark",
-                "-r", file_path,
-                "-T", "json"
-            ], stdout=json_out, stderr=subprocess.DEVNULL, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"[!] Tshark JSON dump failed on file {file_path} with error: {e}")
-
-    # Extract HTTP objects if any (optional)
-    try:
-        subprocess.run([
-            "tshark",
-            "-nr", file_path,
-            "--export-objects", f"http,{object_out_dir}"
-        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"[!] Tshark HTTP export failed on file {file_path} with error: {e}")
-
-    return metadata
 
+manifest = extraction_manifest.Manifest(out_dir, EXTRACTOR, EXTRACTOR_VERSION)
 
 job_id = 0
-for root, subdirs, files in os.walk(walk_dir):
+jobs = []
+pcap_paths = []
+for root, _, files in os.walk(walk_dir):
     for filename in files:
         if filename.lower().endswith(PCAP_EXT):
             file_path = os.path.join(root, filename)
+            pcap_paths.append(file_path)
+            if manifest.is_done(file_path):
+                continue
             jobs.append({
                 'job_id': job_id,
-                'dir_uuid': str(uuid.uuid4()),
                 'filename': filename,
                 'filepath': file_path,
                 'root_segments': root.split(os.sep)
@@ -149,9 +114,14 @@ for root, subdirs, files in os.walk(walk_dir):
             job_id += 1
 
 job_count = len(jobs)
-print("Begin parallel execution")
-file_metadata = Parallel(n_jobs=5)(delayed(do_export)(job, job_count) for job in jobs)
+print(f"Total jobs to process: {job_count} ({len(pcap_paths) - job_count} unchanged, skipped)")
+
+# Record every job as soon as it finishes so an interrupted run can resume
+results = Parallel(n_jobs=5, return_as='generator_unordered')(delayed(do_export)(job, job_count) for job in jobs)
+for file_path, content_sha256, metadata, status in results:
+    manifest.record(file_path, content_sha256, metadata, status)
+
+file_metadata = manifest.results(pcap_paths)
 
-with open(os.path.join(out_dir, 'file_metadata.pickle'), 'wb') as f:
-    pickle.dump(file_metadata, f)
-    print("The pickle has been tickled")
+metadata_store.write_metadata(out_dir, file_metadata)
+print("[+] Metadata saved to", metadata_store.STORE_NAME)
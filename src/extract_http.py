@@ -12,10 +12,10 @@ import os
 import argparse
 import pathlib
 import uuid
-import pickle
-import subprocess
 from joblib import Parallel, delayed
-import pyshark
+
+import metadata_store
+import pcap_decoder
 
 
 #
@@ -48,41 +48,6 @@ file_metadata = []
 jobs = []
 
 
-# Function to extract packets based on a display filter
-# This function collects SSL handshake packets and their details
-# It uses pyshark to read the PCAP file and applies the specified display filter
-# It returns a list of dictionaries containing SSL handshake details and source IP addresses
-def extract_packets_by_filter(packet_file, filter_exp):
-    collected_packets = []
-    packets = pyshark.FileCapture(packet_file, display_filter=filter_exp, use_json=True, custom_parameters=["-Y", "ssl.handshake.ciphersuites"])
-    try:
-        for pkt in packets:
-            try:
-                ip_src = pkt.ip.src if hasattr(pkt, 'ip') else None
-                ssl_layer = pkt.ssl if hasattr(pkt, 'ssl') else None
-
-                if ssl_layer and hasattr(ssl_layer, 'handshake_version') and hasattr(ssl_layer, 'handshake_type'):
-                    handshake_version = ssl_layer.handshake_version
-                    handshake_type = ssl_layer.handshake_type
-                    ciphersuite = getattr(ssl_layer, 'handshake_ciphersuite', None)
-
-                    collected_packets.append({
-                        "SSL": {
-                            'ssl.handshake.version': handshake_version,
-                            'ssl.handshake.type': handshake_type,
-                            'ssl.handshake.ciphersuite': ciphersuite
-                        },
-                        "IP": {
-                            'ip.src': ip_src
-                        }
-                    })
-            except Exception as e:
-                print(f"[!] Packet parse error: {e}")
-    finally:
-        packets.close()
-    return collected_packets
-
-
 # Function to process each job in parallel
 # This function extracts server and client hello packets from the PCAP file
 # It constructs metadata based on the directory structure and the type of action (idle or not)
@@ -102,8 +67,18 @@ def do_export(job, job_count):
 
     is_idle = '/iot-idle/' in file_path
 
-    server_hello_packets = extract_packets_by_filter(file_path, "ssl.handshake.type == 2")
-    client_hello_packets = extract_packets_by_filter(file_path, "ssl.handshake.type == 1")
+    object_out_dir = os.path.join(EXTRACTED_OBJS_DIR, dir_uuid)
+    os.makedirs(object_out_dir, exist_ok=True)
+
+    # One tshark pass collects both hello types and exports HTTP objects
+    decoder = pcap_decoder.FrameDecoder()
+    tls = decoder.register(pcap_decoder.TLSHandshakeConsumer())
+    decoder.register(pcap_decoder.HTTPObjectConsumer(object_out_dir))
+    if not decoder.run(file_path):
+        print(f"[!] Tshark failed on file {file_path}")
+    hellos = tls.result()
+    server_hello_packets = [pcap_decoder.to_ssl_record(r) for r in hellos['server_hello_packets']]
+    client_hello_packets = [pcap_decoder.to_ssl_record(r) for r in hellos['client_hello_packets']]
 
     if is_idle:
         metadata = {
@@ -128,27 +103,6 @@ def do_export(job, job_count):
             'pcap': file_path
         }
 
-    object_out_dir = os.path.join(EXTRACTED_OBJS_DIR, dir_uuid)
-    os.makedirs(object_out_dir, exist_ok=True)  # Ensure output directory exists
-
-
-    # This command extracts HTTP objects from the PCAP file and saves them to the specified directory
-    # Suppress stdout and stderr to avoid cluttering the console
-    # subprocess.run(["tshark", "-v"], check=True)  # Check if tshark is available
-    # If tshark is not available, it will raise an error
-    # If tshark is available, it will run the command to export HTTP objects
-    # This is useful for extracting files transferred over HTTP in the PCAP file
-    #
-
-    try:
-        subprocess.run([
-            "tshark",
-            "-nr", file_path,
-            "--export-objects", f"http,{object_out_dir}"
-        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"[!] Tshark failed on file {file_path} with error: {e}")
-
     return metadata
 
 
@@ -181,6 +135,5 @@ job_count = len(jobs)
 print("Begin parallel execution")
 file_metadata = Parallel(n_jobs=5)(delayed(do_export)(job, job_count) for job in jobs)
 
-with open(os.path.join(out_dir, 'file_metadata.pickle'), 'wb') as f:
-    pickle.dump(file_metadata, f)
-    print("The pickle has been tickled")
+metadata_store.write_metadata(out_dir, file_metadata)
+print("[+] Metadata saved to", metadata_store.STORE_NAME)
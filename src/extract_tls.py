@@ -7,12 +7,17 @@
 import os
 import argparse
 import pathlib
-import uuid
-import pickle
-import json
+from collections import Counter
 from joblib import Parallel, delayed
 import pyshark
 
+import extraction_manifest
+import metadata_store
+import pcap_reader
+import tls_fingerprints
+import tls_parser
+import tls_records
+
 
 import time
 
@@ -21,60 +26,78 @@ start = time.perf_counter()
 parser = argparse.ArgumentParser(description='Analyze Packet Files')
 parser.add_argument('dir', type=str, help='Directory of pcaps to recursively search through')
 parser.add_argument('out', type=str, help='Directory to dump result files to')
+parser.add_argument('--native', action='store_true',
+                    help='Parse TLS from the reassembled TCP payload (tls_parser.py) instead of tshark')
 
 args = parser.parse_args()
 walk_dir = os.path.abspath(args.dir)
 out_dir = os.path.abspath(args.out)
 
 PCAP_EXT = '.pcap'
+EXTRACTOR = 'extract_tls_native' if args.native else 'extract_tls'
+# Bump when the output format changes so existing results are redone
+EXTRACTOR_VERSION = 5
 EXTRACTED_OBJS_DIR = out_dir
 print("Extracting objects to:", EXTRACTED_OBJS_DIR)
 pathlib.Path(EXTRACTED_OBJS_DIR).mkdir(parents=True, exist_ok=True)
 
-def extract_tls_handshake(packet_file, handshake_type):
-    collected_packets = []
-    # We do NOT print detailed info here anymore
+# Handshake message types collected in the single pass
+HANDSHAKE_TYPES = {
+    1: 'client_hello',
+    2: 'server_hello',
+    11: 'certificate',
+    12: 'server_key_exchange',
+    16: 'client_key_exchange',
+}
+HANDSHAKE_FILTER = "tls.handshake.type in {%s}" % ' '.join(str(t) for t in HANDSHAKE_TYPES)
+
+
+def extract_tls_handshakes(packet_file, uuid):
+    """Collect every handshake message of interest in one tshark pass as
+    compact rows (see tls_records.py), one per message, keyed by tcp.stream.
+    Returns (table, ok); ok is False when the capture could not be read."""
+    table = tls_records.HandshakeTable()
     try:
         packets = pyshark.FileCapture(
             packet_file,
-            display_filter=f"tls.handshake.type == {handshake_type}",
+            display_filter=HANDSHAKE_FILTER,
             use_json=True
         )
         for pkt in packets:
-            # Collect detailed layer info per packet
-            packet_layers = []
-            for layer in pkt.layers:
-                # layer._all_fields is dict of all fields
-                layer_info = {
-                    "layer_name": layer.layer_name,
-                    "fields": dict(layer._all_fields)
-                }
-                packet_layers.append(layer_info)
-
             ip_src = pkt.ip.src if hasattr(pkt, 'ip') else None
-            tls_layer = pkt.tls if hasattr(pkt, 'tls') else None
-
-            if tls_layer:
-                collected_packets.append({
-                    "layers": packet_layers,
-                    "TLS": {
-                        'tls.handshake.version': getattr(tls_layer, 'handshake_version', None),
-                        'tls.handshake.type': getattr(tls_layer, 'handshake_type', None),
-                        'tls.handshake.ciphersuite': getattr(tls_layer, 'handshake_ciphersuite', None)
-                    },
-                    "IP": {
-                        'ip.src': ip_src
-                    }
-                })
+            tcp_stream = int(pkt.tcp.stream) if hasattr(pkt, 'tcp') else -1
+            ts = float(pkt.sniff_timestamp)
+            for layer in pkt.layers:
+                if layer.layer_name not in ('tls', 'ssl'):
+                    continue
+                # one TLS layer can carry several messages, e.g. ServerHello + Certificate
+                for rec in tls_records.handshake_records(dict(layer._all_fields)):
+                    if rec['type'] in HANDSHAKE_TYPES:
+                        table.append(rec, uuid=uuid, ip_src=ip_src, tcp_stream=tcp_stream, ts=ts)
         packets.close()
     except Exception as e:
         print(f"[!] Error processing {packet_file}: {e}")
-    return collected_packets
+        return table, False
+    return table, True
+
+
+def extract_tls_handshakes_native(packet_file, uuid):
+    """Same rows as extract_tls_handshakes, parsed without tshark."""
+    table = tls_records.HandshakeTable()
+    try:
+        for rec in tls_parser.parse_pcap(packet_file, certificates=False):
+            if rec['type'] in HANDSHAKE_TYPES or rec['type'] == tls_records.FIRST_APP_DATA:
+                table.append(rec, uuid=uuid)
+    except (pcap_reader.PcapFormatError, OSError) as e:
+        print(f"[!] Error processing {packet_file}: {e}")
+        return table, False
+    return table, True
 
 def do_export(job, job_count):
-    dir_uuid = job['dir_uuid']
-    filename = job['filename']
     file_path = job['filepath']
+    content_sha256 = extraction_manifest.file_sha256(file_path)
+    dir_uuid = extraction_manifest.output_id(file_path, EXTRACTOR, EXTRACTOR_VERSION)
+    filename = job['filename']
     root_segments = job['root_segments']
     root_segments_len = len(root_segments)
 
@@ -83,13 +106,19 @@ def do_export(job, job_count):
 
     is_idle = '/iot-data/' in file_path
 
-    client_hello = extract_tls_handshake(file_path, 1)
-    server_hello = extract_tls_handshake(file_path, 2)
+    if args.native:
+        table, ok = extract_tls_handshakes_native(file_path, dir_uuid)
+    else:
+        table, ok = extract_tls_handshakes(file_path, dir_uuid)
+    if not ok:
+        # Recorded as failed so the next run retries it
+        return file_path, content_sha256, None, extraction_manifest.STATUS_FAILED
+    type_counts = Counter(row['type'] for row in table.rows)
 
     # Skip saving if no TLS handshake info
-    if not client_hello and not server_hello:
+    if not type_counts[1] and not type_counts[2]:
         print(f"[!] No TLS handshake packets found in {file_path}")
-        return None
+        return file_path, content_sha256, None, extraction_manifest.STATUS_DONE
 
     if is_idle:
         metadata = {
@@ -110,32 +139,36 @@ def do_export(job, job_count):
 
     metadata.update({
         'pcap': file_path,
-        'client_hello_count': len(client_hello),
-        'server_hello_count': len(server_hello)
+        'client_hello_count': type_counts[1],
+        'server_hello_count': type_counts[2],
+        'certificate_count': type_counts[11],
+        'key_exchange_count': type_counts[12] + type_counts[16],
+        'tcp_stream_count': len(set(row['tcp_stream'] for row in table.rows))
     })
 
-    # Create output folder and save TLS JSON if info exists
+    # Create output folder and save the handshake records if info exists
     object_out_dir = os.path.join(EXTRACTED_OBJS_DIR, dir_uuid)
     os.makedirs(object_out_dir, exist_ok=True)
 
-    tls_out_path = os.path.join(object_out_dir, 'tls_handshake.json')
-    with open(tls_out_path, 'w') as f:
-        json.dump({
-            'client_hello_packets': client_hello,
-            'server_hello_packets': server_hello
-        }, f, indent=2)
+    tls_records.save(os.path.join(object_out_dir, tls_records.RECORDS_NAME), table.to_arrays())
+
+    return file_path, content_sha256, metadata, extraction_manifest.STATUS_DONE
 
-    return metadata
+
+manifest = extraction_manifest.Manifest(out_dir, EXTRACTOR, EXTRACTOR_VERSION)
 
 job_id = 0
 jobs = []
+pcap_paths = []
 for root, _, files in os.walk(walk_dir):
     for filename in files:
         if filename.lower().endswith(PCAP_EXT):
             file_path = os.path.join(root, filename)
+            pcap_paths.append(file_path)
+            if manifest.is_done(file_path):
+                continue
             jobs.append({
                 'job_id': job_id,
-                'dir_uuid': str(uuid.uuid4()),
                 'filename': filename,
                 'filepath': file_path,
                 'root_segments': root.split(os.sep)
@@ -143,16 +176,23 @@ for root, _, files in os.walk(walk_dir):
             job_id += 1
 
 job_count = len(jobs)
-print(f"Total jobs to process: {job_count}")
+print(f"Total jobs to process: {job_count} ({len(pcap_paths) - job_count} unchanged, skipped)")
+
+# Record every job as soon as it finishes so an interrupted run can resume
+results = Parallel(n_jobs=5, return_as='generator_unordered')(delayed(do_export)(job, job_count) for job in jobs)
+for file_path, content_sha256, metadata, status in results:
+    manifest.record(file_path, content_sha256, metadata, status)
+
+file_metadata = manifest.results(pcap_paths)
 
-file_metadata = Parallel(n_jobs=5)(delayed(do_export)(job, job_count) for job in jobs)
+metadata_store.write_metadata(out_dir, file_metadata)
+print("[+] Metadata saved to", metadata_store.STORE_NAME)
 
-# Filter out jobs where no TLS data was found (None)
-file_metadata = [m for m in file_metadata if m is not None]
+tls_records.write_run_table(out_dir, [m['uuid'] for m in file_metadata])
+print("[+] Handshake records saved to", tls_records.RUN_TABLE)
 
-with open(os.path.join(out_dir, 'file_metadata.pickle'), 'wb') as f:
-    pickle.dump(file_metadata, f)
-    print("[+] Metadata saved to file_metadata.pickle")
+tls_fingerprints.write_index(out_dir)
+print("[+] Fingerprint index saved to", tls_fingerprints.INDEX_NAME)
 
 print("[+] TLS extraction completed.")
 
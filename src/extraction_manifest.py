@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Manifest that makes extraction runs incremental.
+
+Each pcap gets an output id derived from its path plus the extractor name
+and version, so reruns write to the same directory instead of a fresh
+uuid4. The id is not derived from the contents: captures from different
+devices can be byte-identical (empty or header-only idle pcaps) and must
+still get their own directory and metadata row. The SHA-256 of the contents
+is only recorded in the manifest for change detection.
+
+Finished jobs are appended to `manifest.jsonl` in the output directory as
+soon as they complete; a rerun skips every pcap whose path, size and mtime
+still match a recorded entry for the same extractor version (or whose
+content still matches when only the mtime changed), and a crash
+only loses the jobs that were in flight. Jobs recorded as failed are
+retried on the next run.
+
+Used by extract_all.py and extract_tls.py:
+
+    manifest = Manifest(out_dir, 'extract_tls', EXTRACTOR_VERSION)
+    if manifest.is_done(path): ...
+    manifest.record(path, content_sha256, metadata)
+    file_metadata = manifest.results(paths)
+"""
+
+import hashlib
+import json
+import os
+import uuid
+
+MANIFEST_NAME = 'manifest.jsonl'
+HASH_CHUNK = 1 << 20
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+def output_id(pcap_path, extractor, version):
+    """Stable, uuid-shaped id for one pcap path under one extractor version."""
+    pcap_path = os.path.abspath(pcap_path)
+    digest = hashlib.sha256(f"{extractor}:{version}:{pcap_path}".encode()).hexdigest()
+    return str(uuid.UUID(hex=digest[:32]))
+
+
+class Manifest(object):
+    def __init__(self, out_dir, extractor, version):
+        self.path = os.path.join(out_dir, MANIFEST_NAME)
+        self.extractor = extractor
+        self.version = version
+        self.entries = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # partial line from an interrupted write
+                if entry.get('extractor') == self.extractor and entry.get('version') == self.version:
+                    self.entries[entry['pcap']] = entry
+
+    @staticmethod
+    def _stat(pcap_path):
+        st = os.stat(pcap_path)
+        return st.st_size, st.st_mtime_ns
+
+    def is_done(self, pcap_path):
+        """True when pcap_path has a finished entry and is unchanged: same size
+        and mtime, or same size and content after only the mtime changed
+        (copied or touched captures are not redone)."""
+        entry = self.entries.get(pcap_path)
+        if entry is None or entry.get('status', STATUS_DONE) != STATUS_DONE:
+            return False
+        try:
+            size, mtime_ns = self._stat(pcap_path)
+            if (entry['size'], entry['mtime_ns']) == (size, mtime_ns):
+                return True
+            if entry['size'] != size or not entry.get('sha256'):
+                return False
+            if file_sha256(pcap_path) != entry['sha256']:
+                return False
+        except OSError:
+            return False
+        # refresh the mtime so the next run skips it without hashing
+        self._append(dict(entry, mtime_ns=mtime_ns))
+        return True
+
+    def output_id(self, pcap_path):
+        return output_id(pcap_path, self.extractor, self.version)
+
+    def record(self, pcap_path, content_sha256, metadata, status=STATUS_DONE):
+        """Persist one finished job. `metadata` may be None for pcaps that
+        produced nothing; they are still skipped on the next run. Jobs
+        recorded with STATUS_FAILED are not skipped and yield no results."""
+        size, mtime_ns = self._stat(pcap_path)
+        entry = {
+            'pcap': pcap_path,
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'sha256': content_sha256,
+            'extractor': self.extractor,
+            'version': self.version,
+            'status': status,
+            'metadata': metadata,
+        }
+        self._append(entry)
+
+    def _append(self, entry):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries[entry['pcap']] = entry
+
+    def results(self, pcap_paths=None):
+        """Metadata of finished jobs (in `pcap_paths` order when given), skipping empty ones."""
+        paths = self.entries if pcap_paths is None else pcap_paths
+        results = []
+        for p in paths:
+            entry = self.entries.get(p)
+            if entry is None or entry.get('status', STATUS_DONE) != STATUS_DONE:
+                continue
+            if entry['metadata'] is not None:
+                results.append(entry['metadata'])
+        return results
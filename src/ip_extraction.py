@@ -7,7 +7,7 @@ from scapy.all import PcapReader, IP, IPv6
 
 # This script extracts unique communication pairs (source and destination IPs) from a given PCAP file, along with the count of packets exchanged between each pair. The results are saved to a CSV file.
 # Usage, write the input and the output file paths in the main function, change the ip and saved location and run the script. The output CSV will have three columns: source_ip, destination_ip, and packet_count.
-# For large files, uses tshark (Wireshark CLI tool) for efficiency. Fallback to streaming Scapy reader if needed.
+# For large files, uses tshark (Wireshark CLI tool) for efficiency. Falls back to the memory-mapped reader in pcap_reader.py, then to streaming Scapy.
 
 
 def extract_unique_contacts_tshark(pcap_file, filter_ips=None):
@@ -32,7 +32,7 @@ def extract_unique_contacts_tshark(pcap_file, filter_ips=None):
         
         if result.returncode != 0:
             print(f"Warning: tshark error - {result.stderr[:200]}")
-            return extract_unique_contacts_streaming(pcap_file, filter_ips)
+            return extract_unique_contacts_fallback(pcap_file, filter_ips)
         
         for line in result.stdout.strip().split('\n'):
             if not line:
@@ -56,10 +56,46 @@ def extract_unique_contacts_tshark(pcap_file, filter_ips=None):
     except FileNotFoundError:
         print("tshark not found. Install with: sudo apt-get install tshark")
         print("Falling back to streaming reader...")
-        return extract_unique_contacts_streaming(pcap_file, filter_ips)
+        return extract_unique_contacts_fallback(pcap_file, filter_ips)
     except Exception as e:
         print(f"tshark error: {e}. Using streaming reader...")
-        return extract_unique_contacts_streaming(pcap_file, filter_ips)
+        return extract_unique_contacts_fallback(pcap_file, filter_ips)
+
+
+def extract_unique_contacts_native(pcap_file, filter_ips=None):
+    """
+    Extract unique communication pairs with the memory-mapped pcap reader.
+    Headers are parsed in bulk with NumPy, no per-packet objects are built.
+
+    Args:
+        pcap_file (str): path to pcap file
+        filter_ips (set, optional): only include pairs where src or dst is in this set
+    Returns:
+        Counter: {(src,dst): packet_count}, or None if the reader is unavailable
+    """
+    try:
+        import pcap_reader
+    except ImportError:
+        return None
+
+    try:
+        with pcap_reader.PcapFile(pcap_file) as cap:
+            pairs = pcap_reader.ip_pair_counts(cap.frames)
+            print(f"Total packets processed: {len(cap.frames)}")
+    except Exception as e:
+        print(f"Error reading pcap: {e}")
+        return None
+
+    return Counter({(src, dst): count for (src, dst), count in pairs.items()
+                    if not filter_ips or src in filter_ips or dst in filter_ips})
+
+
+def extract_unique_contacts_fallback(pcap_file, filter_ips=None):
+    """Native reader first, then the Scapy streaming reader."""
+    contacts = extract_unique_contacts_native(pcap_file, filter_ips)
+    if contacts is not None:
+        return contacts
+    return extract_unique_contacts_streaming(pcap_file, filter_ips)
 
 
 def extract_unique_contacts_streaming(pcap_file, filter_ips=None):
@@ -108,7 +144,7 @@ def extract_unique_contacts_streaming(pcap_file, filter_ips=None):
 def extract_unique_contacts(pcap_file, filter_ips=None):
     """
     Extract unique communication pairs with packet counts.
-    Automatically uses best available method (tshark > streaming reader).
+    Automatically uses best available method (tshark > native reader > streaming reader).
     
     Args:
         pcap_file (str): path to pcap file
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Indexed store for extraction metadata, replacing file_metadata.pickle.
+
+The extractors (extract_all, extract_http, extract_tls) write one row per
+pcap to `file_metadata.sqlite` in their output directory. uuid is the
+primary key and device, region and action are indexed, so analyzers can
+look up a uuid or filter by device without loading and scanning the whole
+list. Any other metadata keys (hello packet lists, counters, ...) go to a
+JSON `extra` column that is only decoded when one of them is requested.
+
+Directories extracted before the store existed only have the pickle;
+`open_store` falls back to it transparently.
+
+    store = open_store(extracted_dir)
+    device = store.get(uuid, ['device'])['device']
+    for row in store.rows(['uuid', 'region']): ...
+"""
+
+import json
+import os
+import pickle
+import sqlite3
+
+STORE_NAME = 'file_metadata.sqlite'
+PICKLE_NAME = 'file_metadata.pickle'
+
+COLUMNS = ('uuid', 'dataset', 'region', 'device', 'action', 'pcap')
+INDEXED = ('device', 'region', 'action')
+
+
+def write_metadata(out_dir, file_metadata):
+    """(Re)write the store in out_dir from a list of metadata dicts.
+
+    uuids must be unique; a duplicate raises ValueError instead of silently
+    replacing the earlier row, and the previous store is left untouched."""
+    path = os.path.join(out_dir, STORE_NAME)
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    try:
+        with conn:
+            conn.execute('CREATE TABLE files (%s, extra TEXT)' %
+                         ', '.join(c + (' TEXT PRIMARY KEY' if c == 'uuid' else ' TEXT') for c in COLUMNS))
+            insert = 'INSERT INTO files VALUES (%s)' % ', '.join('?' * (len(COLUMNS) + 1))
+            for m in file_metadata:
+                extra = {k: v for k, v in m.items() if k not in COLUMNS}
+                try:
+                    conn.execute(insert, [m.get(c) for c in COLUMNS] + [json.dumps(extra) if extra else None])
+                except sqlite3.IntegrityError:
+                    raise ValueError(f"Duplicate uuid {m.get('uuid')} in metadata (pcap {m.get('pcap')})")
+            for c in INDEXED:
+                conn.execute(f'CREATE INDEX idx_files_{c} ON files ({c})')
+    except BaseException:
+        conn.close()
+        os.remove(tmp)
+        raise
+    conn.close()
+    os.replace(tmp, path)
+    return path
+
+
+class MetadataStore(object):
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        self.conn.row_factory = sqlite3.Row
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def _select(columns):
+        if columns is None:
+            return '*', True
+        cols = [c for c in columns if c in COLUMNS]
+        needs_extra = len(cols) != len(columns)
+        if needs_extra:
+            cols.append('extra')
+        return ', '.join(cols) or 'uuid', needs_extra
+
+    @staticmethod
+    def _to_dict(row, columns):
+        d = dict(row)
+        extra = d.pop('extra', None)
+        if extra:
+            d.update(json.loads(extra))
+        if columns is not None:
+            d = {c: d.get(c) for c in columns}
+        return d
+
+    def rows(self, columns=None, **filters):
+        """Yield metadata dicts with only `columns` (all when None),
+        optionally filtered on indexed fields, e.g. rows(['uuid'], device='echodot')."""
+        sel, _ = self._select(columns)
+        sql = f'SELECT {sel} FROM files'
+        if filters:
+            sql += ' WHERE ' + ' AND '.join(f'{k} = ?' for k in filters)
+        for row in self.conn.execute(sql, tuple(filters.values())):
+            yield self._to_dict(row, columns)
+
+    def get(self, uuid, columns=None):
+        sel, _ = self._select(columns)
+        row = self.conn.execute(f'SELECT {sel} FROM files WHERE uuid = ?', (uuid,)).fetchone()
+        return None if row is None else self._to_dict(row, columns)
+
+    def index(self, columns=None):
+        """Dict uuid -> metadata for repeated O(1) lookups."""
+        cols = None if columns is None else ['uuid'] + [c for c in columns if c != 'uuid']
+        return {row['uuid']: row for row in self.rows(cols)}
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+
+class PickleStore(object):
+    """Same query API over a legacy file_metadata.pickle."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.metadata = [m for m in pickle.load(f) if m is not None]
+        self._by_uuid = None
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _project(m, columns):
+        return dict(m) if columns is None else {c: m.get(c) for c in columns}
+
+    def rows(self, columns=None, **filters):
+        for m in self.metadata:
+            if all(m.get(k) == v for k, v in filters.items()):
+                yield self._project(m, columns)
+
+    def get(self, uuid, columns=None):
+        if self._by_uuid is None:
+            self._by_uuid = {m['uuid']: m for m in self.metadata}
+        m = self._by_uuid.get(uuid)
+        return None if m is None else self._project(m, columns)
+
+    def index(self, columns=None):
+        cols = None if columns is None else ['uuid'] + [c for c in columns if c != 'uuid']
+        return {m['uuid']: self._project(m, cols) for m in self.metadata}
+
+    def __len__(self):
+        return len(self.metadata)
+
+
+def open_store(extracted_dir):
+    """Open the metadata of an extraction directory (SQLite store, else pickle)."""
+    path = os.path.join(extracted_dir, STORE_NAME)
+    if os.path.exists(path):
+        return MetadataStore(path)
+    path = os.path.join(extracted_dir, PICKLE_NAME)
+    if os.path.exists(path):
+        return PickleStore(path)
+    raise FileNotFoundError(f"No {STORE_NAME} or {PICKLE_NAME} in {extracted_dir}")
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""Parallel per-packet entropy over a device folder, replacing the serial
+`while read` loop in entropy.sh.
+
+Every pcap is cut into shards of at most --frames-per-shard frames at record
+boundaries (indexed with pcap_reader, no dissection). Each shard is streamed
+into `tshark -r -` and scored with intl-iot/encryption/shrink_compute.py's
+tshark-fields pipeline on a ProcessPoolExecutor worker, so one huge
+controlled capture keeps all cores busy. Shard CSVs are merged in frame
+order into <out>/<device>/<pcap name>.csv, the same layout entropy.sh writes;
+pcaps in subfolders (or sharing a stem with another top-level pcap) get a
+short hash of their relative path appended so their outputs cannot collide.
+
+Finished shards are kept under <out>/<device>/.shards until their pcap is
+merged, so an interrupted run resumes where it stopped. Shard names carry a
+hash of --frames-per-shard and the pcap's size and mtime; shards from a run
+with a different plan, or of a pcap that changed since, are discarded. A shard whose tshark
+exits non-zero is not kept, so its pcap is reported incomplete and the
+shard is rerun next time.
+
+Note: packets are scored independently, but tshark only sees the frames of
+its own shard, so application-layer dissection of a TCP stream that
+straddles a shard boundary can differ from a whole-file run.
+
+Usage:
+  python3 src/parallel_entropy.py ~/update_traffic/controlled/dataset/dlink ~/update_traffic/controlled/entropy -j 8
+"""
+
+import argparse
+import hashlib
+import mmap
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pcap_reader
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'intl-iot', 'encryption'))
+import shrink_compute  # noqa: E402
+
+PCAP_EXTS = ('.pcap', '.pcapng')
+SHARD_DIR = '.shards'
+FEED_CHUNK = 1 << 22
+
+
+def plan_shards(pcap_file, frames_per_shard):
+    """Return a list of (start, end) byte ranges of whole records, or
+    [None] when the capture is read in one piece."""
+    with pcap_reader.PcapFile(pcap_file, parse=False) as cap:
+        n = len(cap.frames)
+        if n <= frames_per_shard or not cap.splittable:
+            return [None]
+        starts = cap.frames['record'][::frames_per_shard].tolist()
+        preamble_end = cap.preamble_end
+        size = len(cap.mm)
+    starts[0] = preamble_end
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def output_base(input_folder, pcap_file, top_level_bases):
+    """Name stem of a pcap's output and shard CSVs.
+
+    Pcaps directly in the input folder keep `<pcap name>` (entropy.sh's
+    layout) unless another top-level pcap has the same stem; everything else
+    gets a hash of its path relative to the input folder appended, so
+    same-named captures in different subfolders do not overwrite each other."""
+    base = os.path.splitext(os.path.basename(pcap_file))[0]
+    rel = os.path.relpath(pcap_file, input_folder)
+    if os.path.dirname(rel) == '' and top_level_bases[base] == 1:
+        return base
+    return f"{base}.{hashlib.sha256(rel.encode()).hexdigest()[:8]}"
+
+
+def shard_key(pcap_file, frames_per_shard):
+    """Short id of the shard plan: shards of an earlier run are only reused
+    when --frames-per-shard and the pcap's size and mtime are unchanged."""
+    st = os.stat(pcap_file)
+    plan = f"{frames_per_shard}:{st.st_size}:{st.st_mtime_ns}"
+    return hashlib.sha256(plan.encode()).hexdigest()[:8]
+
+
+def discard_stale_shards(shard_dir, base, shard_csvs):
+    """Remove shards of `base` left by a run with a different shard plan."""
+    pattern = re.compile(re.escape(base) + r'(\.[0-9a-f]{8})?\.\d{5}\.csv(\.part)?$')
+    keep = {os.path.basename(s) for s in shard_csvs}
+    for name in os.listdir(shard_dir):
+        if pattern.match(name) and name not in keep:
+            os.remove(os.path.join(shard_dir, name))
+
+
+def _feed(pcap_file, byte_range, stdin):
+    """Write the file preamble followed by one record range to tshark's stdin."""
+    start, end = byte_range
+    try:
+        with open(pcap_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with pcap_reader.PcapFile(pcap_file, parse=False) as cap:
+                preamble_end = cap.preamble_end
+            view = memoryview(mm)
+            stdin.write(view[:preamble_end])
+            for pos in range(start, end, FEED_CHUNK):
+                stdin.write(view[pos:min(pos + FEED_CHUNK, end)])
+            del view
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def run_shard(pcap_file, byte_range, shard_csv, legacy_decode=False):
+    """Compute entropies of one shard into shard_csv. Returns (rows, seconds)."""
+    shrink_compute.legacyDecode = legacy_decode
+    started = time.time()
+    part = shard_csv + '.part'
+
+    if byte_range is None:
+        cmd = shrink_compute.tshark_fields_cmd(pcap_file)
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        feeder = None
+    else:
+        cmd = shrink_compute.tshark_fields_cmd('-')
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, text=True)
+        # binary writes go through the underlying buffer of the text-mode pipe
+        feeder = threading.Thread(target=_feed, args=(pcap_file, byte_range, proc.stdin.buffer))
+        feeder.start()
+
+    try:
+        n_rows = shrink_compute.write_rows(part, shrink_compute.iter_tshark_fields(proc.stdout, pcap_file))
+    finally:
+        proc.stdout.close()
+        if feeder is not None:
+            feeder.join()
+    ret = proc.wait()
+    if ret != 0:
+        # leave the shard missing so the merge reports the pcap as incomplete
+        if os.path.exists(part):
+            os.remove(part)
+        raise RuntimeError(f"tshark exited with status {ret}")
+
+    if n_rows == 0:
+        with open(part, 'w') as f:
+            f.write(shrink_compute.result_header + '\n')
+    os.replace(part, shard_csv)
+    return n_rows, time.time() - started
+
+
+def merge_shards(shard_csvs, out_csv):
+    """Concatenate shard CSVs in order into out_csv, then remove them."""
+    tmp = out_csv + '.part'
+    n_rows = 0
+    with open(tmp, 'w', buffering=shrink_compute.WRITE_BUFFER) as out:
+        out.write(shrink_compute.result_header + '\n')
+        for shard in shard_csvs:
+            with open(shard) as f:
+                next(f, None)
+                for line in f:
+                    out.write(line)
+                    n_rows += 1
+    os.replace(tmp, out_csv)
+    for shard in shard_csvs:
+        os.remove(shard)
+    return n_rows
+
+
+def main():
+    p = argparse.ArgumentParser(description='Compute per-packet entropy for every pcap in a device folder in parallel')
+    p.add_argument('input_folder', help='Device folder containing pcap/pcapng files')
+    p.add_argument('output_folder', help='Entropy output folder; results go to <output_folder>/<device>/')
+    p.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Worker processes')
+    p.add_argument('--frames-per-shard', type=int, default=500000, help='Split pcaps larger than this many frames')
+    p.add_argument('--legacy-decode', action='store_true', help='Count UTF-8 characters instead of raw bytes')
+    args = p.parse_args()
+
+    input_folder = os.path.abspath(os.path.expanduser(args.input_folder))
+    device_name = os.path.basename(input_folder.rstrip(os.sep))
+    device_out = os.path.join(os.path.expanduser(args.output_folder), device_name)
+    shard_dir = os.path.join(device_out, SHARD_DIR)
+    os.makedirs(shard_dir, exist_ok=True)
+
+    pcaps = []
+    for root, _, files in os.walk(input_folder):
+        for filename in sorted(files):
+            if filename.lower().endswith(PCAP_EXTS):
+                pcaps.append(os.path.join(root, filename))
+
+    top_level_bases = Counter(os.path.splitext(os.path.basename(p))[0] for p in pcaps
+                              if os.path.dirname(p) == input_folder)
+
+    # --- plan: skip pcaps already merged, keep finished shards ---
+    plans = {}
+    jobs = []
+    for pcap_file in pcaps:
+        base = output_base(input_folder, pcap_file, top_level_bases)
+        out_csv = os.path.join(device_out, base + '.csv')
+        if os.path.exists(out_csv):
+            print(f"Skipping {pcap_file} (already done)")
+            continue
+        try:
+            ranges = plan_shards(pcap_file, args.frames_per_shard)
+        except (pcap_reader.PcapFormatError, OSError) as e:
+            print(f"[!] Cannot index {pcap_file}: {e}")
+            continue
+        shard_csvs = [os.path.join(shard_dir, f"{base}.{shard_key(pcap_file, args.frames_per_shard)}.{k:05d}.csv")
+                      for k in range(len(ranges))]
+        discard_stale_shards(shard_dir, base, shard_csvs)
+        plans[pcap_file] = (out_csv, shard_csvs)
+        for byte_range, shard_csv in zip(ranges, shard_csvs):
+            if not os.path.exists(shard_csv):
+                jobs.append((pcap_file, byte_range, shard_csv))
+
+    total_shards = sum(len(s) for _, s in plans.values())
+    print(f"{len(plans)} pcaps, {total_shards} shards, {total_shards - len(jobs)} already done")
+
+    # --- run ---
+    started = time.time()
+    done = total_shards - len(jobs)
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {pool.submit(run_shard, pcap_file, byte_range, shard_csv, args.legacy_decode): shard_csv
+                   for pcap_file, byte_range, shard_csv in jobs}
+        for future in as_completed(futures):
+            shard_csv = futures[future]
+            done += 1
+            try:
+                n_rows, seconds = future.result()
+                print(f"[{done}/{total_shards}] {os.path.basename(shard_csv)}: {n_rows} packets in {seconds:.1f}s"
+                      f" (elapsed {time.time() - started:.0f}s)")
+            except Exception as e:
+                print(f"[{done}/{total_shards}] {os.path.basename(shard_csv)} failed: {e}")
+
+    # --- merge in frame order ---
+    for pcap_file, (out_csv, shard_csvs) in plans.items():
+        if all(os.path.exists(s) for s in shard_csvs):
+            n_rows = merge_shards(shard_csvs, out_csv)
+            print(f"Results written to \"{out_csv}\" ({n_rows} packets).")
+        else:
+            print(f"[!] {pcap_file} incomplete, rerun to resume")
+
+
+if __name__ == '__main__':
+    main()
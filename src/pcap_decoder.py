@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""Decode a capture once and fan every frame out to registered consumers.
+
+The extractors in src/ (extract_all, extract_tls, extract_http, stream_size,
+protocol_extraction, ip_extraction) each used to start their own tshark or
+pyshark read of the same pcap. `FrameDecoder` runs a single
+`tshark -T fields` pass with the union of the fields every consumer asks for,
+streams the output line by line and hands each frame to every consumer.
+When a `JSONDumpConsumer` is registered the pass runs `tshark -T json`
+instead: the full packet dump is written to disk as it streams by and the
+other consumers get their fields from the decoded packets, so the dump does
+not need a second tshark run.
+
+Consumers:
+  - StreamSizeConsumer : bytes per tcp.stream (stream_size.py)
+  - ProtocolConsumer   : protocol histogram (protocol_extraction.py)
+  - IPPairConsumer     : (src, dst) packet counts (ip_extraction.py)
+  - TLSHandshakeConsumer : ClientHello / ServerHello records
+  - HTTPObjectConsumer : HTTP objects exported during the same pass
+  - JSONDumpConsumer   : full `tshark -T json` dump written during the same pass
+
+Example:
+  python3 src/pcap_decoder.py --pcap controlled/dataset/tapo/tapo.pcapng \
+    --out controlled/dataset/tapo/decoded --filter-ips 10.42.0.173
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+from collections import Counter, defaultdict
+
+import protocol_extraction
+
+
+FIELD_SEPARATOR = '\t'
+FIELD_AGGREGATOR = ','
+
+
+class FrameConsumer(object):
+    """Base class for consumers fed by `FrameDecoder`.
+
+    `fields` lists the tshark fields the consumer reads; `consume` receives a
+    dict of field name -> raw string value (empty when absent) for one frame.
+    """
+    fields = ()
+
+    def tshark_args(self):
+        return []
+
+    def consume(self, frame):
+        raise NotImplementedError
+
+    def result(self):
+        return None
+
+
+class StreamSizeConsumer(FrameConsumer):
+    fields = ('tcp.stream', 'frame.len')
+
+    def __init__(self):
+        self.stream_bytes = defaultdict(int)
+
+    def consume(self, frame):
+        stream = frame['tcp.stream']
+        frame_len = frame['frame.len']
+        if not stream or not frame_len:
+            return
+        try:
+            self.stream_bytes[int(stream)] += int(frame_len)
+        except ValueError:
+            pass
+
+    def result(self):
+        # remove streams with zero total bytes
+        return {s: b for s, b in self.stream_bytes.items() if b > 0}
+
+
+class ProtocolConsumer(FrameConsumer):
+    fields = ('frame.protocols', '_ws.col.Protocol')
+
+    def __init__(self):
+        self.proto_counter = Counter()
+
+    def consume(self, frame):
+        protocol_extraction.count_protocol_fields(
+            self.proto_counter, frame['frame.protocols'], frame['_ws.col.Protocol'])
+
+    def result(self):
+        return self.proto_counter
+
+
+class IPPairConsumer(FrameConsumer):
+    fields = ('ip.src', 'ip.dst', 'ipv6.src', 'ipv6.dst')
+
+    def __init__(self, filter_ips=None):
+        self.filter_ips = filter_ips
+        self.contact_counter = Counter()
+
+    def _add(self, src, dst):
+        if src and dst:
+            if not self.filter_ips or src in self.filter_ips or dst in self.filter_ips:
+                self.contact_counter[(src, dst)] += 1
+
+    def consume(self, frame):
+        self._add(frame['ip.src'], frame['ip.dst'])
+        self._add(frame['ipv6.src'], frame['ipv6.dst'])
+
+    def result(self):
+        return self.contact_counter
+
+
+class TLSHandshakeConsumer(FrameConsumer):
+    """Collects ClientHello (type 1) and ServerHello (type 2) messages."""
+    fields = ('ip.src', 'tcp.stream', 'tls.handshake.type',
+              'tls.handshake.version', 'tls.handshake.ciphersuite')
+
+    def __init__(self):
+        self.client_hello = []
+        self.server_hello = []
+
+    def consume(self, frame):
+        types = frame['tls.handshake.type']
+        if not types:
+            return
+        types = types.split(FIELD_AGGREGATOR)
+        versions = frame['tls.handshake.version'].split(FIELD_AGGREGATOR)
+        # first suite only: the selected one for a ServerHello and, as with the
+        # pyshark attribute the metadata was built from, the first offered one
+        # for a ClientHello
+        suite = frame['tls.handshake.ciphersuite'].split(FIELD_AGGREGATOR)[0]
+        for hs_type, target in (('1', self.client_hello), ('2', self.server_hello)):
+            if hs_type not in types:
+                continue
+            target.append({
+                'tls.handshake.version': versions[0] or None,
+                'tls.handshake.type': hs_type,
+                'tls.handshake.ciphersuite': suite or None,
+                'tcp.stream': frame['tcp.stream'] or None,
+                'ip.src': frame['ip.src'] or None,
+            })
+
+    def result(self):
+        return {'client_hello_packets': self.client_hello,
+                'server_hello_packets': self.server_hello}
+
+
+def to_ssl_record(record):
+    """Convert a `TLSHandshakeConsumer` record to the {"SSL": ..., "IP": ...}
+    layout stored in file_metadata.pickle by extract_all / extract_http."""
+    return {
+        "SSL": {
+            'ssl.handshake.version': record['tls.handshake.version'],
+            'ssl.handshake.type': record['tls.handshake.type'],
+            'ssl.handshake.ciphersuite': record['tls.handshake.ciphersuite']
+        },
+        "IP": {
+            'ip.src': record['ip.src']
+        }
+    }
+
+
+class HTTPObjectConsumer(FrameConsumer):
+    """Exports HTTP objects to `out_dir` as part of the shared tshark pass."""
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+
+    def tshark_args(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        return ['--export-objects', f'http,{self.out_dir}']
+
+    def consume(self, frame):
+        pass
+
+    def result(self):
+        return sorted(os.listdir(self.out_dir)) if os.path.isdir(self.out_dir) else []
+
+
+class JSONDumpConsumer(FrameConsumer):
+    """Writes tshark's full `-T json` packet dump to `path`. Registering it
+    switches `FrameDecoder` to a `-T json` pass, which carries no `_ws.col.*`
+    column values, so it cannot share a decoder with ProtocolConsumer."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def consume(self, frame):
+        pass
+
+    def result(self):
+        return self.path
+
+
+class _Pairs(list):
+    """A JSON object as its (key, value) pairs; tshark repeats keys, e.g. one
+    "tls.record" per record in a frame."""
+
+
+class _TeeReader(object):
+    """File-like reader that copies everything read from `f` to `out`."""
+
+    def __init__(self, f, out):
+        self.f = f
+        self.out = out
+
+    def read(self, n=-1):
+        data = self.f.read(n)
+        self.out.write(data)
+        return data
+
+
+def json_fields(obj, wanted, found):
+    """Append the values of the `wanted` field names in a `_Pairs` packet to
+    `found` (name -> list), in document order like `-E occurrence=a`."""
+    for key, value in obj:
+        if isinstance(value, _Pairs):
+            json_fields(value, wanted, found)
+        elif isinstance(value, list):
+            for v in value:
+                if isinstance(v, _Pairs):
+                    json_fields(v, wanted, found)
+                elif key in wanted and isinstance(v, str):
+                    found[key].append(v)
+        elif key in wanted and isinstance(value, str):
+            found[key].append(value)
+
+
+class FrameDecoder(object):
+    def __init__(self, tshark_path='tshark'):
+        self.tshark_path = tshark_path
+        self.consumers = []
+
+    def register(self, consumer):
+        consumers = self.consumers + [consumer]
+        if any(isinstance(c, JSONDumpConsumer) for c in consumers):
+            # -T json output has no column values
+            columns = [f for c in consumers for f in c.fields if f.startswith('_ws.col.')]
+            if columns:
+                raise ValueError(f"{', '.join(columns)} cannot be read in the same pass as a JSONDumpConsumer")
+        self.consumers.append(consumer)
+        return consumer
+
+    def fields(self):
+        fields = []
+        for consumer in self.consumers:
+            for f in consumer.fields:
+                if f not in fields:
+                    fields.append(f)
+        # tshark -T fields needs at least one field even for export-only runs
+        return fields or ['frame.number']
+
+    def json_dump(self):
+        for consumer in self.consumers:
+            if isinstance(consumer, JSONDumpConsumer):
+                return consumer
+        return None
+
+    def build_command(self, pcap_file, display_filter=None, limit=None):
+        if self.json_dump() is not None:
+            cmd = [self.tshark_path, '-n', '-r', pcap_file, '-T', 'json']
+        else:
+            cmd = [self.tshark_path, '-n', '-r', pcap_file, '-T', 'fields',
+                   '-E', 'separator=/t', '-E', 'occurrence=a',
+                   '-E', f'aggregator={FIELD_AGGREGATOR}']
+            for f in self.fields():
+                cmd.extend(['-e', f])
+        if display_filter:
+            cmd.extend(['-Y', display_filter])
+        if limit:
+            cmd.extend(['-c', str(limit)])
+        for consumer in self.consumers:
+            cmd.extend(consumer.tshark_args())
+        return cmd
+
+    @staticmethod
+    def _json_frames(stream, fields):
+        """Frames in the `-T fields` layout from a `-T json` packet array."""
+        import ciphersuite
+        wanted = set(fields)
+        decoder = json.JSONDecoder(object_pairs_hook=_Pairs)
+        for packet in ciphersuite.iter_json_array(stream, decoder):
+            found = defaultdict(list)
+            json_fields(packet, wanted, found)
+            yield {f: FIELD_AGGREGATOR.join(found[f]) for f in fields}
+
+    def run(self, pcap_file, display_filter=None, limit=None):
+        """Decode `pcap_file` once, feeding every frame to all consumers.
+
+        Returns True when tshark finished cleanly, False otherwise.
+        """
+        pcap_file = os.path.expanduser(pcap_file)
+        fields = self.fields()
+        n_fields = len(fields)
+        cmd = self.build_command(pcap_file, display_filter, limit)
+
+        with tempfile.TemporaryFile() as err:
+            try:
+                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err,
+                                        text=True, bufsize=1 << 20)
+            except FileNotFoundError:
+                print("tshark not found. Install with: sudo apt-get install tshark")
+                return False
+
+            consumers = self.consumers
+            dump = self.json_dump()
+            parse_error = None
+            if dump is not None:
+                with open(dump.path, 'w') as dump_out:
+                    try:
+                        for frame in self._json_frames(_TeeReader(proc.stdout, dump_out), fields):
+                            for consumer in consumers:
+                                consumer.consume(frame)
+                    except ValueError as e:
+                        parse_error = e
+                    # the closing bracket (and anything after a parse error) still goes to the dump
+                    dump_out.write(proc.stdout.read())
+            else:
+                for line in proc.stdout:
+                    parts = line.rstrip('\n').split(FIELD_SEPARATOR)
+                    if len(parts) < n_fields:
+                        parts.extend([''] * (n_fields - len(parts)))
+                    frame = dict(zip(fields, parts))
+                    for consumer in consumers:
+                        consumer.consume(frame)
+            proc.stdout.close()
+            ret = proc.wait()
+
+            if ret != 0:
+                err.seek(0)
+                print(f"[!] tshark failed on {pcap_file}: {err.read().decode(errors='ignore').strip()[:200]}")
+                return False
+            if parse_error is not None:
+                print(f"[!] Cannot parse tshark JSON for {pcap_file}: {parse_error}")
+                return False
+        return True
+
+
+def main():
+    # Imported here so the library part of this module stays light for the extractors
+    import ip_extraction
+    import stream_size
+
+    p = argparse.ArgumentParser(description='Decode a pcap once and run every extractor on it')
+    p.add_argument('--pcap', '-r', required=True, help='Path to pcap/pcapng file')
+    p.add_argument('--out', '-o', required=True, help='Directory to write results to')
+    p.add_argument('--filter-ips', nargs='*', default=None, help='Only count IP pairs involving these addresses')
+    p.add_argument('--no-http', action='store_true', help='Skip HTTP object export')
+    args = p.parse_args()
+
+    out_dir = os.path.expanduser(args.out)
+    os.makedirs(out_dir, exist_ok=True)
+
+    decoder = FrameDecoder()
+    streams = decoder.register(StreamSizeConsumer())
+    protocols = decoder.register(ProtocolConsumer())
+    contacts = decoder.register(IPPairConsumer(set(args.filter_ips) if args.filter_ips else None))
+    tls = decoder.register(TLSHandshakeConsumer())
+    http = None if args.no_http else decoder.register(HTTPObjectConsumer(os.path.join(out_dir, 'http_objects')))
+
+    print(f"Decoding {args.pcap} ...")
+    if not decoder.run(args.pcap):
+        return
+
+    stream_size.write_stream_sizes_csv(os.path.join(out_dir, 'stream_sizes.csv'), streams.result())
+    protocol_extraction.save_protocols_csv(os.path.join(out_dir, 'protocols.csv'), protocols.result())
+    ip_extraction.save_contacts_csv(os.path.join(out_dir, 'ip_contacts.csv'), contacts.result())
+    with open(os.path.join(out_dir, 'tls_handshakes.json'), 'w') as f:
+        json.dump(tls.result(), f)
+    if http is not None:
+        print(f"Exported {len(http.result())} HTTP objects")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import os
+import re
 import csv
 import subprocess
 import argparse
@@ -23,6 +24,61 @@ except Exception:
     HAVE_SCAPY = False
 
 
+def count_protocol_fields(proto_counter, frame_field, col_proto_field):
+    """Count one frame's frame.protocols and _ws.col.Protocol values into proto_counter."""
+    frame_field = frame_field.strip()
+    col_proto_field = col_proto_field.strip()
+
+    # frame.protocols is colon-separated (e.g. eth:ip:tcp:http)
+    parts = [p.strip().lower() for p in frame_field.split(':') if p.strip()]
+    for p in parts:
+        proto_counter[p] += 1
+
+    # _ws.col.Protocol may contain higher-level protocol tokens like "TLSv1.2" or "QUIC".
+    # Prefer tokens from the Protocol column (Wireshark view). Extract versions when present.
+    if col_proto_field:
+        token_text = col_proto_field.lower()
+        matched_any = False
+
+        # TLS versions: TLSv1.2, TLS 1.3, etc.
+        for m in re.finditer(r'tlsv?\.?\s*(\d+(?:\.\d+)?)', token_text):
+            proto_counter[f"tlsv{m.group(1)}"] += 1
+            matched_any = True
+
+        # QUIC with optional version (e.g. QUIC/1)
+        for m in re.finditer(r'quic(?:/v?(\d+(?:\.\d+)?))?', token_text):
+            ver = m.group(1)
+            if ver:
+                proto_counter[f"quicv{ver}"] += 1
+            else:
+                proto_counter['quic'] += 1
+            matched_any = True
+
+        # HTTP versions: HTTP/2, HTTP/3, HTTP/1.1
+        for m in re.finditer(r'http(?:/|v)?\s*(\d(?:\.\d+)?)', token_text):
+            proto_counter[f"http{m.group(1)}"] += 1
+            matched_any = True
+
+        # Generic matches for TCP/UDP and common protocols
+        if re.search(r'\btcp\b', token_text):
+            proto_counter['tcp'] += 1
+            matched_any = True
+        if re.search(r'\budp\b', token_text):
+            proto_counter['udp'] += 1
+            matched_any = True
+        for tok in ['dns', 'mdns', 'arp', 'dhcp', 'icmpv6', 'icmp', 'igmp', 'eapol']:
+            if re.search(rf'\b{tok}\b', token_text):
+                proto_counter[tok] += 1
+                matched_any = True
+
+        if not matched_any:
+            # Fallback: split on separators and count remaining tokens (keeps versions if present)
+            token_text_clean = token_text.replace('/', ' ').replace(',', ' ').replace('(', ' ').replace(')', ' ')
+            for tok in token_text_clean.split():
+                if tok:
+                    proto_counter[tok] += 1
+
+
 def extract_unique_protocols_tshark(pcap_file, limit=None):
     pcap_file = os.path.expanduser(pcap_file)
     proto_counter = Counter()
@@ -46,55 +102,7 @@ def extract_unique_protocols_tshark(pcap_file, limit=None):
             frame_field = cols[0].strip() if len(cols) > 0 else ''
             col_proto_field = cols[1].strip() if len(cols) > 1 else ''
 
-            # frame.protocols is colon-separated (e.g. eth:ip:tcp:http)
-            parts = [p.strip().lower() for p in frame_field.split(':') if p.strip()]
-            for p in parts:
-                proto_counter[p] += 1
-
-            # _ws.col.Protocol may contain higher-level protocol tokens like "TLSv1.2" or "QUIC".
-            # Prefer tokens from the Protocol column (Wireshark view). Extract versions when present.
-            if col_proto_field:
-                token_text = col_proto_field.lower()
-                import re
-                matched_any = False
-
-                # TLS versions: TLSv1.2, TLS 1.3, etc.
-                for m in re.finditer(r'tlsv?\.?\s*(\d+(?:\.\d+)?)', token_text):
-                    proto_counter[f"tlsv{m.group(1)}"] += 1
-                    matched_any = True
-
-                # QUIC with optional version (e.g. QUIC/1)
-                for m in re.finditer(r'quic(?:/v?(\d+(?:\.\d+)?))?', token_text):
-                    ver = m.group(1)
-                    if ver:
-                        proto_counter[f"quicv{ver}"] += 1
-                    else:
-                        proto_counter['quic'] += 1
-                    matched_any = True
-
-                # HTTP versions: HTTP/2, HTTP/3, HTTP/1.1
-                for m in re.finditer(r'http(?:/|v)?\s*(\d(?:\.\d+)?)', token_text):
-                    proto_counter[f"http{m.group(1)}"] += 1
-                    matched_any = True
-
-                # Generic matches for TCP/UDP and common protocols
-                if re.search(r'\btcp\b', token_text):
-                    proto_counter['tcp'] += 1
-                    matched_any = True
-                if re.search(r'\budp\b', token_text):
-                    proto_counter['udp'] += 1
-                    matched_any = True
-                for tok in ['dns', 'mdns', 'arp', 'dhcp', 'icmpv6', 'icmp', 'igmp', 'eapol']:
-                    if re.search(rf'\b{tok}\b', token_text):
-                        proto_counter[tok] += 1
-                        matched_any = True
-
-                if not matched_any:
-                    # Fallback: split on separators and count remaining tokens (keeps versions if present)
-                    token_text_clean = token_text.replace('/', ' ').replace(',', ' ').replace('(', ' ').replace(')', ' ')
-                    for tok in token_text_clean.split():
-                        if tok:
-                            proto_counter[tok] += 1
+            count_protocol_fields(proto_counter, frame_field, col_proto_field)
 
         return proto_counter
 
@@ -8,7 +8,7 @@
 # Usage: python3 analysis.py <extracted_files_dir>
 # python3 src/analysis.py  ~/update_traffic/extracted/
 
-# Note: the extracted_files_dir should contain the file_metadata.pickle file generated by the extraction script, and the extracted files in subdirectories named by their UUIDs
+# Note: the extracted_files_dir should contain the file_metadata.sqlite (or legacy file_metadata.pickle) file generated by the extraction script, and the extracted files in subdirectories named by their UUIDs
 # The results will be written to a bin_results.json file in the same directory, containing the metadata and update string search results for each file
 import os
 import sys
@@ -18,7 +18,6 @@ import pathlib
 import json
 import base64
 import uuid
-import pickle
 import subprocess
 import magic
 from joblib import Parallel, delayed
@@ -26,6 +25,9 @@ from collections import Counter
 import nest_asyncio
 nest_asyncio.apply()
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metadata_store  # noqa: E402
+
 parser = argparse.ArgumentParser(description='Analyse extracted files from PCAP files')
 
 parser.add_argument('dir', type=str, help='Base directory where files were extracted to')
@@ -36,9 +38,14 @@ walk_dir = args.dir
 #ignore_text = args.t
 
 extraction_data = None
-with open(os.path.join(walk_dir, 'file_metadata.pickle'), 'rb') as f:
-    extraction_data = pickle.load(f)
+try:
+    store = metadata_store.open_store(walk_dir)
+    # process_device only needs the uuid of each extracted pcap
+    extraction_data = list(store.rows(['uuid']))
+    store.close()
     print("Loaded extraction data", len(extraction_data))
+except FileNotFoundError:
+    pass
 
 if (extraction_data == None):
     print("Error: no extraction data found in ", walk_dir)
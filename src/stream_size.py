@@ -31,63 +31,70 @@ output_csv = "./controlled/stream/sony_tv_stream_sizes.csv"
 
 include_megabytes = True   # set False if you do not want MB column
 
-# --- RUN TSHARK ---
-cmd = [
-    "tshark",
-    "-r", pcap_file,
-    "-T", "fields",
-    "-e", "tcp.stream",
-    "-e", "frame.len"
-]
 
-print("Running tshark...")
 
-process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+def extract_stream_sizes(pcap_file):
+    """Sum frame.len per tcp.stream with a single tshark pass."""
+    cmd = [
+        "tshark",
+        "-r", pcap_file,
+        "-T", "fields",
+        "-e", "tcp.stream",
+        "-e", "frame.len"
+    ]
 
-stream_bytes = defaultdict(int)
+    print("Running tshark...")
 
-# --- PARSE TSHARK OUTPUT ---
-for line in process.stdout:
-    parts = line.strip().split()
-    if len(parts) != 2:
-        continue
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
 
-    stream, frame_len = parts
+    stream_bytes = defaultdict(int)
 
-    if not stream or not frame_len:
-        continue
+    # --- PARSE TSHARK OUTPUT ---
+    for line in process.stdout:
+        parts = line.strip().split()
+        if len(parts) != 2:
+            continue
 
-    try:
-        stream = int(stream)
-        frame_len = int(frame_len)
-    except ValueError:
-        continue
+        stream, frame_len = parts
 
-    stream_bytes[stream] += frame_len
+        if not stream or not frame_len:
+            continue
 
-# remove streams with zero total bytes
-stream_bytes = {s: b for s, b in stream_bytes.items() if b > 0}
+        try:
+            stream = int(stream)
+            frame_len = int(frame_len)
+        except ValueError:
+            continue
 
-# --- WRITE CSV ---
-print(f"Writing CSV: {output_csv}")
+        stream_bytes[stream] += frame_len
 
-with open(output_csv, "w", newline="") as f:
-    writer = csv.writer(f)
+    # remove streams with zero total bytes
+    return {s: b for s, b in stream_bytes.items() if b > 0}
 
-    # Header row
-    if include_megabytes:
-        writer.writerow(["stream", "bytes", "megabytes", "tuple"])
-    else:
-        writer.writerow(["stream", "bytes", "tuple"])
 
-    # Data rows
-    for s, b in sorted(stream_bytes.items()):
-        mb = round(b / 1048576, 3) if include_megabytes else ""
-        tuple_text = f"({s}, {b})"
+def write_stream_sizes_csv(output_csv, stream_bytes, include_megabytes=True):
+    print(f"Writing CSV: {output_csv}")
 
+    with open(output_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+
+        # Header row
         if include_megabytes:
-            writer.writerow([s, b, mb, tuple_text])
+            writer.writerow(["stream", "bytes", "megabytes", "tuple"])
         else:
-            writer.writerow([s, b, tuple_text])
+            writer.writerow(["stream", "bytes", "tuple"])
+
+        # Data rows
+        for s, b in sorted(stream_bytes.items()):
+            mb = round(b / 1048576, 3) if include_megabytes else ""
+            tuple_text = f"({s}, {b})"
+
+            if include_megabytes:
+                writer.writerow([s, b, mb, tuple_text])
+            else:
+                writer.writerow([s, b, tuple_text])
+
 
-print("Done.")
+if __name__ == "__main__":
+    write_stream_sizes_csv(output_csv, extract_stream_sizes(pcap_file), include_megabytes)
+    print("Done.")
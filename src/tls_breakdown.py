@@ -7,8 +7,9 @@ Why this exists:
 
 Input format expected:
 - Extracted TLS directory from `src/extract_tls.py`, containing:
-  - `file_metadata.pickle`
-  - `<uuid>/tls_handshake.json`
+  - `file_metadata.sqlite` (or a legacy `file_metadata.pickle`)
+  - `tls_handshakes.npz`, the run's columnar handshake table (tls_records.py)
+    (older extractions with only `<uuid>/tls_handshake.json` still work)
 
 Example:
   python3 src/tls_breakdown.py \
@@ -21,8 +22,13 @@ import csv
 import importlib.util
 import json
 import os
-import pickle
-from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+
+import cipher_table
+import metadata_store
+import tls_records
 
 
 VERSION_MAP = {
@@ -49,62 +55,34 @@ def load_cipher_sets(ciphersuite_py_path: str):
     }
 
 
+CATEGORIES = cipher_table.CATEGORIES
+
+
 def classify_cipher(code: str, sets: dict) -> str:
-    if not code:
+    value = cipher_table.normalize_hex(code) if code else None
+    if value is None:
         return "Unknown"
-    for cat in ("Secure", "Recommended", "Weak", "Insecure"):
-        if code in sets[cat]:
-            return cat
-    return "Unknown"
-
-
-def normalize_hex(v):
-    s = str(v).strip().lower()
-    if s.startswith("0x"):
-        s = s[2:]
-    s = s.zfill(4)
-    if all(c in "0123456789abcdef" for c in s):
-        return s
-    return None
-
-
-def flatten_fields(obj, prefix=""):
-    if isinstance(obj, dict):
-        for k, v in obj.items():
-            np = f"{prefix}.{k}" if prefix else k
-            yield from flatten_fields(v, np)
-    elif isinstance(obj, list):
-        for i, v in enumerate(obj):
-            np = f"{prefix}[{i}]"
-            yield from flatten_fields(v, np)
-    else:
-        yield prefix, obj
-
-
-def parse_tls_packet(packet):
-    versions = []
-    chosen_suites = []
-    offered_suites = []
-
-    for layer in packet.get("layers", []):
-        if layer.get("layer_name") not in ("tls", "ssl"):
-            continue
-
-        for key, val in flatten_fields(layer.get("fields", {})):
-            lk = key.lower()
-            if lk.endswith("tls.handshake.version"):
-                versions.append(str(val))
-
-            if "tls.handshake.ciphersuite[" in lk:
-                c = normalize_hex(val)
-                if c:
-                    offered_suites.append(c)
-            elif lk.endswith("tls.handshake.ciphersuite"):
-                c = normalize_hex(val)
-                if c:
-                    chosen_suites.append(c)
-
-    return versions, chosen_suites, offered_suites
+    return CATEGORIES[cipher_table.load_table(sets)[value]]
+
+
+def load_handshakes(input_dir, uuids):
+    """Run-level handshake table of an extract_tls directory, rebuilt from the
+    per-uuid tls_handshake.json files for directories extracted before it existed."""
+    run_table = os.path.join(input_dir, tls_records.RUN_TABLE)
+    if os.path.exists(run_table):
+        return tls_records.load(run_table)
+    tables = []
+    for uuid in uuids:
+        tls_json = os.path.join(input_dir, uuid, "tls_handshake.json")
+        if os.path.exists(tls_json):
+            with open(tls_json) as f:
+                tables.append(tls_records.table_from_handshake_json(json.load(f), uuid))
+    return tls_records.concat(tables)
+
+
+def _crosstab(device, labels, columns):
+    ct = pd.crosstab(device, labels)
+    return ct.reindex(columns=columns, fill_value=0)
 
 
 def write_csv(path, rows, headers):
@@ -135,80 +113,73 @@ def main():
 
     sets = load_cipher_sets(args.ciphersuite_script)
 
-    meta_path = os.path.join(args.input, "file_metadata.pickle")
-    with open(meta_path, "rb") as f:
-        metadata = pickle.load(f)
-
-    by_device = defaultdict(lambda: {
-        "sessions": 0,
-        "server_versions": Counter(),
-        "server_chosen_cat": Counter(),
-        "client_offered_cat": Counter(),
+    store = metadata_store.open_store(args.input)
+    metadata = list(store.rows(["uuid", args.device_field]))
+    store.close()
+
+    meta = pd.DataFrame(metadata, columns=["uuid", args.device_field])
+    meta["device"] = meta[args.device_field].fillna("unknown")
+
+    table = load_handshakes(args.input, meta["uuid"].tolist())
+    # device of every handshake row (NaN for rows outside the metadata)
+    row_device = pd.Series(table["uuid"]).map(dict(zip(meta["uuid"], meta["device"])))
+    known = row_device.notna().to_numpy()
+    cat_of = cipher_table.load_table(sets)
+    categories = np.array(CATEGORIES)
+
+    present = meta["uuid"].isin(set(table["uuid"].tolist()))
+    missing_json = int((~present).sum())
+    sessions = meta.loc[present, "device"].value_counts(sort=False)
+
+    # ServerHello: negotiated version and suite
+    server = known & (table["type"] == tls_records.SERVER_HELLO)
+    with_version = server & (table["version"] > 0)
+    version_labels = pd.Series([f"0x{v:04x}" for v in table["version"][with_version]], dtype=object)
+    version_labels = version_labels.map(lambda v: VERSION_MAP.get(v, v))
+    server_versions = _crosstab(row_device[with_version].to_numpy(), version_labels.to_numpy(),
+                                list(VERSION_MAP.values()))
+
+    with_cipher = server & (table["cipher"] >= 0)
+    chosen_cat = categories[cat_of[table["cipher"][with_cipher]]]
+    server_chosen = _crosstab(row_device[with_cipher].to_numpy(), chosen_cat, list(CATEGORIES))
+
+    # ClientHello: every offered suite
+    rows, suites = tls_records.explode(table, "ciphers")
+    client = known[rows] & (table["type"][rows] == tls_records.CLIENT_HELLO)
+    offered_cat = categories[cat_of[suites[client]]]
+    client_offered = _crosstab(row_device.to_numpy()[rows[client]], offered_cat, list(CATEGORIES))
+
+    devices = sessions.sort_values(ascending=False, kind="stable").index
+    sv = server_versions.reindex(devices, fill_value=0)
+    sc = server_chosen.reindex(devices, fill_value=0)
+    oc = client_offered.reindex(devices, fill_value=0)
+
+    breakdown = pd.DataFrame({
+        "device": devices,
+        "sessions": sessions.reindex(devices).to_numpy(),
+        "tls10_serverhello": sv["TLS1.0"].to_numpy(),
+        "tls11_serverhello": sv["TLS1.1"].to_numpy(),
+        "tls12_serverhello": sv["TLS1.2"].to_numpy(),
+        "tls13_serverhello": sv["TLS1.3"].to_numpy(),
+        "chosen_secure": sc["Secure"].to_numpy(),
+        "chosen_recommended": sc["Recommended"].to_numpy(),
+        "chosen_weak": sc["Weak"].to_numpy(),
+        "chosen_insecure": sc["Insecure"].to_numpy(),
+        "chosen_unknown": sc["Unknown"].to_numpy(),
+        "offered_secure": oc["Secure"].to_numpy(),
+        "offered_recommended": oc["Recommended"].to_numpy(),
+        "offered_weak": oc["Weak"].to_numpy(),
+        "offered_insecure": oc["Insecure"].to_numpy(),
+        "offered_unknown": oc["Unknown"].to_numpy(),
     })
-
-    overall_versions = Counter()
-    overall_chosen = Counter()
-    overall_offered = Counter()
-    missing_json = 0
-
-    for row in metadata:
-        device = row.get(args.device_field) or "unknown"
-        tls_json = os.path.join(args.input, row["uuid"], "tls_handshake.json")
-        if not os.path.exists(tls_json):
-            missing_json += 1
-            continue
-
-        with open(tls_json) as f:
-            data = json.load(f)
-
-        rec = by_device[device]
-        rec["sessions"] += 1
-
-        for packet in data.get("server_hello_packets", []):
-            versions, chosen, _ = parse_tls_packet(packet)
-            for version in versions:
-                mapped = VERSION_MAP.get(version, version)
-                rec["server_versions"][mapped] += 1
-                overall_versions[mapped] += 1
-
-            for suite in chosen:
-                cat = classify_cipher(suite, sets)
-                rec["server_chosen_cat"][cat] += 1
-                overall_chosen[cat] += 1
-
-        for packet in data.get("client_hello_packets", []):
-            _, _, offered = parse_tls_packet(packet)
-            for suite in offered:
-                cat = classify_cipher(suite, sets)
-                rec["client_offered_cat"][cat] += 1
-                overall_offered[cat] += 1
-
-    device_rows = []
-    for dev, rec in sorted(by_device.items(), key=lambda kv: kv[1]["sessions"], reverse=True):
-        sc = rec["server_chosen_cat"]
-        oc = rec["client_offered_cat"]
-        sv = rec["server_versions"]
-        device_rows.append({
-            "device": dev,
-            "sessions": rec["sessions"],
-            "tls10_serverhello": sv["TLS1.0"],
-            "tls11_serverhello": sv["TLS1.1"],
-            "tls12_serverhello": sv["TLS1.2"],
-            "tls13_serverhello": sv["TLS1.3"],
-            "chosen_secure": sc["Secure"],
-            "chosen_recommended": sc["Recommended"],
-            "chosen_weak": sc["Weak"],
-            "chosen_insecure": sc["Insecure"],
-            "chosen_unknown": sc["Unknown"],
-            "offered_secure": oc["Secure"],
-            "offered_recommended": oc["Recommended"],
-            "offered_weak": oc["Weak"],
-            "offered_insecure": oc["Insecure"],
-            "offered_unknown": oc["Unknown"],
-            "chosen_weak_insecure_total": sc["Weak"] + sc["Insecure"],
-            "chosen_secure_recommended_total": sc["Secure"] + sc["Recommended"],
-            "offered_weak_insecure_total": oc["Weak"] + oc["Insecure"],
-        })
+    breakdown["chosen_weak_insecure_total"] = breakdown["chosen_weak"] + breakdown["chosen_insecure"]
+    breakdown["chosen_secure_recommended_total"] = breakdown["chosen_secure"] + breakdown["chosen_recommended"]
+    breakdown["offered_weak_insecure_total"] = breakdown["offered_weak"] + breakdown["offered_insecure"]
+    device_rows = breakdown.to_dict("records")
+
+    overall_versions = server_versions.sum()
+    overall_chosen = server_chosen.sum()
+    overall_offered = client_offered.sum()
 
     summary_rows = [
         {"metric": "missing_tls_json", "value": missing_json},
@@ -1,8 +1,17 @@
+import contextlib
 import subprocess
 import json
 import socket
 import hashlib
+import os
 import sys
+import tempfile
+
+import numpy as np
+
+import cert_store
+import ciphersuite
+from compute_entropy import entropies_from_counts
 
 # You need to have pyasn1, pyasn1-modules, and cryptography for X509 cert parsing,
 # or adapt your cert parsing code accordingly. 
@@ -20,13 +29,84 @@ cipher_suite_mapping = {
     # Add more known cipher suites here
 }
 
-class PCAPParserApp:
+def oid_to_der(dotted):
+    """'1.2.840.113549.1.1.5' -> the OID's DER content bytes (SIG_ALG_MAPPING keys)."""
+    arcs = [int(a) for a in dotted.split('.')]
+    out = bytearray([40 * arcs[0] + arcs[1]])
+    for arc in arcs[2:]:
+        chunk = [arc & 0x7F]
+        arc >>= 7
+        while arc:
+            chunk.append(0x80 | (arc & 0x7F))
+            arc >>= 7
+        out.extend(reversed(chunk))
+    return bytes(out)
+
+class FlowStats:
+    """Running aggregates of one flow's encrypted payloads; the payloads
+    themselves are dropped as soon as they are counted."""
+    SIZE_BUCKETS = 17     # bucket k holds records of 2**(k-1) <= size < 2**k bytes
+    ENTROPY_BINS = 10     # per-record Shannon entropy in [0, 1]
+
     def __init__(self):
+        self.records = 0
+        self.bytes = 0
+        self.min_size = None
+        self.max_size = 0
+        self.byte_hist = np.zeros(256, dtype=np.int64)
+        self.size_hist = np.zeros(self.SIZE_BUCKETS, dtype=np.int64)
+        self.entropy_hist = np.zeros(self.ENTROPY_BINS, dtype=np.int64)
+        self.first_seq = None
+        self.last_seq = None
+
+    def add(self, data, seq=None):
+        size = len(data)
+        counts = np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+        self.byte_hist += counts
+        self.records += 1
+        self.bytes += size
+        self.min_size = size if self.min_size is None else min(self.min_size, size)
+        self.max_size = max(self.max_size, size)
+        self.size_hist[min(size.bit_length(), self.SIZE_BUCKETS - 1)] += 1
+        if size:
+            shannon = entropies_from_counts(counts)[0][0]
+            self.entropy_hist[min(int(shannon * self.ENTROPY_BINS), self.ENTROPY_BINS - 1)] += 1
+        if seq is not None:
+            self.first_seq = seq if self.first_seq is None else self.first_seq
+            self.last_seq = seq
+
+    def entropy(self, renyi_alpha=2.0, tsallis_q=1.5):
+        """Shannon/Rényi/Tsallis of all bytes of the flow."""
+        shannon, renyi, tsallis = entropies_from_counts(self.byte_hist, renyi_alpha, tsallis_q)
+        return {'shannon': float(shannon[0]), 'renyi': float(renyi[0]), 'tsallis': float(tsallis[0])}
+
+    def summary(self):
+        return {
+            'records': self.records,
+            'bytes': self.bytes,
+            'min_size': self.min_size or 0,
+            'max_size': self.max_size,
+            'mean_size': self.bytes / self.records if self.records else 0.0,
+            **self.entropy(),
+            'size_hist': self.size_hist.tolist(),
+            'entropy_hist': self.entropy_hist.tolist(),
+        }
+
+
+class PCAPParserApp:
+    def __init__(self, store=None, streaming=False):
         self.encrypted_data = []
         self.cipher_suite_info = []
         self.certificates = []
         self.seen_cert_hashes = set()
         self.tshark_path = 'tshark'  # or full path if not in PATH
+        # optional cert_store.CertStore: every certificate seen is also
+        # recorded there (with the pcap it came from) across runs and workers
+        self.store = store
+        # streaming mode: TLS app data / ESP payloads are folded into
+        # per-flow FlowStats instead of being kept in encrypted_data
+        self.streaming = streaming
+        self.flows = {}
 
     def run_tshark_command(self, command):
         try:
@@ -42,6 +122,25 @@ class PCAPParserApp:
             print(f"tshark error: {e.stderr}", file=sys.stderr)
             return []
 
+    @contextlib.contextmanager
+    def open_tshark(self, command):
+        """tshark's stdout as a text stream, read while tshark is still running."""
+        with tempfile.TemporaryFile('w+') as err:
+            proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=err, text=True)
+            try:
+                yield proc.stdout
+            finally:
+                proc.stdout.close()
+                if proc.wait() != 0:
+                    err.seek(0)
+                    print(f"tshark error: {err.read()}", file=sys.stderr)
+
+    def flow(self, key):
+        stats = self.flows.get(key)
+        if stats is None:
+            stats = self.flows[key] = FlowStats()
+        return stats
+
     def process_tls_appdata(self, file_path, display_filter=''):
         command = [
             self.tshark_path,
@@ -55,6 +154,22 @@ class PCAPParserApp:
             '-e', 'tls.record.version',
             '-e', 'tls.app_data'
         ]
+        if self.streaming:
+            with self.open_tshark(command) as out:
+                for line in out:
+                    parts = line.rstrip('\n').split('\t')
+                    if len(parts) < 6:
+                        continue
+                    src_ip, dst_ip, sport, dport, version, data_hex = parts
+                    # several records in one frame are comma separated
+                    stats = self.flow(('TLS', src_ip, sport, dst_ip, dport, version))
+                    for record_hex in data_hex.split(','):
+                        try:
+                            stats.add(bytes.fromhex(record_hex))
+                        except ValueError:
+                            continue
+            return
+
         lines = self.run_tshark_command(command)
 
         for line in lines:
@@ -95,7 +210,8 @@ class PCAPParserApp:
             src_ip, dst_ip, suite = parts
             self.cipher_suite_info.append((src_ip, dst_ip, suite))
 
-    def process_certificates(self, file_path, display_filter=''):
+    def iter_certificates(self, file_path, display_filter=''):
+        """(cert_der, src_ip, dst_ip) for every certificate in the pcap."""
         command = [
             self.tshark_path,
             '-r', file_path,
@@ -113,12 +229,18 @@ class PCAPParserApp:
                 continue
             src_ip, dst_ip, certs_hex = parts
             try:
-                certs = certs_hex.split(',')
-                for cert_hex in certs:
-                    cert_der = bytes.fromhex(cert_hex)
-                    self.process_single_cert(cert_der, src_ip, dst_ip)
+                certs = [bytes.fromhex(cert_hex) for cert_hex in certs_hex.split(',')]
             except ValueError:
                 continue
+            for cert_der in certs:
+                yield cert_der, src_ip, dst_ip
+
+    def process_certificates(self, file_path, display_filter=''):
+        sightings = list(self.iter_certificates(file_path, display_filter))
+        for cert_der, src_ip, dst_ip in sightings:
+            self.process_single_cert(cert_der, src_ip, dst_ip)
+        if self.store is not None:
+            self.store.add_many(sightings, os.path.abspath(file_path))
 
     def process_single_cert(self, cert_der, src_ip, dst_ip):
         cert_hash = hashlib.sha256(cert_der).hexdigest()
@@ -126,8 +248,10 @@ class PCAPParserApp:
             return
         self.seen_cert_hashes.add(cert_hash)
 
-        # For simplicity, skip deep cert parsing, just dummy sig alg
         sig_name = "UnknownAlg"
+        sig_oid = cert_store.signature_oid(cert_der)
+        if sig_oid is not None:
+            sig_name = SIG_ALG_MAPPING.get(oid_to_der(sig_oid), sig_oid)
 
         self.certificates.append({
             'ip_pair': f"{src_ip} -> {dst_ip}",
@@ -143,6 +267,19 @@ class PCAPParserApp:
             '-Y', f'esp{(" && " + display_filter) if display_filter else ""}',
             '-T', 'jsonraw'
         ]
+        if self.streaming:
+            # decode the jsonraw array one packet at a time straight off the pipe
+            with self.open_tshark(command) as out:
+                try:
+                    for packet in ciphersuite.iter_json_array(out):
+                        entry = self.parse_esp_packet(packet)
+                        if entry is not None:
+                            self.flow(('ESP', entry['src_ip'], entry['dst_ip'], entry['spi'])).add(
+                                entry['data'], entry['seq'])
+                except ValueError as e:
+                    print(f"JSON parse error: {e}", file=sys.stderr)
+            return
+
         json_output = self.run_tshark_command(command)
 
         if not json_output:
@@ -156,34 +293,39 @@ class PCAPParserApp:
             return
 
         for packet in packets:
-            layers = packet.get("_source", {}).get("layers", {})
-            esp_layer = layers.get("esp", {})
-            ip_layer = layers.get("ip", {})
-            esp_raw = layers.get("esp_raw", [""])[0] if "esp_raw" in layers else ""
+            entry = self.parse_esp_packet(packet)
+            if entry is not None:
+                self.encrypted_data.append(entry)
 
-            spi_hex = esp_layer.get("esp.spi_raw", [""])[0] if "esp.spi_raw" in esp_layer else ""
-            seq_hex = esp_layer.get("esp.sequence_raw", [""])[0] if "esp.sequence_raw" in esp_layer else ""
-            src_ip_hex = ip_layer.get("ip.src_raw", [""])[0] if "ip.src_raw" in ip_layer else ""
-            dst_ip_hex = ip_layer.get("ip.dst_raw", [""])[0] if "ip.dst_raw" in ip_layer else ""
+    def parse_esp_packet(self, packet):
+        layers = packet.get("_source", {}).get("layers", {})
+        esp_layer = layers.get("esp", {})
+        ip_layer = layers.get("ip", {})
+        esp_raw = layers.get("esp_raw", [""])[0] if "esp_raw" in layers else ""
 
-            try:
-                spi = int(spi_hex.replace('0x', ''), 16) if spi_hex else 0
-                seq = int(seq_hex.replace('0x', ''), 16) if seq_hex else 0
-                data = bytes.fromhex(esp_raw.replace(':', ''))[8:] if esp_raw else b''
-                src_ip = self.hex_to_ip(src_ip_hex)
-                dst_ip = self.hex_to_ip(dst_ip_hex)
+        spi_hex = esp_layer.get("esp.spi_raw", [""])[0] if "esp.spi_raw" in esp_layer else ""
+        seq_hex = esp_layer.get("esp.sequence_raw", [""])[0] if "esp.sequence_raw" in esp_layer else ""
+        src_ip_hex = ip_layer.get("ip.src_raw", [""])[0] if "ip.src_raw" in ip_layer else ""
+        dst_ip_hex = ip_layer.get("ip.dst_raw", [""])[0] if "ip.dst_raw" in ip_layer else ""
 
-                self.encrypted_data.append({
-                    'proto': 'ESP',
-                    'spi': spi,
-                    'seq': seq,
-                    'src_ip': src_ip,
-                    'dst_ip': dst_ip,
-                    'data': data
-                })
-            except (ValueError, KeyError) as e:
-                print(f"ESP data parse error: {e}", file=sys.stderr)
-                continue
+        try:
+            spi = int(spi_hex.replace('0x', ''), 16) if spi_hex else 0
+            seq = int(seq_hex.replace('0x', ''), 16) if seq_hex else 0
+            data = bytes.fromhex(esp_raw.replace(':', ''))[8:] if esp_raw else b''
+            src_ip = self.hex_to_ip(src_ip_hex)
+            dst_ip = self.hex_to_ip(dst_ip_hex)
+        except (ValueError, KeyError) as e:
+            print(f"ESP data parse error: {e}", file=sys.stderr)
+            return None
+
+        return {
+            'proto': 'ESP',
+            'spi': spi,
+            'seq': seq,
+            'src_ip': src_ip,
+            'dst_ip': dst_ip,
+            'data': data
+        }
 
     def hex_to_ip(self, hex_str):
         hex_clean = hex_str.replace('0x', '').replace(':', '').strip()
@@ -200,14 +342,23 @@ class PCAPParserApp:
             return hex_str
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python3 tls_cert.py <pcap_file> [display_filter]")
+    args = sys.argv[1:]
+    streaming = '--stream' in args
+    if streaming:
+        args.remove('--stream')
+    store_path = None
+    if '--store' in args:
+        i = args.index('--store')
+        store_path = args[i + 1] if i + 1 < len(args) else None
+        del args[i:i + 2]
+    if not args or (store_path is None and '--store' in sys.argv):
+        print("Usage: python3 tls_cert.py <pcap_file> [display_filter] [--store certs.sqlite] [--stream]")
         sys.exit(1)
 
-    pcap_file = sys.argv[1]
-    display_filter = sys.argv[2] if len(sys.argv) > 2 else ''
+    pcap_file = args[0]
+    display_filter = args[1] if len(args) > 1 else ''
 
-    parser = PCAPParserApp()
+    parser = PCAPParserApp(cert_store.CertStore(store_path) if store_path else None, streaming)
 
     print("[*] Processing TLS Application Data...")
     parser.process_tls_appdata(pcap_file, display_filter)
@@ -228,6 +379,19 @@ def main():
         elif entry['proto'] == 'ESP':
             print(f"ESP#{idx}: SPI=0x{entry['spi']:08x}, Seq={entry['seq']}, {entry['src_ip']} -> {entry['dst_ip']}, Length: {len(entry['data'])} bytes")
 
+    if parser.streaming:
+        print("\n=== Encrypted Flows ===")
+        for key, stats in parser.flows.items():
+            if key[0] == 'TLS':
+                _, src_ip, sport, dst_ip, dport, version = key
+                name = f"TLS {src_ip}:{sport} -> {dst_ip}:{dport}, Version: {version}"
+            else:
+                _, src_ip, dst_ip, spi = key
+                name = f"ESP SPI=0x{spi:08x}, {src_ip} -> {dst_ip}, Seq {stats.first_seq}..{stats.last_seq}"
+            ent = stats.entropy()
+            print(f"{name}: {stats.records} records, {stats.bytes} bytes "
+                  f"(size {stats.min_size or 0}-{stats.max_size}), Shannon {ent['shannon']:.4f}")
+
     print("\n=== Cipher Suites ===")
     for src_ip, dst_ip, cs in parser.cipher_suite_info:
         cs_name = cipher_suite_mapping.get(cs[2:], "Unknown")
@@ -237,5 +401,9 @@ def main():
     for cert in parser.certificates:
         print(f"{cert['ip_pair']} | SigAlg: {cert['sig_alg']} | Hash: {cert['cert_hash']}")
 
+    if parser.store is not None:
+        print(f"\nCertificate store {parser.store.path}: {len(parser.store)} unique certificates")
+        parser.store.close()
+
 if __name__ == "__main__":
     main()
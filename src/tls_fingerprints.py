@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""JA3/JA3S/JA4/JA4S fingerprint index over an extract_tls directory.
+
+Built from the run's handshake table (tls_records.py) and its metadata store.
+Each (fingerprint, device, region, action, SNI) combination is one row of
+`tls_fingerprints.sqlite` with the number of hellos and the first/last time
+it was seen. The table is keyed on (hash, ...) and indexed on device, so
+"which devices share this TLS stack" and "what does this device present"
+are index lookups instead of a rescan of every pcap's handshakes.
+
+extract_tls.py rebuilds the index at the end of every run. For older
+extraction directories it can be built directly; directories without the
+handshake table are read from their per-uuid tls_handshake.json files, which
+carry no capture times, so first_seen/last_seen stay empty for them:
+
+  python3 src/tls_fingerprints.py --input retrospective/dataset_extracted/iot-data_tls
+  python3 src/tls_fingerprints.py --input ... --lookup t13d1516h2_8daaf6152771_02713d6af862
+  python3 src/tls_fingerprints.py --input ... --device echodot
+"""
+
+import argparse
+import os
+import sqlite3
+
+import pandas as pd
+
+import metadata_store
+import tls_breakdown
+import tls_records
+
+INDEX_NAME = 'tls_fingerprints.sqlite'
+
+# fingerprint kind -> (handshake type, table column)
+KINDS = {
+    'ja3': (tls_records.CLIENT_HELLO, 'ja3'),
+    'ja4': (tls_records.CLIENT_HELLO, 'ja4'),
+    'ja3s': (tls_records.SERVER_HELLO, 'ja3s'),
+    'ja4s': (tls_records.SERVER_HELLO, 'ja4s'),
+}
+GROUP_COLUMNS = ['hash', 'kind', 'device', 'region', 'action', 'sni']
+
+
+def fingerprint_rows(table, metadata):
+    """Aggregate a handshake table into one row per (hash, kind, device,
+    region, action, sni) with count, first_seen and last_seen."""
+    meta = pd.DataFrame(metadata, columns=['uuid', 'device', 'region', 'action']).set_index('uuid')
+    frames = []
+    # SNI of a ServerHello is the one its connection's ClientHello asked for
+    hello = table['type'] == tls_records.CLIENT_HELLO
+    conn_sni = dict(zip(zip(table['uuid'][hello].tolist(), table['tcp_stream'][hello].tolist()),
+                        table['sni'][hello].tolist()))
+    for kind, (hs_type, column) in KINDS.items():
+        mask = (table['type'] == hs_type) & (table[column] != '')
+        if not mask.any():
+            continue
+        uuids = table['uuid'][mask]
+        if hs_type == tls_records.CLIENT_HELLO:
+            sni = table['sni'][mask]
+        else:
+            sni = [conn_sni.get(key, '') for key in zip(uuids.tolist(), table['tcp_stream'][mask].tolist())]
+        frames.append(pd.DataFrame({
+            'hash': table[column][mask],
+            'kind': kind,
+            'uuid': uuids,
+            'sni': sni,
+            'ts': table['ts'][mask],
+        }))
+    columns = GROUP_COLUMNS + ['count', 'first_seen', 'last_seen']
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    df = pd.concat(frames, ignore_index=True).join(meta, on='uuid')
+    df[['device', 'region', 'action']] = df[['device', 'region', 'action']].fillna('unknown')
+    grouped = df.groupby(GROUP_COLUMNS, sort=False).agg(
+        count=('ts', 'size'), first_seen=('ts', 'min'), last_seen=('ts', 'max')).reset_index()
+    return grouped[columns]
+
+
+def write_index(out_dir, table=None, metadata=None):
+    """(Re)build out_dir/INDEX_NAME from the run table (or, for directories
+    extracted before it existed, the per-uuid tls_handshake.json files) and
+    the metadata store."""
+    if metadata is None:
+        store = metadata_store.open_store(out_dir)
+        metadata = list(store.rows(['uuid', 'device', 'region', 'action']))
+        store.close()
+    if table is None:
+        table = tls_breakdown.load_handshakes(out_dir, [m['uuid'] for m in metadata])
+    rows = fingerprint_rows(table, metadata)
+
+    path = os.path.join(out_dir, INDEX_NAME)
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    with conn:
+        conn.execute('CREATE TABLE fingerprints (hash TEXT, kind TEXT, device TEXT, region TEXT, action TEXT,'
+                     ' sni TEXT, count INTEGER, first_seen REAL, last_seen REAL,'
+                     ' PRIMARY KEY (hash, kind, device, region, action, sni)) WITHOUT ROWID')
+        values = rows.astype(object).where(rows.notna(), None).itertuples(index=False, name=None)
+        conn.executemany('INSERT INTO fingerprints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', values)
+        conn.execute('CREATE INDEX idx_fingerprints_device ON fingerprints (device, kind)')
+    conn.close()
+    os.replace(tmp, path)
+    return path
+
+
+class FingerprintIndex(object):
+    def __init__(self, extracted_dir):
+        self.path = os.path.join(extracted_dir, INDEX_NAME)
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"No {INDEX_NAME} in {extracted_dir}")
+        self.conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+        self.conn.row_factory = sqlite3.Row
+
+    def close(self):
+        self.conn.close()
+
+    def lookup(self, fingerprint):
+        """Every (device, region, action, sni) a hash was seen with."""
+        return [dict(r) for r in self.conn.execute(
+            'SELECT * FROM fingerprints WHERE hash = ? ORDER BY device, action, sni', (fingerprint,))]
+
+    def devices(self, fingerprint):
+        """Devices sharing a TLS stack: fingerprint -> {device: hello count}."""
+        return {r['device']: r['n'] for r in self.conn.execute(
+            'SELECT device, SUM(count) AS n FROM fingerprints WHERE hash = ? GROUP BY device', (fingerprint,))}
+
+    def fingerprints(self, device, kind=None):
+        """Fingerprints presented by (or to) one device."""
+        sql = ('SELECT hash, kind, SUM(count) AS count, MIN(first_seen) AS first_seen, MAX(last_seen) AS last_seen'
+               ' FROM fingerprints WHERE device = ?')
+        params = [device]
+        if kind:
+            sql += ' AND kind = ?'
+            params.append(kind)
+        sql += ' GROUP BY hash, kind ORDER BY count DESC'
+        return [dict(r) for r in self.conn.execute(sql, params)]
+
+    def shared(self, kind='ja4', min_devices=2):
+        """Fingerprints seen on at least `min_devices` devices."""
+        return [dict(r) for r in self.conn.execute(
+            'SELECT hash, COUNT(DISTINCT device) AS devices, SUM(count) AS count FROM fingerprints'
+            ' WHERE kind = ? GROUP BY hash HAVING devices >= ? ORDER BY devices DESC, count DESC',
+            (kind, min_devices))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the TLS fingerprint index of an extract_tls directory')
+    parser.add_argument('--input', required=True, help='Path to extracted TLS directory')
+    parser.add_argument('--lookup', help='Show devices/actions/SNI seen with this JA3/JA3S/JA4/JA4S hash')
+    parser.add_argument('--device', help='List fingerprints of one device')
+    parser.add_argument('--shared', choices=list(KINDS), help='List fingerprints shared by several devices')
+    args = parser.parse_args()
+
+    if not (args.lookup or args.device or args.shared):
+        path = write_index(args.input)
+        print(f"Wrote: {path}")
+        return
+
+    index = FingerprintIndex(args.input)
+    if args.lookup:
+        for row in index.lookup(args.lookup):
+            print(row)
+    if args.device:
+        for row in index.fingerprints(args.device):
+            print(row)
+    if args.shared:
+        for row in index.shared(args.shared):
+            print(row)
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""TLS handshake latency and session-resumption metrics per stream, device and action.
+
+Built from the handshake table extract_tls.py writes (tls_records.py), or
+from the per-uuid tls_handshake.json files of older extraction directories
+(no capture times there, so both latencies are empty), one row per
+(pcap uuid, tcp.stream) with:
+
+  - hello_rtt      : ServerHello time - ClientHello time
+  - ttfad          : time from ClientHello to the client's first application
+                     data record (native extractions only, see tls_parser.py;
+                     empty for tshark-based ones)
+  - resumed        : TLS 1.3 ServerHello with pre_shared_key, or a TLS <= 1.2
+                     handshake that completed without a Certificate message
+                     (session id / session ticket resumption)
+
+Streams are aggregated per device and action (count, resumption rate and
+median/p95 of both latencies). All steps are pandas group-bys over the table.
+
+Example:
+  python3 src/tls_latency.py \
+    --input retrospective/dataset_extracted/iot-data_tls \
+    --output retrospective/analysis_output
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import metadata_store
+import tls_breakdown
+import tls_records
+
+EXT_PRE_SHARED_KEY = 41
+TLS13 = 0x0304
+CERTIFICATE = 11
+
+
+def stream_metrics(table):
+    """One row per (uuid, tcp_stream) that has a ClientHello or ServerHello."""
+    rows = pd.DataFrame({
+        'uuid': table['uuid'],
+        'tcp_stream': table['tcp_stream'],
+        'type': table['type'],
+        'ts': table['ts'],
+    })
+    server = table['type'] == tls_records.SERVER_HELLO
+    ext_rows, exts = tls_records.explode(table, 'extensions')
+    psk = np.zeros(len(rows), dtype=bool)
+    psk[ext_rows[exts == EXT_PRE_SHARED_KEY]] = True
+    rows['psk'] = psk & server
+    rows['certificate'] = table['type'] == CERTIFICATE
+    rows['server_version'] = np.where(server, np.where(table['selected_version'] > 0,
+                                                        table['selected_version'], table['version']), 0)
+
+    keys = ['uuid', 'tcp_stream']
+    first_ts = rows.groupby(keys + ['type'])['ts'].min().unstack('type')
+    per_stream = pd.DataFrame(index=first_ts.index)
+    for hs_type, name in ((tls_records.CLIENT_HELLO, 'client_hello_ts'),
+                          (tls_records.SERVER_HELLO, 'server_hello_ts'),
+                          (tls_records.FIRST_APP_DATA, 'first_app_data_ts')):
+        per_stream[name] = first_ts[hs_type] if hs_type in first_ts.columns else np.nan
+
+    rows['client_hello'] = table['type'] == tls_records.CLIENT_HELLO
+    rows['server_hello'] = server
+    grouped = rows.groupby(keys)
+    per_stream['version'] = grouped['server_version'].max()
+    per_stream['psk'] = grouped['psk'].any()
+    per_stream['certificate'] = grouped['certificate'].any()
+    # by message type, not time: legacy tables have no capture times
+    per_stream['client_hello'] = grouped['client_hello'].any()
+    per_stream['server_hello'] = grouped['server_hello'].any()
+    per_stream = per_stream.reset_index()
+
+    per_stream = per_stream[per_stream['client_hello'] | per_stream['server_hello']].copy()
+    completed = per_stream['server_hello']
+    per_stream['resumed'] = completed & (
+        per_stream['psk'] | ((per_stream['version'] < TLS13) & ~per_stream['certificate']))
+    per_stream['hello_rtt'] = per_stream['server_hello_ts'] - per_stream['client_hello_ts']
+    per_stream['ttfad'] = per_stream['first_app_data_ts'] - per_stream['client_hello_ts']
+    return per_stream
+
+
+def _p95(x):
+    return x.quantile(0.95)
+
+
+def aggregate(per_stream, group_by):
+    agg = per_stream.groupby(group_by, dropna=False).agg(
+        streams=('tcp_stream', 'size'),
+        completed=('server_hello', 'sum'),
+        resumed=('resumed', 'sum'),
+        hello_rtt_median=('hello_rtt', 'median'),
+        hello_rtt_p95=('hello_rtt', _p95),
+        ttfad_median=('ttfad', 'median'),
+        ttfad_p95=('ttfad', _p95),
+    ).reset_index()
+    agg['full'] = agg['completed'] - agg['resumed']
+    agg['resumption_rate'] = (agg['resumed'] / agg['completed'].where(agg['completed'] > 0)).round(4)
+    return agg
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TLS handshake latency and resumption metrics')
+    parser.add_argument('--input', required=True, help='Path to extracted TLS directory')
+    parser.add_argument('--output', required=True, help='Directory for CSV outputs')
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+
+    store = metadata_store.open_store(args.input)
+    meta = pd.DataFrame(list(store.rows(['uuid', 'device', 'action'])), columns=['uuid', 'device', 'action'])
+    store.close()
+    table = tls_breakdown.load_handshakes(args.input, meta['uuid'].tolist())
+
+    per_stream = stream_metrics(table).merge(meta, on='uuid', how='left')
+    per_stream[['device', 'action']] = per_stream[['device', 'action']].fillna('unknown')
+    by_device_action = aggregate(per_stream, ['device', 'action'])
+    by_device = aggregate(per_stream, ['device'])
+
+    outputs = {
+        'tls_stream_latency.csv': per_stream[['uuid', 'device', 'action', 'tcp_stream', 'version', 'resumed',
+                                              'hello_rtt', 'ttfad']],
+        'tls_latency_by_device_action.csv': by_device_action,
+        'tls_latency_by_device.csv': by_device,
+    }
+    for name, df in outputs.items():
+        path = os.path.join(args.output, name)
+        df.to_csv(path, index=False)
+        print(f"Wrote: {path}")
+
+
+if __name__ == '__main__':
+    main()
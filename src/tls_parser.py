@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""Native TLS record and handshake parser over reassembled TCP payload.
+
+extract_tls.py and extract_all.py rely on tshark to dissect TLS. This module
+reads the TCP payload bytes straight from a capture mapped with pcap_reader,
+reassembles each direction of a connection by sequence number and parses the
+TLS records and the handshake messages inside them. Records and messages that
+span several segments (certificate chains, large ClientHellos) are handled.
+
+Each ClientHello, ServerHello and Certificate message becomes a record in the
+tls_records.py layout (version, offered/chosen suites, extensions, SNI,
+supported groups, point formats, JA3/JA3S, JA4/JA4S) plus `alpn` and, for
+Certificate messages, `certificates` (DER bytes, leaf first).
+
+The client's first application data record is reported as a
+tls_records.FIRST_APP_DATA row (the first ApplicationData record after its
+Finished: the second one on TLS 1.3, where Finished itself is sent as
+ApplicationData). A direction stops being tracked, and its buffers are
+freed, once nothing more can be read from it: at the server's
+ChangeCipherSpec or first ApplicationData record, after the client's first
+application data, or as soon as the bytes do not look like TLS.
+
+Each direction's byte stream is anchored at its SYN (or SYN-ACK) sequence
+number plus one, so a handshake whose first data segment arrives out of
+order is still reassembled from the start. Without a SYN (capture started
+mid-connection, SYN filtered out), segments are held back until the one
+with the lowest sequence number starts with a TLS handshake record header.
+
+`TLSConnectionTracker.feed` takes one segment at a time, so TLS handshakes
+can be collected in the same pass over the frames as entropy or stream sizes
+(see compute_entropy.process_pcap_sessions).
+
+Example:
+  python3 src/tls_parser.py --pcap controlled/dataset/tapo/tapo.pcapng
+"""
+
+import argparse
+import struct
+
+import numpy as np
+
+import pcap_reader
+import tls_records
+
+CONTENT_CHANGE_CIPHER_SPEC = 20
+CONTENT_ALERT = 21
+CONTENT_HANDSHAKE = 22
+CONTENT_APPLICATION_DATA = 23
+
+HANDSHAKE_CLIENT_HELLO = 1
+HANDSHAKE_SERVER_HELLO = 2
+HANDSHAKE_CERTIFICATE = 11
+
+EXT_SERVER_NAME = 0
+EXT_SUPPORTED_GROUPS = 10
+EXT_EC_POINT_FORMATS = 11
+EXT_SIGNATURE_ALGORITHMS = 13
+EXT_ALPN = 16
+EXT_SUPPORTED_VERSIONS = 43
+
+# 2^14 plaintext plus the largest expansion allowed for protected records
+MAX_RECORD_LEN = (1 << 14) + 2048
+# out-of-order segments kept per direction before giving up on it
+MAX_PENDING_SEGMENTS = 64
+
+# (kind, value) event yielded by TLSDirection for an ApplicationData record
+APP_DATA_EVENT = -1
+
+TCP_SYN = 0x02
+
+_SEQ_MOD = 1 << 32
+_SEQ_HALF = 1 << 31
+
+
+class TLSParseError(ValueError):
+    pass
+
+
+class _Reader(object):
+    """Bounds-checked cursor over a bytes-like object."""
+    __slots__ = ('buf', 'pos', 'end')
+
+    def __init__(self, buf, pos=0, end=None):
+        self.buf = buf
+        self.pos = pos
+        self.end = len(buf) if end is None else end
+
+    def remaining(self):
+        return self.end - self.pos
+
+    def _advance(self, n):
+        pos = self.pos
+        if pos + n > self.end:
+            raise TLSParseError('truncated')
+        self.pos = pos + n
+        return pos
+
+    def u8(self):
+        return self.buf[self._advance(1)]
+
+    def u16(self):
+        pos = self._advance(2)
+        return (self.buf[pos] << 8) | self.buf[pos + 1]
+
+    def u24(self):
+        pos = self._advance(3)
+        return (self.buf[pos] << 16) | (self.buf[pos + 1] << 8) | self.buf[pos + 2]
+
+    def take(self, n):
+        pos = self._advance(n)
+        return self.buf[pos:pos + n]
+
+    def vector(self, len_bytes):
+        """Sub-reader over a length-prefixed vector."""
+        n = (self.u8, self.u16, self.u24)[len_bytes - 1]()
+        pos = self._advance(n)
+        return _Reader(self.buf, pos, pos + n)
+
+    def u16_list(self):
+        n = self.remaining() // 2
+        values = struct.unpack_from(f'>{n}H', self.buf, self.pos)
+        self.pos += n * 2
+        return list(values)
+
+
+def _new_record(hs_type, version):
+    return {
+        'type': hs_type,
+        'version': version,
+        'selected_version': 0,
+        'cipher': -1,
+        'ciphers': [],
+        'extensions': [],
+        'groups': [],
+        'point_formats': [],
+        'versions': [],
+        'sig_algs': [],
+        'sni': '',
+        'alpn': [],
+    }
+
+
+def _parse_extensions(r, rec, client):
+    if r.remaining() == 0:
+        return
+    exts = r.vector(2)
+    while exts.remaining():
+        ext_type = exts.u16()
+        body = exts.vector(2)
+        rec['extensions'].append(ext_type)
+        if ext_type == EXT_SERVER_NAME and client:
+            names = body.vector(2)
+            while names.remaining():
+                name_type = names.u8()
+                name = names.vector(2)
+                if name_type == 0 and not rec['sni']:
+                    rec['sni'] = bytes(name.take(name.remaining())).decode('ascii', 'replace')
+        elif ext_type == EXT_SUPPORTED_GROUPS:
+            rec['groups'] = body.vector(2).u16_list()
+        elif ext_type == EXT_EC_POINT_FORMATS:
+            formats = body.vector(1)
+            rec['point_formats'] = list(formats.take(formats.remaining()))
+        elif ext_type == EXT_ALPN:
+            protocols = body.vector(2)
+            while protocols.remaining():
+                proto = protocols.vector(1)
+                rec['alpn'].append(bytes(proto.take(proto.remaining())).decode('ascii', 'replace'))
+        elif ext_type == EXT_SIGNATURE_ALGORITHMS:
+            rec['sig_algs'] = body.vector(2).u16_list()
+        elif ext_type == EXT_SUPPORTED_VERSIONS:
+            if client:
+                rec['versions'] = body.vector(1).u16_list()
+            else:
+                rec['selected_version'] = body.u16()
+
+
+def parse_client_hello(body):
+    r = _Reader(body)
+    rec = _new_record(HANDSHAKE_CLIENT_HELLO, r.u16())
+    r.take(32)                                  # random
+    r.vector(1)                                 # session id
+    rec['ciphers'] = r.vector(2).u16_list()
+    r.vector(1)                                 # compression methods
+    _parse_extensions(r, rec, client=True)
+    return tls_records.add_fingerprints(rec)
+
+
+def parse_server_hello(body):
+    r = _Reader(body)
+    rec = _new_record(HANDSHAKE_SERVER_HELLO, r.u16())
+    r.take(32)
+    r.vector(1)
+    rec['cipher'] = r.u16()
+    r.u8()                                      # compression method
+    _parse_extensions(r, rec, client=False)
+    return tls_records.add_fingerprints(rec)
+
+
+def parse_certificate(body, tls13=False):
+    """DER certificates of a Certificate message, leaf first."""
+    r = _Reader(body)
+    if tls13:
+        r.vector(1)                             # certificate_request_context
+    chain = r.vector(3)
+    certs = []
+    while chain.remaining():
+        cert = chain.vector(3)
+        certs.append(bytes(cert.take(cert.remaining())))
+        if tls13:
+            chain.vector(2)                     # per-entry extensions
+    return certs
+
+
+class TLSDirection(object):
+    """Reassembles one direction of a TCP connection and yields its
+    cleartext handshake messages as (type, body) pairs, plus
+    (APP_DATA_EVENT, n) for the n-th ApplicationData record of a client."""
+
+    def __init__(self):
+        self.next_seq = None
+        self.pending = {}
+        self.buf = bytearray()
+        self.handshake = bytearray()
+        self.done = False
+        self.is_client = False
+        self.encrypted = False
+        self.app_records = 0
+
+    def _finish(self):
+        self.done = True
+        self.pending = {}
+        self.buf = bytearray()
+        self.handshake = bytearray()
+
+    def syn(self, seq):
+        """Anchor the stream at the SYN / SYN-ACK: data starts at seq + 1."""
+        if self.done or self.next_seq is not None:
+            return []
+        self.next_seq = (seq + 1) % _SEQ_MOD
+        # segments that arrived before the SYN, if any
+        self._drain()
+        return self._records() if self.buf else []
+
+    @staticmethod
+    def _starts_record(payload):
+        """True when payload begins with a plausible TLS handshake record header,
+        the first record of either direction of a connection."""
+        return (len(payload) >= 5 and payload[0] == CONTENT_HANDSHAKE and payload[1] == 3
+                and ((payload[3] << 8) | payload[4]) <= MAX_RECORD_LEN)
+
+    def _drain(self):
+        while self.pending:
+            nxt = self.pending.pop(self.next_seq, None)
+            if nxt is None:
+                break
+            self.buf += nxt
+            self.next_seq = (self.next_seq + len(nxt)) % _SEQ_MOD
+
+    def feed(self, seq, payload):
+        if self.done or not payload:
+            return []
+        if self.next_seq is None:
+            # no SYN seen: hold segments back until the lowest one starts a record
+            if len(self.pending) >= MAX_PENDING_SEGMENTS:
+                self._finish()
+                return []
+            self.pending.setdefault(seq, bytes(payload))
+            first = min(self.pending, key=lambda s: (s - seq + _SEQ_HALF) % _SEQ_MOD)
+            if not self._starts_record(self.pending[first]):
+                return []
+            self.next_seq = first
+            self._drain()
+            return self._records()
+        delta = (seq - self.next_seq) % _SEQ_MOD
+        if delta >= _SEQ_HALF:                  # starts before next_seq: retransmission / overlap
+            overlap = _SEQ_MOD - delta
+            if overlap >= len(payload):
+                return []
+            payload = payload[overlap:]
+        elif delta > 0:                         # gap: keep until it is filled
+            if len(self.pending) >= MAX_PENDING_SEGMENTS:
+                self._finish()
+            else:
+                self.pending.setdefault(seq, bytes(payload))
+            return []
+        self.buf += payload
+        self.next_seq = (self.next_seq + len(payload)) % _SEQ_MOD
+        self._drain()
+        return self._records()
+
+    def _records(self):
+        messages = []
+        buf = self.buf
+        pos = 0
+        while len(buf) - pos >= 5:
+            content_type = buf[pos]
+            length = (buf[pos + 3] << 8) | buf[pos + 4]
+            if not CONTENT_CHANGE_CIPHER_SPEC <= content_type <= CONTENT_APPLICATION_DATA \
+                    or buf[pos + 1] != 3 or length > MAX_RECORD_LEN:
+                self._finish()
+                return messages
+            if len(buf) - pos < 5 + length:
+                break
+            if content_type == CONTENT_HANDSHAKE:
+                if not self.encrypted:
+                    self.handshake += buf[pos + 5:pos + 5 + length]
+                    messages.extend(self._messages())
+            elif content_type == CONTENT_CHANGE_CIPHER_SPEC:
+                # the rest of the handshake is encrypted; only a client is
+                # still followed, up to its first application data
+                self.encrypted = True
+                if not self.is_client:
+                    self._finish()
+                    return messages
+            elif content_type == CONTENT_APPLICATION_DATA:
+                if not self.is_client:
+                    self._finish()
+                    return messages
+                self.app_records += 1
+                messages.append((APP_DATA_EVENT, self.app_records))
+                if self.app_records >= 2:
+                    self._finish()
+                    return messages
+            pos += 5 + length
+        del buf[:pos]
+        return messages
+
+    def _messages(self):
+        hs = self.handshake
+        pos = 0
+        messages = []
+        while len(hs) - pos >= 4:
+            length = (hs[pos + 1] << 16) | (hs[pos + 2] << 8) | hs[pos + 3]
+            if len(hs) - pos < 4 + length:
+                break
+            if hs[pos] == HANDSHAKE_CLIENT_HELLO:
+                self.is_client = True
+            messages.append((hs[pos], bytes(hs[pos + 4:pos + 4 + length])))
+            pos += 4 + length
+        del hs[:pos]
+        return messages
+
+
+class TLSConnectionTracker(object):
+    """Feeds TCP segments to per-direction parsers and collects handshake records.
+
+    Connections are numbered in order of first appearance (`tcp_stream`)."""
+
+    def __init__(self, certificates=True):
+        self.certificates = certificates
+        self.directions = {}
+        self.streams = {}
+        self.server_version = {}
+        self.records = []
+
+    def feed(self, src, dst, sport, dport, seq, payload, ts=None, syn=False):
+        """Feed one TCP segment; pass syn=True for SYN / SYN-ACK segments so
+        the direction is anchored at their sequence number."""
+        key = (src, dst, sport, dport)
+        direction = self.directions.get(key)
+        if direction is None:
+            direction = self.directions[key] = TLSDirection()
+        if direction.done:
+            return
+        messages = direction.syn(seq) if syn else []
+        if payload:
+            messages += direction.feed((seq + 1) % _SEQ_MOD if syn else seq, payload)
+        for hs_type, body in messages:
+            if hs_type == APP_DATA_EVENT:
+                self._app_data(key, body, ts)
+            else:
+                self._handle(key, hs_type, body, ts)
+
+    def _stream(self, key):
+        src, dst, sport, dport = key
+        conn = (src, sport, dst, dport) if (src, sport) <= (dst, dport) else (dst, dport, src, sport)
+        return self.streams.setdefault(conn, len(self.streams))
+
+    def _app_data(self, key, n_records, ts):
+        stream = self._stream(key)
+        # TLS 1.3 sends the client Finished as the first ApplicationData record
+        wanted = 2 if self.server_version.get(stream) == 0x0304 else 1
+        if n_records == wanted:
+            rec = _new_record(tls_records.FIRST_APP_DATA, 0)
+            rec.update(tcp_stream=stream, ip_src=key[0], ts=ts)
+            self.records.append(rec)
+        if n_records >= wanted:
+            self.directions[key]._finish()
+
+    def _handle(self, key, hs_type, body, ts):
+        stream = self._stream(key)
+        try:
+            if hs_type == HANDSHAKE_CLIENT_HELLO:
+                rec = parse_client_hello(body)
+            elif hs_type == HANDSHAKE_SERVER_HELLO:
+                rec = parse_server_hello(body)
+                self.server_version[stream] = rec['selected_version'] or rec['version']
+            elif hs_type == HANDSHAKE_CERTIFICATE and self.certificates:
+                rec = _new_record(hs_type, 0)
+                rec['certificates'] = parse_certificate(body, self.server_version.get(stream) == 0x0304)
+            else:
+                rec = _new_record(hs_type, 0)
+        except TLSParseError:
+            return
+        rec.update(tcp_stream=stream, ip_src=key[0], ts=ts)
+        self.records.append(rec)
+
+
+def parse_pcap(pcap_file, certificates=True):
+    """Handshake records of every TLS connection in a capture."""
+    tracker = TLSConnectionTracker(certificates)
+    with pcap_reader.PcapFile(pcap_file) as cap:
+        frames = cap.frames
+        idx = np.flatnonzero((frames['ip_proto'] == pcap_reader.IPPROTO_TCP) & (frames['l4_offset'] > 0)
+                             & ((frames['payload_len'] > 0) | (frames['tcp_flags'] & TCP_SYN > 0)))
+        if len(idx) == 0:
+            return tracker.records
+        tcp = frames[idx]
+        keys = np.empty(len(tcp), dtype=[('v', 'u1'), ('src', 'u1', (16,)), ('dst', 'u1', (16,)),
+                                         ('sport', 'u2'), ('dport', 'u2')])
+        for col in ('src', 'dst', 'sport', 'dport'):
+            keys[col] = tcp[col]
+        keys['v'] = tcp['ip_version']
+        uniq, flow_of = np.unique(keys.view(np.dtype((np.void, keys.dtype.itemsize))), return_inverse=True)
+        uniq = uniq.view(keys.dtype)
+        flows = [(pcap_reader.format_addr(k['src'], k['v']), pcap_reader.format_addr(k['dst'], k['v']),
+                  int(k['sport']), int(k['dport'])) for k in uniq]
+        seqs = tcp['tcp_seq'].tolist()
+        stamps = tcp['ts'].tolist()
+        syns = (tcp['tcp_flags'] & TCP_SYN > 0).tolist()
+        for k, (i, flow) in enumerate(zip(idx.tolist(), flow_of.ravel().tolist())):
+            src, dst, sport, dport = flows[flow]
+            tracker.feed(src, dst, sport, dport, seqs[k], cap.payload(i), stamps[k], syns[k])
+    return tracker.records
+
+
+def main():
+    p = argparse.ArgumentParser(description='Parse TLS handshakes of a pcap/pcapng file without tshark')
+    p.add_argument('--pcap', '-r', required=True, help='Path to pcap/pcapng file')
+    p.add_argument('--out', help='Write the records as a tls_records .npz table')
+    args = p.parse_args()
+
+    records = parse_pcap(args.pcap)
+    for rec in records:
+        if rec['type'] == HANDSHAKE_CLIENT_HELLO:
+            print(f"[{rec['tcp_stream']}] ClientHello  {rec['ip_src']} sni={rec['sni']} alpn={','.join(rec['alpn'])}"
+                  f" suites={len(rec['ciphers'])} ja3={rec['ja3']}")
+        elif rec['type'] == HANDSHAKE_SERVER_HELLO:
+            print(f"[{rec['tcp_stream']}] ServerHello  {rec['ip_src']} version=0x{rec['selected_version'] or rec['version']:04x}"
+                  f" suite=0x{rec['cipher']:04x} ja3s={rec['ja3s']}")
+        elif rec['type'] == HANDSHAKE_CERTIFICATE:
+            print(f"[{rec['tcp_stream']}] Certificate  {rec['ip_src']} chain={[len(c) for c in rec.get('certificates', [])]}")
+    if args.out:
+        table = tls_records.HandshakeTable()
+        for rec in records:
+            table.append(rec)
+        tls_records.save(args.out, table.to_arrays())
+        print(f"Records written to \"{args.out}\" ({len(records)} handshake messages).")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""Compact, typed TLS handshake records stored as a columnar table.
+
+extract_tls.py used to dump every layer's `_all_fields` into
+tls_handshake.json, and tls_breakdown.py had to walk that whole tree to find
+three keys. Each handshake message is now reduced to one row:
+
+  uuid, type, ts, tcp_stream, ip_src, version, selected_version, cipher, sni,
+  alpn, ja3, ja3s, ja3_string, ja3s_string, ja4, ja4s
+  + list columns: ciphers (offered), extensions, groups, point_formats,
+    versions (ClientHello supported_versions), sig_algs
+
+List columns are stored CSR-style: `<name>` holds the concatenated values and
+`<name>_offsets` (length rows + 1) the start of each row, so a group-by over
+offered suites is an np.repeat instead of a Python loop.
+
+Tables are saved as .npz: one `<uuid>/tls_records.npz` per pcap (written by
+the extraction worker, so resumed runs keep it) and one `tls_handshakes.npz`
+per extraction run that concatenates them.
+
+    table = tls_records.load(os.path.join(extracted_dir, tls_records.RUN_TABLE))
+    hello = table['type'] == 1
+    rows, suites = tls_records.explode(table, 'ciphers')
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+RECORDS_NAME = 'tls_records.npz'
+RUN_TABLE = 'tls_handshakes.npz'
+
+CLIENT_HELLO = 1
+SERVER_HELLO = 2
+# pseudo handshake type for the client's first application data record
+# (only emitted by the native parser, see tls_parser.py)
+FIRST_APP_DATA = 255
+
+SCALAR_COLUMNS = {
+    'type': np.uint8,
+    'ts': np.float64,         # capture time of the message, NaN when unknown
+    'tcp_stream': np.int64,   # -1 when unknown
+    'version': np.uint16,     # legacy handshake version, 0 when absent
+    'selected_version': np.uint16,  # ServerHello supported_versions, 0 when absent
+    'cipher': np.int32,       # ServerHello chosen suite, -1 when absent
+}
+STRING_COLUMNS = ('uuid', 'ip_src', 'sni', 'alpn', 'ja3', 'ja3s', 'ja3_string', 'ja3s_string', 'ja4', 'ja4s')
+LIST_COLUMNS = ('ciphers', 'extensions', 'groups', 'point_formats', 'versions', 'sig_algs')
+
+# GREASE values (RFC 8701) are ignored by JA3/JA3S
+GREASE = frozenset((b << 8) | b for b in range(0x0a, 0x100, 0x10))
+
+# tshark field -> compact list column
+_LIST_FIELDS = {
+    'tls.handshake.extension.type': 'extensions',
+    'tls.handshake.extensions_supported_group': 'groups',
+    'tls.handshake.extensions_ec_point_format': 'point_formats',
+}
+
+EXT_SERVER_NAME = 0x0000
+EXT_ALPN = 0x0010
+EXT_SIGNATURE_ALGORITHMS = 0x000d
+
+JA4_VERSIONS = {
+    0x0304: '13', 0x0303: '12', 0x0302: '11', 0x0301: '10', 0x0300: 's3',
+    0x0002: 's2', 0xfeff: 'd1', 0xfefd: 'd2', 0xfefc: 'd3',
+}
+
+
+def _int(value):
+    try:
+        return int(str(value), 0)
+    except ValueError:
+        try:
+            return int(str(value), 10)
+        except ValueError:
+            return None
+
+
+def _values(value):
+    return value if isinstance(value, list) else [value]
+
+
+def _collect(obj, found, ext=None):
+    """Gather the fields of one handshake message (stops at nested messages).
+    Fields inside an extension are also stored as '<extension type>/<field>'."""
+    if 'tls.handshake.extension.type' in obj:
+        ext = _int(_values(obj['tls.handshake.extension.type'])[0])
+    for key, value in obj.items():
+        if isinstance(value, dict):
+            if 'tls.handshake.type' not in value:
+                _collect(value, found, ext)
+        elif isinstance(value, list) and value and isinstance(value[0], dict):
+            for v in value:
+                if 'tls.handshake.type' not in v:
+                    _collect(v, found, ext)
+        else:
+            found.setdefault(key, []).extend(_values(value))
+            if ext is not None:
+                found.setdefault(f'{ext}/{key}', []).extend(_values(value))
+
+
+def _handshake_dicts(obj):
+    if isinstance(obj, dict):
+        if 'tls.handshake.type' in obj:
+            yield obj
+        for value in obj.values():
+            yield from _handshake_dicts(value)
+    elif isinstance(obj, list):
+        for value in obj:
+            yield from _handshake_dicts(value)
+
+
+def ja3_string(rec):
+    fields = [
+        [rec['version']],
+        [c for c in rec['ciphers'] if c not in GREASE],
+        [e for e in rec['extensions'] if e not in GREASE],
+        [g for g in rec['groups'] if g not in GREASE],
+        rec['point_formats'],
+    ]
+    return ','.join('-'.join(str(v) for v in f) for f in fields)
+
+
+def ja3s_string(rec):
+    fields = [
+        [rec['version']],
+        [rec['cipher']] if rec['cipher'] >= 0 else [],
+        [e for e in rec['extensions'] if e not in GREASE],
+    ]
+    return ','.join('-'.join(str(v) for v in f) for f in fields)
+
+
+def _sha12(values):
+    if not values:
+        return '000000000000'
+    return hashlib.sha256(','.join(values).encode()).hexdigest()[:12]
+
+
+def _ja4_alpn(alpn):
+    if not alpn or not alpn[0]:
+        return '00'
+    value = alpn[0]
+    if value[0].isalnum() and value[-1].isalnum() and value.isascii():
+        return value[0] + value[-1]
+    hexed = value.encode().hex()
+    return hexed[0] + hexed[-1]
+
+
+def ja4(rec):
+    """JA4 (TCP) fingerprint of a ClientHello record."""
+    versions = [v for v in rec.get('versions', ()) if v not in GREASE]
+    version = JA4_VERSIONS.get(max(versions) if versions else rec['version'], '00')
+    ciphers = [c for c in rec['ciphers'] if c not in GREASE]
+    extensions = [e for e in rec['extensions'] if e not in GREASE]
+    sni = 'd' if EXT_SERVER_NAME in extensions else 'i'
+    a = f"t{version}{sni}{min(len(ciphers), 99):02d}{min(len(extensions), 99):02d}{_ja4_alpn(rec.get('alpn'))}"
+    b = _sha12(sorted(f'{c:04x}' for c in ciphers))
+    exts = sorted(f'{e:04x}' for e in extensions if e not in (EXT_SERVER_NAME, EXT_ALPN))
+    if not exts:
+        c = '000000000000'
+    else:
+        sig_algs = [f'{s:04x}' for s in rec.get('sig_algs', ())]
+        c = _sha12([','.join(exts) + ('_' + ','.join(sig_algs) if sig_algs else '')])
+    return f'{a}_{b}_{c}'
+
+
+def ja4s(rec):
+    """JA4S (TCP) fingerprint of a ServerHello record."""
+    version = JA4_VERSIONS.get(rec['selected_version'] or rec['version'], '00')
+    extensions = rec['extensions']
+    a = f"t{version}{min(len(extensions), 99):02d}{_ja4_alpn(rec.get('alpn'))}"
+    cipher = f"{rec['cipher']:04x}" if rec['cipher'] >= 0 else '0000'
+    return f"{a}_{cipher}_{_sha12([f'{e:04x}' for e in extensions])}"
+
+
+def add_fingerprints(rec):
+    """Fill ja3/ja3s (and their source strings) and ja4/ja4s of a hello record in place."""
+    if rec['type'] == CLIENT_HELLO:
+        rec['ja3_string'] = ja3_string(rec)
+        rec['ja4'] = ja4(rec)
+    elif rec['type'] == SERVER_HELLO:
+        rec['ja3s_string'] = ja3s_string(rec)
+        rec['ja4s'] = ja4s(rec)
+    for name in ('ja3', 'ja3s'):
+        s = rec.get(name + '_string')
+        rec[name] = hashlib.md5(s.encode()).hexdigest() if s else ''
+    return rec
+
+
+def handshake_records(tls_fields):
+    """Compact records for every handshake message in one packet's TLS
+    layer fields (pyshark `use_json=True` layout, as in tls_handshake.json)."""
+    for hs in _handshake_dicts(tls_fields):
+        found = {}
+        _collect(hs, found)
+        hs_type = _int(_values(hs['tls.handshake.type'])[0])
+        if hs_type is None:
+            continue
+        rec = {
+            'type': hs_type,
+            'version': _int(found.get('tls.handshake.version', ['0'])[0]) or 0,
+            'selected_version': 0,
+            'cipher': -1,
+            'ciphers': [],
+            'sni': '',
+        }
+        for field, column in _LIST_FIELDS.items():
+            rec[column] = [v for v in map(_int, found.get(field, [])) if v is not None]
+        rec['sig_algs'] = [v for v in map(_int, found.get(f'{EXT_SIGNATURE_ALGORITHMS}/tls.handshake.sig_hash_alg', []))
+                           if v is not None]
+        rec['alpn'] = [str(v) for v in found.get('tls.handshake.extensions_alpn_str', [])]
+        suites = [v for v in map(_int, found.get('tls.handshake.ciphersuite', [])) if v is not None]
+        if hs_type == CLIENT_HELLO:
+            rec['ciphers'] = suites
+            rec['versions'] = [v for v in map(_int, found.get('tls.handshake.extensions.supported_version', []))
+                               if v is not None]
+            rec['sni'] = str(found.get('tls.handshake.extensions_server_name', [''])[0])
+        elif hs_type == SERVER_HELLO:
+            rec['cipher'] = suites[0] if suites else -1
+            selected = found.get('tls.handshake.extensions.supported_version')
+            if selected:
+                rec['selected_version'] = _int(selected[0]) or 0
+        yield add_fingerprints(rec)
+
+
+def _default(dtype):
+    if np.issubdtype(dtype, np.floating):
+        return np.nan
+    return -1 if np.issubdtype(dtype, np.signedinteger) else 0
+
+
+def _string(value):
+    if isinstance(value, (list, tuple)):
+        return ','.join(value)
+    return str(value or '')
+
+
+class HandshakeTable(object):
+    """Row-wise builder for the columnar table."""
+
+    def __init__(self):
+        self.rows = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def append(self, rec, **extra):
+        row = dict(rec)
+        row.update(extra)
+        self.rows.append(row)
+
+    def to_arrays(self):
+        n = len(self.rows)
+        arrays = {}
+        for name, dtype in SCALAR_COLUMNS.items():
+            arrays[name] = np.fromiter(
+                (_default(dtype) if r.get(name) is None else r[name] for r in self.rows), dtype=dtype, count=n)
+        for name in STRING_COLUMNS:
+            arrays[name] = np.array([_string(r.get(name)) for r in self.rows], dtype=str)
+        for name in LIST_COLUMNS:
+            lengths = np.fromiter((len(r.get(name, ())) for r in self.rows), dtype=np.int64, count=n)
+            offsets = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            arrays[name] = np.fromiter(
+                (v for r in self.rows for v in r.get(name, ())), dtype=np.uint16, count=int(offsets[-1]))
+            arrays[name + '_offsets'] = offsets
+        return arrays
+
+
+def empty():
+    return HandshakeTable().to_arrays()
+
+
+def save(path, arrays):
+    tmp = path + '.part.npz'
+    np.savez_compressed(tmp, **arrays)
+    os.replace(tmp, path)
+    return path
+
+
+def load(path):
+    with np.load(path, allow_pickle=False) as data:
+        table = {name: data[name] for name in data.files}
+    # tables written before a column existed get its default
+    n = len(table['type'])
+    for name, dtype in SCALAR_COLUMNS.items():
+        if name not in table:
+            table[name] = np.full(n, _default(dtype), dtype=dtype)
+    for name in STRING_COLUMNS:
+        if name not in table:
+            table[name] = np.full(n, '', dtype=str)
+    for name in LIST_COLUMNS:
+        if name not in table:
+            table[name] = np.zeros(0, dtype=np.uint16)
+            table[name + '_offsets'] = np.zeros(n + 1, dtype=np.int64)
+    return table
+
+
+def concat(tables):
+    """Concatenate tables row-wise, shifting list offsets."""
+    tables = [t for t in tables if len(t['type'])]
+    if not tables:
+        return empty()
+    out = {}
+    for name in list(SCALAR_COLUMNS) + list(STRING_COLUMNS):
+        out[name] = np.concatenate([t[name] for t in tables])
+    for name in LIST_COLUMNS:
+        out[name] = np.concatenate([t[name] for t in tables])
+        offsets = [np.zeros(1, dtype=np.int64)]
+        base = 0
+        for t in tables:
+            offsets.append(t[name + '_offsets'][1:] + base)
+            base += t[name + '_offsets'][-1]
+        out[name + '_offsets'] = np.concatenate(offsets)
+    return out
+
+
+def explode(table, name):
+    """(row index, value) arrays for one list column."""
+    offsets = table[name + '_offsets']
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    return rows, table[name]
+
+
+def write_run_table(out_dir, uuids):
+    """Concatenate the per-pcap tables of `uuids` into out_dir/RUN_TABLE."""
+    tables = []
+    for uuid in uuids:
+        path = os.path.join(out_dir, uuid, RECORDS_NAME)
+        if os.path.exists(path):
+            tables.append(load(path))
+    return save(os.path.join(out_dir, RUN_TABLE), concat(tables))
+
+
+def table_from_handshake_json(data, uuid):
+    """Build a table from a legacy tls_handshake.json (full pyshark layers)."""
+    table = HandshakeTable()
+    for key in ('client_hello_packets', 'server_hello_packets'):
+        for packet in data.get(key, []):
+            ip_src = (packet.get('IP') or {}).get('ip.src')
+            tcp_stream = (packet.get('TCP') or {}).get('tcp.stream')
+            for layer in packet.get('layers', []):
+                if layer.get('layer_name') not in ('tls', 'ssl'):
+                    continue
+                for rec in handshake_records(layer.get('fields', {})):
+                    if rec['type'] == (CLIENT_HELLO if key == 'client_hello_packets' else SERVER_HELLO):
+                        table.append(rec, uuid=uuid, ip_src=ip_src,
+                                     tcp_stream=_int(tcp_stream) if tcp_stream is not None else -1)
+    return table.to_arrays()